@@ -0,0 +1,345 @@
+"""
+Benchmarks for the tddtags scan, update and save phases over a generated corpus:
+
+    python benchmarks/bench_tddtags.py [--sizes 10,1000] [--mode import|static] [--output FILE]
+    python benchmarks/bench_tddtags.py --compare BASE.json NEW.json
+
+For each size a synthetic project is generated in a temporary directory: a package of source modules
+tagged for a package of test modules that already hold part of the tests, plus the pathological
+cases - a test module without end tokens and one with thousands of classes. Each phase is timed
+on its own:
+
+    compile  CompileTags.compile() for every source module
+    update   ModuleUpdater.update() for every referenced test module (without saving)
+    save     UTModuleContainer.save_module() for every updated test module
+
+The cold run is the first pass in a fresh TDDTagSession with the corpus not imported yet. Warm runs
+repeat the pass in the same session, with the test modules put back as generated first so every
+pass does the same edits. The JSON written can be compared between commits with --compare.
+"""
+import os
+import sys
+import time
+import json
+import random
+import shutil
+import argparse
+import datetime
+import platform
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tddtags import __version__
+from tddtags._core import TDDTagSession, CompileTags, ModuleUpdater, create_end_class_token
+
+SOURCE_PACKAGE = 'benchsrc'
+TEST_PACKAGE = 'benchtests'
+
+
+def letter_name(index):
+    """
+    :returns: A name for index made of lower case letters. Tag values can't hold digits.
+    """
+    name = ''
+    while True:
+        index, remainder = divmod(index, 26)
+        name = chr(ord('a') + remainder) + name
+        if not index:
+            return name
+
+
+class CorpusGenerator(object):
+    """
+    Writes a synthetic project: SOURCE_PACKAGE with the tagged source modules and TEST_PACKAGE with
+    their partly written test modules.
+    """
+    def __init__(self, root_dir, size, classes=3, methods=6, tag_density=0.5, many_classes=2000, seed=0):
+        """
+        :param root_dir: The directory to write the project in
+        :param size: The number of regular source modules
+        :param classes: The number of classes per source module
+        :param methods: The number of methods per class
+        :param tag_density: The fraction of functions and methods with a :unit_test: tag
+        :param many_classes: The number of classes in the pathological many-classes module
+        :param seed: Seed for the tag placement, so a corpus is the same between runs
+        """
+        self.root_dir = root_dir
+        self.size = size
+        self.classes = classes
+        self.methods = methods
+        self.tag_density = tag_density
+        self.many_classes = many_classes
+        self.random = random.Random(seed)
+
+    def generate(self):
+        """
+        :returns: The list of source module names
+        """
+        for package in (SOURCE_PACKAGE, TEST_PACKAGE):
+            os.makedirs(os.path.join(self.root_dir, package))
+            self._write(os.path.join(package, '__init__.py'), [])
+
+        names = ['mod_%s' % letter_name(index) for index in xrange(self.size)]
+        for name in names:
+            self.write_module(name, class_count=self.classes, end_tokens=True)
+        self.write_module('path_no_end_tokens', class_count=self.classes, end_tokens=False)
+        self.write_module('path_many_classes', class_count=self.many_classes, end_tokens=True)
+        names.extend(['path_no_end_tokens', 'path_many_classes'])
+
+        return ['%s.%s' % (SOURCE_PACKAGE, name) for name in names]
+
+    def write_module(self, name, class_count, end_tokens):
+        """
+        Writes a source module and its test module. The test module has every other test class, and
+        those have every other test method, so the update has both classes and methods to add.
+        """
+        source = [
+            '"""',
+            'Generated for the tddtags benchmarks',
+            ':unit_test_module: %s.test_%s' % (TEST_PACKAGE, name),
+            ':unit_test_class: GlobalTests',
+            '"""',
+            '',
+            '',
+            'def helper(value):',
+            '    """',
+            '    :unit_test:',
+            '    """',
+            '    return value',
+        ]
+        tests = ['import unittest', '']
+
+        for class_index in xrange(class_count):
+            class_name = 'Class' + letter_name(class_index).capitalize()
+            source.extend([
+                '',
+                '',
+                'class %s(object):' % class_name,
+                '    """',
+                '    A generated class',
+                '    :unit_test_class: %sTests' % class_name,
+                '    """',
+            ])
+            tagged = []
+            for method_index in xrange(self.methods):
+                method_name = 'method_%s' % letter_name(method_index)
+                source.extend(['', '    def %s(self):' % method_name, '        """'])
+                source.append('        Does the generated thing')
+                if self.random.random() < self.tag_density:
+                    source.append('        :unit_test: %s Verify %s' % (method_name, method_name))
+                    tagged.append(method_name)
+                source.extend(['        """', '        return %d' % method_index])
+
+            if class_index % 2 == 0:
+                tests.extend(['', 'class %sTests(unittest.TestCase):' % class_name])
+                for method_name in tagged[::2]:
+                    tests.extend(['    def test_%s(self):' % method_name, '        pass', ''])
+                if not tagged[::2]:
+                    tests.append('    pass')
+                if end_tokens:
+                    tests.extend(['', '    # -- %s ---' % create_end_class_token('%sTests' % class_name)])
+                tests.append('')
+
+        self._write(os.path.join(SOURCE_PACKAGE, name + '.py'), source)
+        self._write(os.path.join(TEST_PACKAGE, 'test_%s.py' % name), tests)
+
+    def _write(self, rel_path, lines):
+        with open(os.path.join(self.root_dir, rel_path), 'w') as out_file:
+            out_file.write('\n'.join(lines) + '\n')
+
+
+class PhaseTimer(object):
+    """
+    Runs the compile, update and save phases over a generated corpus and times each of them.
+    """
+    def __init__(self, root_dir, module_names, config=None, repeat=3):
+        """
+        :param config: The config overrides for the sessions the passes run in
+        """
+        self.root_dir = root_dir
+        self.module_names = module_names
+        self.config = dict(config or {}, save=False)  # ModuleUpdater doesn't save; the save phase is timed by itself
+        self.repeat = repeat
+        self.session = None
+        self.pristine_dir = os.path.join(root_dir, '.pristine')
+        shutil.copytree(os.path.join(root_dir, TEST_PACKAGE), self.pristine_dir)
+
+    def reset_state(self):
+        """
+        Drops everything a previous pass left behind - the imported corpus modules, and the session with
+        its keyword memo and compiled model - and puts the test modules back as generated.
+        """
+        for name in list(sys.modules):
+            if name.split('.')[0] in (SOURCE_PACKAGE, TEST_PACKAGE):
+                del sys.modules[name]
+        self.session = TDDTagSession(anchor_dir=self.root_dir, config=self.config)
+
+        test_dir = os.path.join(self.root_dir, TEST_PACKAGE)
+        shutil.rmtree(test_dir)
+        shutil.copytree(self.pristine_dir, test_dir)
+
+    def time_compile(self):
+        self.session.test_module_details.clear()
+        start = time.time()
+        for name in self.module_names:
+            CompileTags(source_module_name=name, session=self.session).compile()
+        return time.time() - start
+
+    def time_update(self):
+        """
+        :returns: The seconds taken, and the updated containers by path
+        """
+        containers = {}
+        start = time.time()
+        for name, ut_module in self.session.test_module_details.items():
+            module_path = self.session.module_loader.find_source(name)
+            updater = ModuleUpdater(ut_module=ut_module, session=self.session)
+            updater.update(module_path=module_path)
+            containers[module_path] = updater.container
+        return time.time() - start, containers
+
+    def time_save(self, containers):
+        start = time.time()
+        for path, container in containers.items():
+            container.dirty_flag = True
+            container.save_module(path)
+        return time.time() - start
+
+    def run(self):
+        """
+        :returns: Dictionary of phase -> {'cold': seconds, 'warm': [seconds, ...], 'warm_min': seconds}
+        """
+        self.reset_state()
+        timings = dict((phase, {'warm': []}) for phase in ('compile', 'update', 'save'))
+
+        for run in xrange(self.repeat + 1):
+            key = 'cold' if run == 0 else 'warm'
+            compile_time = self.time_compile()
+            update_time, containers = self.time_update()
+            save_time = self.time_save(containers)
+            for phase, seconds in (('compile', compile_time), ('update', update_time), ('save', save_time)):
+                if key == 'cold':
+                    timings[phase]['cold'] = seconds
+                else:
+                    timings[phase]['warm'].append(seconds)
+            # --> The next pass starts from the generated test modules again
+            if run < self.repeat:
+                self.restore_tests()
+
+        for phase in timings.values():
+            phase['warm_min'] = min(phase['warm']) if phase['warm'] else None
+        return timings
+
+    def restore_tests(self):
+        test_dir = os.path.join(self.root_dir, TEST_PACKAGE)
+        for name in os.listdir(self.pristine_dir):
+            shutil.copy2(os.path.join(self.pristine_dir, name), os.path.join(test_dir, name))
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args):
+    config = {'verbose': False, 'compile_mode': args.mode}
+    results = {
+        'meta': {
+            'version': __version__,
+            'commit': get_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': datetime.datetime.utcnow().isoformat(),
+            'mode': args.mode,
+            'repeat': args.repeat,
+            'classes': args.classes,
+            'methods': args.methods,
+            'tag_density': args.tag_density,
+            'many_classes': args.many_classes,
+        },
+        'sizes': {},
+    }
+
+    for size in [int(size) for size in args.sizes.split(',')]:
+        root_dir = tempfile.mkdtemp(prefix='tddtags_bench_')
+        try:
+            generator = CorpusGenerator(root_dir=root_dir, size=size, classes=args.classes, methods=args.methods,
+                                        tag_density=args.tag_density, many_classes=args.many_classes)
+            module_names = generator.generate()
+            timer = PhaseTimer(root_dir=root_dir, module_names=module_names, config=config, repeat=args.repeat)
+            timings = timer.run()
+            results['sizes'][str(size)] = {
+                'modules': len(module_names),
+                'test_modules': len(timer.session.test_module_details),
+                'phases': timings,
+            }
+            print >> sys.stderr, '%6d modules: %s' % (size, ', '.join(
+                '%s %.3fs cold / %.3fs warm' % (phase, timings[phase]['cold'], timings[phase]['warm_min'] or 0)
+                for phase in ('compile', 'update', 'save')))
+        finally:
+            if root_dir in sys.path:
+                sys.path.remove(root_dir)
+            shutil.rmtree(root_dir)
+
+    return results
+
+
+def compare_results(base, new):
+    """
+    :returns: Lines comparing each size and phase, new/base as a ratio (< 1.0 is faster)
+    """
+    lines = ['%-8s %-8s %-5s %10s %10s %7s' % ('size', 'phase', 'run', 'base', 'new', 'ratio')]
+    for size in sorted(set(base['sizes']) & set(new['sizes']), key=int):
+        for phase in ('compile', 'update', 'save'):
+            for run, key in (('cold', 'cold'), ('warm', 'warm_min')):
+                base_time = base['sizes'][size]['phases'][phase][key]
+                new_time = new['sizes'][size]['phases'][phase][key]
+                if base_time is None or new_time is None:
+                    continue
+                ratio = new_time / base_time if base_time else float('inf')
+                lines.append('%-8s %-8s %-5s %10.4f %10.4f %7.2f' % (size, phase, run, base_time, new_time, ratio))
+    return lines
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the tddtags compile, update and save phases')
+    parser.add_argument('--sizes', default='10,1000', help='Comma separated corpus sizes, in source modules. Default is 10,1000.')
+    parser.add_argument('--mode', choices=[CompileTags.MODE_IMPORT, CompileTags.MODE_STATIC], default=CompileTags.MODE_IMPORT,
+                        help='The compile mode. Default is import.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of warm runs. Default is 3.')
+    parser.add_argument('--classes', type=int, default=3, help='Classes per source module. Default is 3.')
+    parser.add_argument('--methods', type=int, default=6, help='Methods per class. Default is 6.')
+    parser.add_argument('--tag-density', type=float, default=0.5, help='Fraction of methods with a :unit_test: tag. Default is 0.5.')
+    parser.add_argument('--many-classes', type=int, default=2000, help='Classes in the pathological many-classes module. Default is 2000.')
+    parser.add_argument('-o', '--output', help='File to write the JSON results to. Default is stdout.')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='Compare two JSON result files instead of running')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as base_file, open(args.compare[1]) as new_file:
+            print '\n'.join(compare_results(json.load(base_file), json.load(new_file)))
+        return 0
+
+    # --> stdout carries the JSON, so anything printed while running goes to stderr
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        results = run_benchmarks(args)
+    finally:
+        sys.stdout = stdout
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as out_file:
+            out_file.write(text + '\n')
+    else:
+        print text
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -37,6 +37,9 @@ setup(
                  'tddtags'},
     include_package_data=True,
     install_requires=requirements,
+    entry_points={
+        'pytest11': ['tddtags = tddtags.pytest_plugin'],
+    },
     license="MIT",
     zip_safe=False,
     keywords='tddtags',
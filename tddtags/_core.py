@@ -8,14 +8,43 @@ Core for tddtags module.
 """
 import os
 import sys
+import time
 import argparse
 import inspect
 import re
+import ast
+import fnmatch
+import glob
 import StringIO
 import importlib
-
+import multiprocessing
+import hashlib
+import json
+import tempfile
+import bisect
+import collections
+import threading
+import __builtin__
+
+from tddtags import __version__
+from tddtags.stats import RunStats, retained_size
+from tddtags import hooks
+from tddtags.hooks import EventHooks
+
+# --> The state of the global session (see TDDTagSession), for callers that don't make their own
 _test_module_details = {}
 _module_loader = None
+_run_stats = RunStats()
+_memory_profiler = None  # A stats.MemoryProfiler when --memprofile is on
+_event_hooks = EventHooks()
+_keyword_memo = {}
+
+# --> Read once: setting the umask to read it is process-wide, and would race with other threads' files
+_umask = os.umask(0)
+os.umask(_umask)
+
+# --> Held while _timed_import() has __import__ wrapped, so two loaders can't wrap and unwrap out of order
+_import_hook_lock = threading.Lock()
 
 # --> The config defaults; overwrite within a setup.cfg file in a section [tddtag].
 # TODO: Add ConfigParser support for tddtags_config from setup.cfg
@@ -36,6 +65,8 @@ tddtags_config = {
     'verbose': False,
     'save': True,
     'save_to_name': None,
+    'compile_mode': 'import',  # 'import', 'static' or 'static_only' - see CompileTags.MODE_*
+    'cache_dir': None,  # Directory for the TagCache, relative to the anchor dir. None disables the cache.
 }
 
 
@@ -76,6 +107,50 @@ def create_end_class_token(class_name):
     return 'TDDTag: /' + class_name
 
 
+def get_stub_lines(body):
+    """
+    :param body: The test_method_body config string
+    :returns: Its statement lines, stripped, to compare a method's body against
+    :unit_test:
+    """
+    return [line.strip() for line in body.splitlines() if line.strip()]
+
+
+class ImportCost(object):
+    """
+    What importing a scanned module cost: the wall time, the count of sys.modules entries the import
+    added, and the slowest of the imports it made along the way.
+    :unit_test_class: ImportCostTests
+    """
+    nested_limit = 5  # The number of nested imports kept
+
+    def __init__(self, name, seconds, added, nested=None):
+        """
+        :param name: The [package.]module imported
+        :param seconds: The wall time the import took
+        :param added: The count of modules added to sys.modules (not counting the None entries Python 2 leaves
+                      for failed implicit relative imports)
+        :param nested: Dictionary of nested import name -> seconds, for the imports that loaded something
+        :unit_test: create_instance
+        """
+        self.name = name
+        self.seconds = seconds
+        self.added = added
+        nested = nested or {}
+        self.nested = sorted(nested.items(), key=lambda item: (-item[1], item[0]))[:self.nested_limit]
+
+    def to_dict(self):
+        """
+        :unit_test:
+        """
+        return {'name': self.name, 'seconds': self.seconds, 'added': self.added,
+                'nested': [{'name': name, 'seconds': seconds} for name, seconds in self.nested]}
+
+    def __str__(self):
+        return '%-40s %9.3f %7d  %s' % (self.name, self.seconds, self.added,
+                                        ', '.join('%s %.3f' % (name, seconds) for name, seconds in self.nested))
+
+
 class ModuleLoader(object):
     """
     Light wrapper around importlib.
@@ -94,27 +169,262 @@ class ModuleLoader(object):
         if not os.path.exists(anchor_dir):
             raise Exception('Anchor dir does not exist: %s' % anchor_dir)
 
+        self.anchor_dir = anchor_dir
+
+        # --> With track_imports set, load_module() records an ImportCost for each module it imports
+        self.track_imports = False
+        self.import_costs = {}
+
         # Pop this anchor directory into our path
         print 'Adding %s to sys.path' % anchor_dir
         if anchor_dir not in sys.path:
             sys.path.append(anchor_dir)
 
-    def load_module(self, name):
+    def load_module(self, name, session=None):
         """
         Loads the module by name
         :param name: The name, [package.]module, to load.
-        :return: Module, or None if ImportError
+        :param session: The TDDTagSession to report to. Default is the global session.
+        :return: Module, or None if the import failed - whatever the module raised, or if it exits on import
+                 the way a setup.py does
         :unit_test:
         :unit_test: load_module_name_unknown
         :unit_test: load_module_diff_anchor
+        :unit_test: load_module_track_imports
+        :unit_test: load_module_count_imported
         """
+        session = get_session(session)
         try:
-            mod = importlib.import_module(name)
+            start = time.time()
+            imported = name not in sys.modules  # Not counted when the import only looks it up
+            with session.run_stats.phase('load'):
+                if self.track_imports and imported:
+                    mod = self._timed_import(name)
+                else:
+                    mod = importlib.import_module(name)
+            if imported:
+                session.run_stats.count('modules_imported')
+            if session.event_hooks:
+                session.event_hooks.fire(hooks.MODULE_LOADED, name=name, path=getattr(mod, '__file__', None),
+                                         seconds=time.time() - start, static=False)
             return mod
-        except ImportError as ex:
-            print '- Failed to load module: %s. -> %s' % (name, ex.message)
+        except (Exception, SystemExit) as ex:
+            print '- Failed to load module: %s. -> %s: %s' % (name, type(ex).__name__, ex)
             return None
 
+    def _timed_import(self, name):
+        """
+        Imports the module with __import__ wrapped, timing each nested import that loads a new module.
+        The nested times are inclusive - an import's time includes the imports it makes. Imports made
+        by other threads meanwhile pass straight through.
+        """
+        with _import_hook_lock:
+            return self._timed_import_locked(name)
+
+    def _timed_import_locked(self, name):
+        before = set(sys.modules)
+        nested = {}
+        original_import = __builtin__.__import__
+        owner = threading.current_thread()
+
+        def timed_import(import_name, globals=None, locals=None, fromlist=None, level=-1):
+            if threading.current_thread() is not owner:
+                return original_import(import_name, globals, locals, fromlist, level)
+            module_cnt = len(sys.modules)
+            start = time.time()
+            try:
+                return original_import(import_name, globals, locals, fromlist, level)
+            finally:
+                if len(sys.modules) > module_cnt:
+                    full_name = ModuleLoader._resolve_import_name(import_name, globals, level)
+                    if full_name and fromlist:
+                        # --> 'from package import module' is charged to the modules it loaded
+                        loaded = ['%s.%s' % (full_name, item) for item in fromlist if item != '*']
+                        loaded = [loaded_name for loaded_name in loaded if sys.modules.get(loaded_name) is not None
+                                  and loaded_name not in before]
+                        if loaded:
+                            full_name = ', '.join(loaded)
+                    if full_name and full_name != name and full_name not in before:
+                        nested[full_name] = nested.get(full_name, 0.0) + time.time() - start
+
+        __builtin__.__import__ = timed_import
+        start = time.time()
+        try:
+            mod = importlib.import_module(name)
+        finally:
+            __builtin__.__import__ = original_import
+            seconds = time.time() - start
+            added = [added_name for added_name in set(sys.modules) - before if sys.modules[added_name] is not None]
+            self.import_costs[name] = ImportCost(name=name, seconds=seconds, added=len(added), nested=nested)
+        return mod
+
+    @staticmethod
+    def _resolve_import_name(import_name, globals, level):
+        """
+        :returns: The full name of the module an __import__() call loaded - relative (or Python 2 implicit
+                  relative) to the importing module's package if that's what was found - or None
+        """
+        candidates = [import_name] if import_name else []
+        if globals and level != 0:
+            package = globals.get('__package__') or globals.get('__name__') or ''
+            if not globals.get('__package__') and '__path__' not in globals:
+                package = package.rpartition('.')[0]  # The importer is a module, not a package
+            if level > 1:
+                package = package.rsplit('.', level - 1)[0]
+            if package:
+                candidates.insert(0, '%s.%s' % (package, import_name) if import_name else package)
+
+        for candidate in candidates:
+            if sys.modules.get(candidate) is not None:
+                return candidate
+        return None
+
+    def get_import_costs(self, top=None):
+        """
+        :param top: The number of costs to return, or None for all
+        :returns: The ImportCosts recorded, most expensive first
+        :unit_test:
+        """
+        costs = sorted(self.import_costs.values(), key=lambda cost: (-cost.seconds, cost.name))
+        return costs[:top] if top else costs
+
+    def format_import_report(self, top=None):
+        """
+        :param top: The number of modules to report, or None for all
+        :returns: The report of the most expensive imports, as a list of lines
+        :unit_test:
+        """
+        lines = ['%-40s %9s %7s  %s' % ('module', 'seconds', 'added', 'slowest nested imports')]
+        lines.extend(str(cost) for cost in self.get_import_costs(top=top))
+        return lines
+
+    def unload_module(self, name):
+        """
+        Drops a module from sys.modules so the next load_module() imports it fresh - for when
+        its source has changed since it was loaded.
+        :param name: The name, [package.]module, to unload.
+        :unit_test:
+        """
+        sys.modules.pop(name, None)
+
+    def find_source(self, name):
+        """
+        Locates the source file for a module without importing it. Packages resolve to their
+        __init__.py, and the search follows sys.path in the same order the import would.
+        :param name: The name, [package.]module, to find. A path to a .py file is also accepted.
+        :return: The path to the module's source file, or None if not found
+        :unit_test: find_source
+        :unit_test: find_source_name_unknown
+        :unit_test: find_source_path
+        """
+        if name.endswith('.py') and os.path.isfile(name):
+            return os.path.abspath(name)
+
+        parts = name.split('.')
+        for path in sys.path:
+            base = os.path.join(path or os.getcwd(), *parts)
+            for candidate in (os.path.join(base, '__init__.py'), base + '.py'):
+                if os.path.isfile(candidate):
+                    return os.path.abspath(candidate)
+        return None
+
+    def find_module_names(self, target, excludes=None):
+        """
+        Expands a scan target into the [package.]module names it covers. The target can be a module,
+        a package (walked recursively), a directory tree, a .py file, or a shell-style glob of paths.
+        :param target: The target to expand
+        :param excludes: Optional list of fnmatch patterns. Files and directories matching one are skipped.
+        :return: The list of module names. A name that isn't found is returned as-is, for the load to report.
+        :unit_test: find_module_names
+        :unit_test: find_module_names_package
+        :unit_test: find_module_names_glob
+        :unit_test: find_module_names_excludes
+        """
+        excludes = excludes or []
+        if re.search(r'[*?[]', target):
+            names = []
+            for path in sorted(glob.glob(target)):
+                names.extend(self.find_module_names(path, excludes=excludes))
+            return names
+
+        if os.path.isdir(target):
+            return self._walk_module_names(target, excludes)
+
+        if target.endswith('.py') and os.path.isfile(target):
+            return [self.module_name_for_path(target)]
+
+        source = self.find_source(target)
+        if source and os.path.basename(source) == '__init__.py':
+            return self._walk_module_names(os.path.dirname(source), excludes)
+        return [target]
+
+    def _walk_module_names(self, top_dir, excludes):
+        return [self.module_name_for_path(path) for path in ModuleLoader.find_source_files(top_dir, excludes)]
+
+    @staticmethod
+    def find_source_files(top_dir, excludes=None):
+        """
+        Walks a directory tree for the .py files in it, in a stable (sorted) order. Hidden and
+        __pycache__ directories are skipped.
+        :param top_dir: The directory to walk
+        :param excludes: Optional list of fnmatch patterns, matched against the name and the path relative to top_dir
+        :return: The list of file paths
+        :unit_test: find_source_files
+        """
+        excludes = excludes or []
+
+        def excluded(path, name):
+            rel_path = os.path.relpath(path, top_dir)
+            return [pattern for pattern in excludes if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(rel_path, pattern)]
+
+        paths = []
+        for path, dir_names, file_names in os.walk(top_dir):
+            # --> Prune in place so os.walk() skips them
+            dir_names[:] = sorted(name for name in dir_names if not name.startswith('.') and name != '__pycache__'
+                                  and not excluded(os.path.join(path, name), name))
+            for name in sorted(file_names):
+                file_path = os.path.join(path, name)
+                if name.endswith('.py') and not excluded(file_path, name):
+                    paths.append(file_path)
+        return paths
+
+    @staticmethod
+    def is_excluded(path, top_dir, excludes):
+        """
+        Matches a file against exclude patterns the way find_source_files() does when it walks top_dir:
+        the file, or any directory between top_dir and it, matching by name or by path relative to top_dir.
+        :param path: The file path
+        :param top_dir: The directory the relative paths are taken from
+        :param excludes: The list of fnmatch patterns
+        :return: True if excluded
+        :unit_test: is_excluded
+        """
+        parts = os.path.relpath(path, top_dir).split(os.sep)
+        for index, name in enumerate(parts):
+            rel_path = os.sep.join(parts[:index + 1])
+            if [pattern for pattern in excludes if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(rel_path, pattern)]:
+                return True
+        return False
+
+    @staticmethod
+    def module_name_for_path(path):
+        """
+        Works out the [package.]module name of a source file by walking up through the
+        directories that hold an __init__.py.
+        :param path: The path to the .py file
+        :return: The module name. A package's __init__.py gives the package name.
+        :unit_test: module_name_for_path
+        """
+        directory, name = os.path.split(os.path.abspath(path))
+        parts = [os.path.splitext(name)[0]]
+        if parts[0] == '__init__':
+            parts = []
+
+        while os.path.isfile(os.path.join(directory, '__init__.py')):
+            directory, package = os.path.split(directory)
+            parts.insert(0, package)
+        return '.'.join(parts)
+
 
 class UTClassDetails(object):
     """
@@ -192,8 +502,11 @@ class Formatter(object):
     The strings for this are stored in the 'tddtags_config' dictionary.
     :unit_test_class: FormatterTests
     """
-    def __init(self):
-        pass
+    def __init__(self, config=None):
+        """
+        :param config: The config to take the strings from. Default is tddtags_config.
+        """
+        self.config = config if config is not None else tddtags_config
 
     def gen_test_module_header(self, out_file, module_name):
         """
@@ -203,8 +516,8 @@ class Formatter(object):
         :param module_name: The name of the module
         :unit_test: module_header
         """
-        out_file.write('""" %s - %s """\n\n' % (module_name, tddtags_config['module_header_text']))
-        out_file.write('%s\n' % tddtags_config['module_unit_test_import_line'])
+        out_file.write('""" %s - %s """\n\n' % (module_name, self.config['module_header_text']))
+        out_file.write('%s\n' % self.config['module_unit_test_import_line'])
 
     def gen_class_def(self, out_file, class_name, description='', parent_name='TestCase'):
         """
@@ -221,16 +534,16 @@ class Formatter(object):
         out_file.write('    """\n')
         if class_description:
             out_file.write('    %s\n' % class_description)
-        out_file.write('    %s\n' % tddtags_config['class_tddtag_line'])
+        out_file.write('    %s\n' % self.config['class_tddtag_line'])
         out_file.write('    """\n')
-        if tddtags_config['generate_setup_method']:
-            out_file.write('    %s\n' % tddtags_config['setup_method_def'])
-            body = tddtags_config['setup_method_body'] % class_name
+        if self.config['generate_setup_method']:
+            out_file.write('    %s\n' % self.config['setup_method_def'])
+            body = self.config['setup_method_body'] % class_name
             out_file.write('        %s\n' % body)
 
-        if tddtags_config['generate_teardown_method']:
-            out_file.write('\n    %s\n' % tddtags_config['teardown_method_def'])
-            body = tddtags_config['teardown_method_body'] % class_name
+        if self.config['generate_teardown_method']:
+            out_file.write('\n    %s\n' % self.config['teardown_method_def'])
+            body = self.config['teardown_method_body'] % class_name
             out_file.write('        %s\n' % body)
         else:
             out_file.write('    pass\n')
@@ -263,34 +576,166 @@ class Formatter(object):
             full_name = 'test_%s' % full_name
 
         out_file.write('\n    def %s(self):\n' % full_name)
-        out_file.write("        %s\n" % tddtags_config['test_method_body'])
+        out_file.write("        %s\n" % self.config['test_method_body'])
 
 
 # Redefine this to replace the default formatter class
 default_formatter = Formatter()
 
 
+class ClassSpan(object):
+    """
+    Where a class sits within a test module's lines. The positions are 0 based line indexes into the lines
+    as they were last indexed (before any pending insertions), -1 if not found.
+    :unit_test_class: ClassSpanTests
+    """
+    def __init__(self, class_name, def_line):
+        """
+        :unit_test: create_instance
+        """
+        self.class_name = class_name
+        self.def_line = def_line
+        self.end_token_line = -1
+        self.end_token_pending = False  # True if the end token is a pending insertion at end_token_line
+        self.last_method_line = -1
+        self.method_names = set()  # The names of the methods defined in the class body
+        self.method_lines = {}  # Method name -> the line it's defined on. If it's defined twice, the later one.
+
+    def __str__(self):
+        return 'Class: %s, def: %d, end token: %d, last method: %d' % (self.class_name, self.def_line, self.end_token_line, self.last_method_line)
+
+
 class UTModuleContainer(object):
     """
     Loads and contains the module lines of text for updating and saving
     :unit_test_class: ModuleContainerTests
     """
-    def __init__(self, module_path):
+    re_any_class_line = re.compile(r'^class[ ]+([a-zA-Z0-9_]+)[ ]*[(:]')
+    re_method_line = re.compile(r'^    def[ ]+([a-zA-Z0-9_]+)[ ]*\(')
+    end_token_prefix = create_end_class_token('')
+    re_end_token = re.compile(re.escape(end_token_prefix) + r'([a-zA-Z0-9_]+)')
+
+    def __init__(self, module_path, session=None, lines=None):
         """
         :param module_path: The path to the module source file to load
+        :param session: The TDDTagSession to work in. Default is the global session.
+        :param lines: The module's lines, e.g. from an editor's unsaved buffer. Default is to read the file.
         :raises: IOError
         :unit_test: create_instance
+        :unit_test: create_instance_lines
         :unit_test: create_invalid_path "Verify that we handle an invalid path with IOError"
         """
+        self.session = get_session(session)
+
         # Find the path to the modules's source
         self.module_path = self._get_source_filename(module_path=module_path)
 
-        if tddtags_config['verbose']:
+        if self.session.config['verbose']:
             print '--> module source: %s' % self.module_path
 
-        self.lines = UTModuleContainer.load_module_lines(module_path=self.module_path)
+        self.pending = {}  # Line index -> lines to insert before it. Applied in one pass by _apply_pending().
+        if lines is None:
+            with self.session.run_stats.phase('load'):
+                lines = UTModuleContainer.load_module_lines(module_path=self.module_path)
+        self.lines = lines
         self.dirty_flag = False  # True if the module lines are changed
 
+    @property
+    def lines(self):
+        """
+        The module's lines, with any pending insertions applied.
+        """
+        if self.pending:
+            self._apply_pending()
+        return self._lines
+
+    @lines.setter
+    def lines(self, lines):
+        self._lines = lines
+        self.pending = {}
+
+        # --> Where each class is, so finding the end of a class doesn't rescan the lines
+        self.class_spans = {}
+        self.class_def_lines = []  # Sorted line indexes of every class definition
+        self._index_lines()
+
+    def _apply_pending(self):
+        """
+        Splices all of the pending insertions into the lines in a single pass, then re-indexes the
+        classes. The cost is the size of the module plus the lines inserted, however many
+        insertions there were.
+        :unit_test: apply_pending
+        """
+        lines = []
+        start = 0
+        for index in sorted(self.pending):
+            lines.extend(self._lines[start:index])
+            lines.extend(self.pending[index])
+            start = index
+        lines.extend(self._lines[start:])
+        self.lines = lines
+
+    def _insert_lines(self, index, lines):
+        """
+        Queues lines to insert before the line at index. Lines queued at the same index keep
+        the order they were queued in.
+        """
+        self.pending.setdefault(index, []).extend(lines)
+        self.session.run_stats.count('lines_inserted', len(lines))
+
+    def _current_line(self, index, pending=False):
+        """
+        :returns: Where the line at index ends up once the pending insertions are applied. If pending, the
+                  index is that of a pending insertion rather than an existing line.
+        """
+        offset = 0
+        for pending_index, lines in self.pending.items():
+            if pending_index < index or (pending_index == index and not pending):
+                offset += len(lines)
+        return index + offset
+
+    def _index_lines(self, start=0):
+        """
+        Indexes the class definitions, methods and end tokens in a single pass over the lines from
+        start on. If a class is defined twice the later one wins, and the first end token for a class
+        is the one used.
+        :param start: The line to start from. Anything before it must already be indexed.
+        :unit_test: index_lines
+        :unit_test: index_lines_appended
+        """
+        span = None
+        for index in xrange(start, len(self._lines)):
+            line = self._lines[index]
+            if not line.startswith(' '):
+                m = self.re_any_class_line.match(line)
+                if m:
+                    span = ClassSpan(class_name=m.group(1), def_line=index)
+                    self.class_spans[span.class_name] = span
+                    self.class_def_lines.append(index)
+                    continue
+                if line.strip() and not line.startswith('#'):
+                    span = None  # Top level code ends the class
+                    continue
+
+            if self.end_token_prefix in line:
+                m = self.re_end_token.search(line)
+                token_span = self.class_spans.get(m.group(1)) if m else None
+                if token_span and token_span.end_token_line == -1:
+                    token_span.end_token_line = index
+            elif span and line.startswith('    def'):
+                m = self.re_method_line.match(line)
+                if m:
+                    span.last_method_line = index
+                    span.method_names.add(m.group(1))
+                    span.method_lines[m.group(1)] = index
+
+    def _next_class_line(self, def_line):
+        """
+        :returns: The line of the first class definition after def_line, -1 if none
+        """
+        index = bisect.bisect_right(self.class_def_lines, def_line)
+        return self.class_def_lines[index] if index < len(self.class_def_lines) else -1
+
     def _get_source_filename(self, module_path):
         """
         Since the module path might point to the pyc, pyo or PEP 0488 name pattern as found in:
@@ -326,8 +771,8 @@ class UTModuleContainer(object):
         :param method_name: The test method to add
         :unit_test:
         """
-        class_def_line, end_token_line = self._find_class_end(class_name=class_name)
-        if end_token_line == -1:
+        span = self._get_class_end(class_name=class_name)
+        if not span or span.end_token_line == -1:
             print 'Warning: Failed to find/recreate class end token: %s' % class_name
             # print 'Lines cnt: %d' % len(self.lines)
             # print 'Module path: %s' % self.module_path
@@ -335,56 +780,208 @@ class UTModuleContainer(object):
 
         # Write the new test method to a string with the formatter
         output = StringIO.StringIO()
-        default_formatter.gen_unittest_method(out_file=output, method_name=method_name)
+        with self.session.run_stats.phase('format'):
+            self.session.formatter.gen_unittest_method(out_file=output, method_name=method_name)
         lines = output.getvalue().splitlines(True)
         if not lines:
             print 'Warning: No test method lines returned by the formatter for %s' % method_name
             return False
 
-        # And insert the lines into the module's lines
-        end_token_line -= 1
-        for offset, line in enumerate(lines):
-            self.lines.insert(end_token_line, line)
-            end_token_line += 1
+        # And queue the lines to go in before the line preceding the end token
+        self._insert_lines(span.end_token_line - 1, lines)
+        if self.session.event_hooks:
+            self.session.event_hooks.fire(hooks.TEST_METHOD_INSERTED, module_path=self.module_path, class_name=class_name,
+                                          method_name=method_name, lines=len(lines))
 
         self.dirty_flag = True
         return True
 
+    def get_generated_methods(self, class_name):
+        """
+        :returns: The sorted names of the test methods between the class definition and its end token - the
+                  ones tddtags generates. A class without an end token has none.
+        :unit_test: get_generated_methods
+        """
+        span = self.class_spans.get(class_name)
+        if not span or span.end_token_line == -1 or span.end_token_pending:
+            return []
+        return sorted(name for name, index in span.method_lines.items()
+                      if name.startswith('test_') and index < span.end_token_line)
+
+    def _read_method(self, def_line):
+        """
+        :param def_line: The line the method is defined on
+        :returns: (the line after the last line of the method's body, the body's statement lines stripped). Blank
+                  and comment lines aren't statements, and blank lines after the body aren't part of it.
+        """
+        end = def_line + 1
+        body = []
+        for index in xrange(def_line + 1, len(self._lines)):
+            stripped = self._lines[index].strip()
+            if not stripped:
+                continue
+            if not self._lines[index].startswith('        '):
+                break
+            end = index + 1
+            if not stripped.startswith('#'):
+                body.append(stripped)
+        return end, body
+
+    def is_stub_method(self, class_name, method_name):
+        """
+        :returns: True if the method's body is still just the configured test_method_body
+        :unit_test: is_stub_method
+        """
+        lines = self.lines  # --> With any pending insertions applied, so the spans are current
+        span = self.class_spans.get(class_name)
+        if not span or method_name not in span.method_lines or not lines:
+            return False
+        end, body = self._read_method(span.method_lines[method_name])
+        return body == get_stub_lines(self.session.config['test_method_body'])
+
+    def remove_class_method(self, class_name, method_name):
+        """
+        Removes a method from a class, with the blank lines before it.
+        :param class_name: The class
+        :param method_name: The method to remove
+        :returns: True if it was removed, False if the class doesn't have it
+        :unit_test: remove_class_method
+        """
+        return bool(self.remove_class_methods([(class_name, method_name)]))
+
+    def remove_class_methods(self, methods):
+        """
+        Removes methods from their classes, each with the blank lines before it. The lines are rebuilt and
+        re-indexed once, however many methods there are.
+        :param methods: List of (class name, method name)
+        :returns: The list of the (class name, method name) removed, in line order - the ones the classes had
+        :unit_test: remove_class_methods
+        """
+        lines = self.lines
+        cuts = {}  # First line removed -> (the line after the last one removed, class span, method name)
+        for class_name, method_name in methods:
+            span = self.class_spans.get(class_name)
+            if not span or method_name not in span.method_lines:
+                continue
+            start = span.method_lines[method_name]
+            end, body = self._read_method(start)
+            while start > 0 and not lines[start - 1].strip():
+                start -= 1
+            cuts[start] = (end, span, method_name)
+        if not cuts:
+            return []
+
+        kept = []
+        removed = []
+        fillers = {}  # Class name -> (index in kept of its class definition, of its first cut)
+        position = 0
+        for start in sorted(cuts):
+            end, span, method_name = cuts[start]
+            kept.extend(lines[position:start])
+            position = end
+            if span.class_name not in fillers:
+                fillers[span.class_name] = (span.def_line - (start - len(kept)), len(kept))
+            removed.append((span.class_name, method_name))
+            if self.session.event_hooks:
+                self.session.event_hooks.fire(hooks.TEST_METHOD_REMOVED, module_path=self.module_path,
+                                              class_name=span.class_name, method_name=method_name, lines=end - start)
+        kept.extend(lines[position:])
+
+        # --> A class left with nothing in it needs a statement, where its first removed method was
+        def is_code(line):
+            return line.strip() and not line.strip().startswith('#')
+        inserts = []
+        for def_index, cut_index in fillers.values():
+            code_after = next((kept[index] for index in xrange(def_index + 1, len(kept)) if is_code(kept[index])), '')
+            if not code_after.startswith(' '):
+                inserts.append(cut_index)
+        for index in sorted(inserts, reverse=True):
+            kept.insert(index, '    pass\n')
+
+        self.lines = kept
+        self.dirty_flag = True
+        return removed
+
     def save_module(self, target_file_name):
-        """ Saves the module file with the updates if it's been changed
+        """ Saves the module file with the updates if it's been changed. If the text is the same as the
+        file already has, the file is left alone so its mtime doesn't change. Otherwise the text is written to
+        a temporary file and renamed into place, so a concurrent reader never sees a partial module.
         :unit_test: save_end_no_tag_end_of_module
         :unit_test: save_end_no_tag
         :unit_test: save_not_dirty
+        :unit_test: save_unchanged
+        :unit_test: save_keeps_mode
         """
         if not self.dirty_flag:
             return True
 
-        with open(target_file_name, 'w+') as output_file:
-            output_file.writelines(self.lines)
+        run_stats = self.session.run_stats
+        start = time.time()
+        with run_stats.phase('save'):
+            text = ''.join(self.lines)
             self.dirty_flag = False
-
+            changed = not os.path.exists(target_file_name) or TagCache.hash_file(target_file_name) != hashlib.sha1(text).hexdigest()
+            if changed:
+                UTModuleContainer.write_file_atomic(file_name=target_file_name, text=text)
+                run_stats.count('test_modules_touched')
+                run_stats.count('bytes_written', len(text))
+            elif self.session.config['verbose']:
+                print '- %s is unchanged, not saving' % target_file_name
+
+        if self.session.event_hooks:
+            self.session.event_hooks.fire(hooks.MODULE_SAVED, path=target_file_name, size=len(text), changed=changed,
+                                          seconds=time.time() - start)
         return True
 
+    @staticmethod
+    def write_file_atomic(file_name, text):
+        """ Writes the text to a temporary file in the same directory and renames it over file_name.
+        The file keeps its permissions, and a new file gets the usual ones for the umask.
+        :unit_test:
+        """
+        if os.path.exists(file_name):
+            mode = os.stat(file_name).st_mode & 07777
+        else:
+            mode = 0666 & ~_umask
+
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_name)), suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'w') as output_file:
+                output_file.write(text)
+            os.chmod(temp_path, mode)
+            os.rename(temp_path, file_name)
+        except:
+            os.remove(temp_path)
+            raise
+
     def append_class(self, ut_class):
         """
         Add a new class to the end of the module
         :unit_test:
         """
         output = StringIO.StringIO()
-        default_formatter.gen_class_def(out_file=output, class_name=ut_class.class_name)
-        for method_name in ut_class.method_names:
-            default_formatter.gen_unittest_method(out_file=output, method_name=method_name)
-        default_formatter.gen_class_close(out_file=output, class_name=ut_class.class_name)
+        formatter = self.session.formatter
+        with self.session.run_stats.phase('format'):
+            formatter.gen_class_def(out_file=output, class_name=ut_class.class_name)
+            for method_name in ut_class.method_names:
+                formatter.gen_unittest_method(out_file=output, method_name=method_name)
+            formatter.gen_class_close(out_file=output, class_name=ut_class.class_name)
 
         # Grab the lines and stuff them at the end
         lines = output.getvalue().splitlines(True)
-        self.lines.extend(lines)
+        self.session.run_stats.count('lines_inserted', len(lines))
+        start = len(self._lines)
+        self._lines.extend(lines)
+        self._index_lines(start=start)
         self.dirty_flag = True
+        if self.session.event_hooks:
+            self.session.event_hooks.fire(hooks.TEST_CLASS_CREATED, module_path=self.module_path, class_name=ut_class.class_name,
+                                          methods=len(ut_class.method_names), lines=len(lines))
 
         return True
 
     def _find_class_end(self, class_name):
-        """ Searches for the end-of-class token.
+        """ Looks up the class and its end-of-class token in the class index.
         If the token is not found this will attempt to locate the end of class position, insert the
         token, and return the positions. The tuple returned will contain the line on which the class
         is defined and the line the end token was found or created at.
@@ -395,59 +992,53 @@ class UTModuleContainer(object):
         :unit_test: find_class_end_no_tag_end_of_module
         :unit_test: find_class_end_no_tag
         """
-        class_def_line = -1
-        next_class_def_line = -1
-        end_token_line = -1
+        span = self._get_class_end(class_name=class_name)
+        if not span:
+            return -1, -1
 
-        re_any_class_line = r'^class[ ]+([a-zA-Z0-9_]+)[ ]*\('
-        end_token = create_end_class_token(class_name)
+        # print class_name, span
 
-        for i, line in enumerate(self.lines):
-            m = re.search(re_any_class_line, line)
-            if m and m.group(1) == class_name:
-                class_def_line = i  # 0 based indexing
-                # print 'Found class def line: %s on %d' % (class_name, class_def_line)
-                continue
-            elif m and class_def_line != -1 and next_class_def_line == -1:
-                next_class_def_line = i
-                # print 'Next class: %d' % next_class_def_line
+        return self._current_line(span.def_line), self._current_line(span.end_token_line, pending=span.end_token_pending)
 
-            if end_token in line:
-                end_token_line = i  # 0 based indexing
-                # print 'Found end token: %d' % end_token_line
-                break
+    def _get_class_end(self, class_name):
+        """
+        Gets the class span, first adding the end token if the class doesn't have one.
+        :returns: The ClassSpan, or None if the class isn't in the module
+        """
+        span = self.class_spans.get(class_name)
+        if not span:
+            return None
 
-        # Did we find the start of our class but not the end token and no next class? Means there is no
-        # token and the end of the class is the end of the file.
-        if end_token_line == -1 and class_def_line != -1:
+        # Did we find the start of our class but not the end token? Then the token needs to be added.
+        if span.end_token_line == -1:
             # print "Still haven't found the end token for class %s" % class_name
             token = create_end_class_token(class_name)
             line = '    # --%s --\n' % token
+            next_class_def_line = self._next_class_line(span.def_line)
 
             # Means our class is the last in the module
             if next_class_def_line == -1:
-                self.lines.append('\n')
-                end_token_line = len(self.lines)
-                self.lines.append(line)
+                self._lines.append('\n')
+                span.end_token_line = len(self._lines)
+                self._lines.append(line)
                 self.dirty_flag = True
                 # print 'Appended %d %d' % (end_token_line, len(self.lines))
 
             # Need to insert the missing end tag
-            elif next_class_def_line != -1:
+            else:
                 # Scan back to find end of previous class' code, if any
                 prev_code_end = self._scan_back_for_foo_code(start_index=next_class_def_line)
                 if prev_code_end == -1:
                     print 'Warning: Failed to find previous class code end. Doublecheck class %s' % class_name
                     prev_code_end = next_class_def_line - 2
 
-                end_token_line = prev_code_end + 2
-                self.lines.insert(prev_code_end + 2, '\n')
-                self.lines.insert(prev_code_end + 2, line)
+                insert_at = prev_code_end + 2
+                self._insert_lines(insert_at, [line, '\n'])
+                span.end_token_line = insert_at
+                span.end_token_pending = True
                 self.dirty_flag = True
 
-        # print class_name, end_token, class_def_line, end_token_line
-
-        return class_def_line, end_token_line
+        return span
 
     def _scan_back_for_foo_code(self, start_index, max_lines=10):
         """
@@ -465,11 +1056,37 @@ class UTModuleContainer(object):
         for index in range(start_index, start_index - max_lines, -1):
             if index < 0:
                 return -1
-            line = self.lines[index]
+            line = self._lines[index]
             if line.strip() and line.startswith('    '):
                 return index
         return -1
 
+    @classmethod
+    def read_test_names(cls, module_path):
+        """
+        Reads only the class and method names of a test module, by the same rules as _index_lines(), without
+        keeping the lines or the class spans. That's all a check needs for its membership tests.
+        :param module_path: The path to the module file
+        :returns: Dict of class name -> set of method names
+        :raises: IOError
+        :unit_test: read_test_names
+        """
+        names = {}
+        method_names = None
+        with open(module_path) as module_file:
+            for line in module_file:
+                if not line.startswith(' '):
+                    m = cls.re_any_class_line.match(line)
+                    if m:
+                        method_names = names[m.group(1)] = set()
+                    elif line.strip() and not line.startswith('#'):
+                        method_names = None  # Top level code ends the class
+                elif method_names is not None and line.startswith('    def'):
+                    m = cls.re_method_line.match(line)
+                    if m:
+                        method_names.add(m.group(1))
+        return names
+
     @classmethod
     def load_module_lines(cls, module_path):
         """ Loads the text of the unit test module as lines for updating.
@@ -487,43 +1104,50 @@ class ModuleUpdater(object):
     Handles the details of updating an existing module with additional classes and tests
     :unit_test_class: ModuleUpdaterTests
     """
-    def __init__(self, ut_module):
+    def __init__(self, ut_module, session=None):
         """
         :param ut_module: UTModuleDetails for the test module to update/create
+        :param session: The TDDTagSession to work in. Default is the global session.
         :unit_test: create_instance
         """
         self.ut_module = ut_module
+        self.session = get_session(session)
         self.container = None
 
-    def update(self, loaded_module):
+    def update(self, module_path):
         """
-        Updates the unit test module Python text. The source is pointed to by module_path while
-        the loaded_module is the module object, and used to introspect the current classes and class
-        methods.
+        Updates the unit test module Python text. The module isn't imported - the current classes and
+        class methods come from the same index of the source lines that the updates are made with, so
+        a test module whose imports are broken can still be updated.
 
-        :param loaded_module: The module object for the unit test module.
+        :param module_path: The path to the unit test module's source.
         :unit_test: update_verify_path
         :unit_test: update_no_save
         :unit_test: update_with_save_name
         """
-        module_path = loaded_module.__file__
-        if tddtags_config['verbose']:
+        if self.session.config['verbose']:
             print '+ Comparing existing test module: %s (%s)' % (self.ut_module.module_name, module_path)
 
         # This, simply to make it easier to mock/test
-        return self._update_step1(loaded_module=loaded_module, module_path=module_path)
+        with self.session.run_stats.phase('diff'):
+            return self._update_step1(module_path=module_path)
 
-    def _update_step1(self, loaded_module, module_path):
-        # UTModuleContainer, if there are changes
+    def _update_step1(self, module_path):
+        self.container = UTModuleContainer(module_path=module_path, session=self.session)
 
-        existing_classes, new_names = self._get_class_lists(loaded_module=loaded_module)
+        existing_classes, new_names = self._get_class_lists(container=self.container)
         if new_names:
             # First add any new classes. Later update each class test methods
-            self.container = UTModuleContainer(module_path=module_path)
             self._add_new_classes(self.container, new_names)
 
-        self.container = self._update_new_methods(self.container, module_path=module_path, existing_classes=existing_classes)
-        return self._save(self.container)
+        self.container = self._update_new_methods(self.container, existing_classes=existing_classes)
+        if self.session.memory_profiler:
+            self.session.memory_checkpoint('update %s' % self.ut_module.module_name, lines=self.container.lines)
+
+        saved = self._save(self.container)
+        if self.session.memory_profiler:
+            self.session.memory_checkpoint('save %s' % self.ut_module.module_name)
+        return saved
 
     def _save(self, container):
         """
@@ -535,69 +1159,99 @@ class ModuleUpdater(object):
         :unit_test: save_different_name Verify that a save picks up the new filename
         """
         # Are there changes to the module to save?
-        if not tddtags_config['save'] or not container or not container.dirty_flag:
-            if tddtags_config['verbose']:
-                print 'Not saving %s (--nosave=%s)' % (self.ut_module.module_name, ['True', 'False'][tddtags_config['save']])
+        if not self.session.config['save'] or not container or not container.dirty_flag:
+            if self.session.config['verbose']:
+                print 'Not saving %s (--nosave=%s)' % (self.ut_module.module_name, ['True', 'False'][self.session.config['save']])
             return True
 
         # TODO If we support wildcard scanning of source files we'll need a better way to specify save_name
-        save_name = container.module_path if not tddtags_config['save_to_name'] else tddtags_config['save_to_name']
+        save_name = container.module_path if not self.session.config['save_to_name'] else self.session.config['save_to_name']
         container.save_module(save_name)
 
-        if tddtags_config['verbose']:
+        if self.session.config['verbose']:
             print 'Saved the updated test module file to %s' % save_name
 
         return True
 
-    def _get_class_lists(self, loaded_module):
+    def _get_class_lists(self, container):
         """
-        Scans the loaded module for the list of classes and compares against the list defined
+        Takes the list of classes defined in the test module and compares against the list defined
         by tags in the ut_module.
 
-        :param loaded_module: The module
-        :return: existing_classes, new_names
+        :param container: The UTModuleContainer for the test module
+        :return: existing_classes (class name -> ClassSpan), new_names
         :unit_test: get_class_lists
         """
         # Collect a list of all classes currently in the module
-        existing_classes = dict(inspect.getmembers(loaded_module, inspect.isclass))
+        existing_classes = dict(container.class_spans)
 
         # And see if there are any new ones
         new_names = [name for name, item in self.ut_module.class_list.items() if name not in existing_classes]
         return existing_classes, new_names
 
-    def _update_new_methods(self, container, module_path, existing_classes):
-        """ Checks the existing classes to see if there are any new test methods required.
-        This will use UTModuleContainer to load the module text (as it is now) and update it
-        with the required methods and any missing class end tags.
-        :param module_path: The path to the unit test module
-        :param existing_classes: The set of existing classes in the module from inspect
-        :returns: None, or a UTModuleContainer if updated
+    def _update_new_methods(self, container, existing_classes):
+        """ Checks the existing classes to see if there are any new test methods required, and
+        updates the module text with the required methods and any missing class end tags.
+        :param container: The UTModuleContainer for the test module
+        :param existing_classes: The existing classes in the module, class name -> ClassSpan
+        :returns: The UTModuleContainer, with dirty_flag set if it was updated
         :unit_test: update_new_methods
         :unit_test: update_new_methods_no_new Verify no changes made if no new class test methods
         """
         # Any required updates?
-        for name, clazz in existing_classes.items():
+        for name, span in existing_classes.items():
             if name not in self.ut_module.class_list:
                 # print '...skipping %s' % name
                 continue
 
-            filtered = filter_to_class(inspect.getmembers(clazz, inspect.ismethod), clazz)
-            existing_tests = dict(filtered)
-
             ut_class = self.ut_module.class_list[name]
             existing_names = ['test_'+name for name in ut_class.method_names]
-            new_test_names = [name for name in existing_names if name not in existing_tests]
+            new_test_names = [name for name in existing_names if name not in span.method_names]
             if not new_test_names:
                 continue  # We're bored - let's see what else there is...
 
-            if not container:
-                container = UTModuleContainer(module_path=module_path)
-
             self._add_new_tests_to_class(container=container, class_name=ut_class.class_name, new_test_names=new_test_names)
 
         # Return the container
         return container
 
+    def get_missing_tests(self, container):
+        """
+        Lists the test classes and methods the tags call for that the test module doesn't have yet,
+        without changing the module.
+        :param container: The UTModuleContainer for the test module
+        :returns: Dict of class name -> list of missing test method names. A class that's missing
+                  altogether is listed with all of its test methods.
+        :unit_test: get_missing_tests
+        """
+        missing = {}
+        for name, ut_class in self.ut_module.class_list.items():
+            span = container.class_spans.get(name)
+            existing_names = span.method_names if span else set()
+            new_test_names = ['test_' + method_name for method_name in ut_class.method_names
+                              if 'test_' + method_name not in existing_names]
+            if new_test_names or not span:
+                missing[name] = new_test_names
+        return missing
+
+    def get_orphaned_tests(self, container):
+        """
+        Lists the generated test methods that no tag calls for anymore - the test methods between a class's
+        definition and its end token that the tags don't have, in classes the tags do or don't have.
+        :param container: The UTModuleContainer for the test module
+        :returns: Dict of class name -> sorted list of orphaned test method names
+        :unit_test: get_orphaned_tests
+        """
+        orphaned = {}
+        for name in container.class_spans:
+            ut_class = self.ut_module.class_list.get(name)
+            tagged_names = set('test_' + method_name for method_name in ut_class.method_names) if ut_class else set()
+            orphan_names = [method_name for method_name in container.get_generated_methods(name)
+                            if method_name not in tagged_names]
+            if orphan_names:
+                orphaned[name] = orphan_names
+        return orphaned
+
     def _add_new_tests_to_class(self, container, class_name, new_test_names):
         """ Updates the module file to add the new test methods to a class
         :param container: The UTModuleContainer
@@ -610,7 +1264,7 @@ class ModuleUpdater(object):
         if not new_test_names:
             return True
 
-        if tddtags_config['verbose']:
+        if self.session.config['verbose']:
             print '+ %d new test methods for class: [%s]' % (len(new_test_names), class_name)
 
         for method_name in new_test_names:
@@ -618,7 +1272,7 @@ class ModuleUpdater(object):
             if not result:
                 print 'Warning: Failed to add the method %s to the class %s' % (method_name, class_name)
                 return False
-            if tddtags_config['verbose']:
+            if self.session.config['verbose']:
                 print '+ Added test method to class [%s]: %s' % (class_name, method_name)
 
         return True
@@ -630,16 +1284,309 @@ class ModuleUpdater(object):
         :param new_names: List of new classes to add
         :unit_test: add_new_classes
         """
-        if tddtags_config['verbose']:
+        if self.session.config['verbose']:
             print '+ %d new classes' % len(new_names)
 
         for class_name in new_names:
             ut_class = self.ut_module.class_list[class_name]
             container.append_class(ut_class=ut_class)
-            if tddtags_config['verbose']:
+            if self.session.config['verbose']:
                 print '+ Adding class to test module [%s]: %s' % (self.ut_module.module_name, class_name)
 
 
+class TagCache(object):
+    """
+    An on-disk cache of the tag records compiled from each source module, so that a run only has
+    to compile the modules that changed.
+
+    An entry is checked against the source file's size and mtime first, and the content hash is
+    only computed when those differ. The whole cache is dropped when the tddtags version or the
+    config that affects the compile changes. Note that only the module's own source is checked, so
+    in import mode a change to a docstring built from another module won't be noticed.
+    :unit_test_class: TagCacheTests
+    """
+    CACHE_FILE_NAME = 'tags.json'
+
+    # --> The tddtags_config keys that change what the compile produces
+    fingerprint_keys = ['compile_mode']
+
+    def __init__(self, cache_dir, session=None):
+        """
+        :param cache_dir: The directory to keep the cache in. Created on save if needed.
+        :param session: The TDDTagSession whose config and module loader to use. Default is the global session.
+        :unit_test: create_instance
+        :unit_test: create_instance_fingerprint_changed
+        """
+        self.session = get_session(session)
+        self.cache_dir = cache_dir
+        self.cache_path = os.path.join(cache_dir, TagCache.CACHE_FILE_NAME)
+        self.fingerprint = TagCache.get_fingerprint(config=self.session.config)
+        self.entries = {}
+        self.dirty_flag = False
+        self.load()
+
+    @classmethod
+    def get_fingerprint(cls, config=None):
+        """
+        :param config: The config the compile runs with. Default is tddtags_config.
+        :unit_test:
+        """
+        config = config if config is not None else tddtags_config
+        config = dict((key, config[key]) for key in cls.fingerprint_keys)
+        text = json.dumps({'version': __version__, 'config': config}, sort_keys=True)
+        return hashlib.sha1(text).hexdigest()
+
+    @staticmethod
+    def hash_file(path):
+        with open(path, 'rb') as source_file:
+            return hashlib.sha1(source_file.read()).hexdigest()
+
+    def load(self):
+        """
+        Loads the cache file, if there is one and it was written with the same fingerprint.
+        """
+        if not os.path.exists(self.cache_path):
+            return
+
+        try:
+            with open(self.cache_path) as cache_file:
+                data = json.load(cache_file)
+        except ValueError as ex:
+            print '- Ignoring unreadable tag cache %s -> %s' % (self.cache_path, ex)
+            return
+
+        if data.get('fingerprint') == self.fingerprint:
+            self.entries = data.get('entries', {})
+        elif self.session.config['verbose']:
+            print '+ Tag cache fingerprint changed - rebuilding %s' % self.cache_path
+
+    def get(self, module_name):
+        """
+        Gets the cached tag records for a module, if its source file hasn't changed.
+        :param module_name: The [package.]module name
+        :returns: The list of tag records, or None if not cached or out of date
+        :unit_test: get
+        :unit_test: get_changed_source
+        :unit_test: get_touched_source Verify a new mtime with the same content is still a hit
+        """
+        entry = self.entries.get(module_name)
+        if not entry:
+            return None
+
+        try:
+            stat = os.stat(entry['path'])
+        except OSError:
+            return None
+
+        if stat.st_size != entry['size']:
+            return None
+
+        if stat.st_mtime != entry['mtime']:
+            if TagCache.hash_file(entry['path']) != entry['hash']:
+                return None
+            entry['mtime'] = stat.st_mtime
+            self.dirty_flag = True
+
+        return [tuple(record) for record in entry['records']]
+
+    def put(self, module_name, records):
+        """
+        Stores the tag records compiled for a module.
+        :param module_name: The [package.]module name
+        :param records: The list of (test module, test class, test method) records
+        :unit_test: put
+        """
+        source_path = self.session.module_loader.find_source(module_name)
+        if not source_path:
+            return
+
+        stat = os.stat(source_path)
+        self.entries[module_name] = {
+            'path': source_path,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'hash': TagCache.hash_file(source_path),
+            'records': [list(record) for record in records],
+        }
+        self.dirty_flag = True
+
+    def save(self):
+        """
+        Writes the cache file if anything changed. It's written to a temporary file and renamed into
+        place so that a concurrent run never reads a partial cache.
+        :unit_test: save
+        """
+        if not self.dirty_flag:
+            return True
+
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        handle, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'w') as cache_file:
+                json.dump({'fingerprint': self.fingerprint, 'entries': self.entries}, cache_file)
+            os.rename(temp_path, self.cache_path)
+        except:
+            os.remove(temp_path)
+            raise
+
+        self.dirty_flag = False
+        return True
+
+
+class TagChecker(object):
+    """
+    Checks compiled tags against the tests that the test modules already have, never writing anything.
+    Only the class and method names of each test module are read, so there's no container to build and
+    nothing to format. A missing item is a (test module, class, test method) tuple, with None for the
+    class and method when the whole test module is missing, or for the method when the whole class is.
+    :unit_test_class: TagCheckerTests
+    """
+    def __init__(self, fail_fast=False, session=None):
+        """
+        :param fail_fast: Stop at the first missing item
+        :param session: The TDDTagSession to work in. Default is the global session.
+        :unit_test: create_instance
+        """
+        self.session = get_session(session)
+        self.fail_fast = fail_fast
+        self.missing = []  # The missing items, in the order found
+        self._found = set()
+        self._test_names = {}  # Test module name -> its class -> method names, None if there's no module
+
+    def get_test_names(self, module_name):
+        """
+        :returns: Dict of class name -> set of method names for the test module, None if it doesn't exist
+        :unit_test: get_test_names
+        """
+        if module_name not in self._test_names:
+            module_path = self.session.module_loader.find_source(module_name)
+            with self.session.run_stats.phase('load'):
+                self._test_names[module_name] = UTModuleContainer.read_test_names(module_path) if module_path else None
+        return self._test_names[module_name]
+
+    def check_records(self, records):
+        """
+        Checks tag records, adding the items that are missing to self.missing.
+        :param records: An iterable of (test module, test class, test method) records
+        :returns: True if anything was missing. With fail_fast this stops at the first.
+        :unit_test: check_records
+        :unit_test: check_records_fail_fast
+        """
+        found = False
+        for module_name, class_name, method_name in records:
+            test_names = self.get_test_names(module_name)
+            if test_names is None:
+                item = (module_name, None, None)
+            elif class_name not in test_names:
+                item = (module_name, class_name, None)
+            elif 'test_' + method_name not in test_names[class_name]:
+                item = (module_name, class_name, 'test_' + method_name)
+            else:
+                continue
+
+            found = True
+            if item not in self._found:
+                self._found.add(item)
+                self.missing.append(item)
+            if self.fail_fast:
+                break
+        return found
+
+    def check_model(self, test_module_details):
+        """
+        Checks every tag in the compiled model, in module, class and then tag order.
+        :param test_module_details: Dict of test module name -> UTModuleDetails
+        :returns: True if anything was missing
+        :unit_test: check_model
+        """
+        def records():
+            for module_name in sorted(test_module_details):
+                class_list = test_module_details[module_name].class_list
+                for class_name in sorted(class_list):
+                    for method_name in class_list[class_name].method_names:
+                        yield module_name, class_name, method_name
+
+        return self.check_records(records())
+
+    def format_missing(self):
+        """
+        :returns: A line per missing item
+        :unit_test: format_missing
+        """
+        lines = []
+        for module_name, class_name, method_name in self.missing:
+            if class_name is None:
+                lines.append('%s (no test module)' % module_name)
+            elif method_name is None:
+                lines.append('%s.%s (no test class)' % (module_name, class_name))
+            else:
+                lines.append('%s.%s.%s' % (module_name, class_name, method_name))
+        return lines
+
+
+class OrphanFinder(object):
+    """
+    Finds the generated test methods that no tag calls for anymore, after a tag was deleted or renamed, and
+    optionally removes the ones that are still stubs - a test that has been written is listed, but kept. It
+    takes a checker's place in TDDTag.run(), so it sees the whole compiled model; the tags of every source
+    that feeds a test module need to be in it, or the tests for the ones left out look orphaned. Only the
+    test modules the model refers to are read - a test module no tag refers to anymore isn't looked at.
+    An orphan is a (test module, class, test method, is a stub, removed) tuple.
+    :unit_test_class: OrphanFinderTests
+    """
+    fail_fast = False  # --> As a checker, it always needs the whole model
+
+    def __init__(self, remove=False, session=None):
+        """
+        :param remove: Remove the orphaned test methods that are still stubs, and save the test modules
+        :param session: The TDDTagSession to work in. Default is the global session.
+        :unit_test: create_instance
+        """
+        self.session = get_session(session)
+        self.remove = remove
+        self.orphans = []  # The orphans, in the order found
+
+    def check_model(self, test_module_details):
+        """
+        Finds the orphans in each of the model's test modules that exists, in module, class and then method order.
+        :param test_module_details: Dict of test module name -> UTModuleDetails
+        :returns: True if anything was orphaned
+        :unit_test: check_model
+        :unit_test: check_model_remove
+        """
+        found = False
+        for module_name in sorted(test_module_details):
+            module_path = self.session.module_loader.find_source(module_name)
+            if not module_path:
+                continue
+
+            updater = ModuleUpdater(ut_module=test_module_details[module_name], session=self.session)
+            container = UTModuleContainer(module_path=module_path, session=self.session)
+            with self.session.run_stats.phase('diff'):
+                orphaned = updater.get_orphaned_tests(container)
+            methods = [(class_name, method_name) for class_name in sorted(orphaned) for method_name in orphaned[class_name]]
+            stubs = set(method for method in methods if container.is_stub_method(*method))
+            removed = set(container.remove_class_methods(sorted(stubs))) if self.remove else set()
+            for method in methods:
+                found = True
+                self.orphans.append((module_name, method[0], method[1], method in stubs, method in removed))
+            updater._save(container)
+        return found
+
+    def format_orphans(self):
+        """
+        :returns: A line per orphan
+        :unit_test: format_orphans
+        """
+        lines = []
+        for module_name, class_name, method_name, stub, removed in self.orphans:
+            state = 'stub, removed' if removed else 'stub' if stub else 'implemented'
+            lines.append('%s.%s.%s (%s)' % (module_name, class_name, method_name, state))
+        return lines
+
+
 class TDDTag(object):
     """
     The main TDDTag class.
@@ -648,10 +1595,12 @@ class TDDTag(object):
     TEST_FRAMEWORK_PYTHON = 'python'
     TEST_FRAMEWORK_DJANGO = 'django'
 
-    def __init__(self):
+    def __init__(self, session=None):
         """
+        :param session: The TDDTagSession to run in. Default is the global session.
         :unit_test: create_instance
         """
+        self.session = get_session(session)
         self.test_framework = TDDTag.TEST_FRAMEWORK_PYTHON
         self.test_import = 'unittest.TestCase'
         self.test_base_class = 'TestCase'
@@ -659,48 +1608,230 @@ class TDDTag(object):
         self.dump_existing_modules = False
         self.compiler = None
 
-    def run(self, source_module_name, class_filter=None):
+    def add_hook(self, event, callback):
+        """
+        Registers a callback for one of the events in tddtags.hooks, called as callback(event, **details).
+        The hooks belong to the session, so they're shared by every TDDTag in it. The compile events (module
+        loaded, docstring scanned, tag found) aren't fired for modules taken from the tag cache or compiled
+        in --jobs workers.
+        :raises: ValueError for an unknown event
+        :unit_test:
+        """
+        self.session.event_hooks.add(event, callback)
+
+    def remove_hook(self, event, callback):
+        """
+        :unit_test:
+        """
+        self.session.event_hooks.remove(event, callback)
+
+    def run(self, source_module_name, class_filter=None, excludes=None, jobs=1, checker=None, index=None):
         """ Run the DogTag scanner and generator
-        :param module_name: The name of the module to scan
+        :param source_module_name: The module to scan, or a list of targets. See expand_targets() for the
+                                   forms a target can take.
         :param class_filter: The optional name of a class to constrain the scan to (not used)
+        :param excludes: Optional list of fnmatch patterns for files/directories to skip when walking
+        :param jobs: The number of worker processes to compile with. Default is 1 (no pool).
+        :param checker: Optional TagChecker to check the test modules with, or OrphanFinder to look for
+                        orphaned tests in them, instead of updating them. With its fail_fast set the modules
+                        are compiled one at a time, stopping at the first one with a missing test.
+        :param index: Optional tddtags.index.TagIndex to bring up to date for the modules
+        :returns: True if every module compiled
         :unit_test: run_valid_module Verify sets up compiler sucessfully
         :unit_test: run_invalid_module Verify handles invalid module correctly
+        :unit_test: run_many_modules Verify all the modules compile into a single update pass
         """
         print "\nTDDTag - scanning source to generate/update unit test skeletons"
-        self.compiler = CompileTags(source_module_name=source_module_name)
+        targets = [source_module_name] if isinstance(source_module_name, basestring) else source_module_name
+        module_names = expand_targets(targets, excludes=excludes, module_loader=self.session.module_loader)
+        if not module_names:
+            print 'No modules found to scan'
+            return False
+
+        # First inspect the source modules and compile a list of stuff
+        cache = None
+        if self.session.config['cache_dir']:
+            cache_dir = os.path.join(self.session.module_loader.anchor_dir, self.session.config['cache_dir'])
+            cache = TagCache(cache_dir=cache_dir, session=self.session)
 
-        # First inspect the source module and compile a list of stuff
-        if self.compiler.compile():
+        if checker and checker.fail_fast:
+            compiled_cnt = self._compile_serial(module_names=module_names, cache=cache, checker=checker)
+        elif jobs > 1 and len(module_names) > 1:
+            compiled_cnt = self._compile_parallel(module_names=module_names, jobs=jobs, cache=cache)
+        else:
+            compiled_cnt = self._compile_serial(module_names=module_names, cache=cache)
+
+        if cache:
+            cache.save()
+        if index:
+            index.update(module_names)
+        if self.session.memory_profiler:
+            self.session.memory_checkpoint('compile', model=self.session.test_module_details)
+
+        if checker:
+            if not checker.fail_fast:
+                checker.check_model(self.session.test_module_details)
+        elif compiled_cnt:
             self.process_referenced_test_modules()
-            return True
-        return False
+        return compiled_cnt == len(module_names)
+
+    def run_sources(self, sources, deadline=None, checker=None):
+        """
+        Compiles the tags from source texts, without importing anything, then updates the test modules
+        they refer to. This is the pre-commit path, where the sources are the content git has staged.
+        :param sources: A list of (path, source text)
+        :param deadline: Optional time.time() to be done by. The sources and test modules that aren't
+                         reached by then are left out, and listed.
+        :param checker: Optional TagChecker to check the test modules with, instead of updating them
+        :returns: True if every source that was reached compiled
+        :unit_test: run_sources
+        :unit_test: run_sources_deadline
+        """
+        compiled_cnt = 0
+        for index, (source_path, source) in enumerate(sources):
+            if deadline and time.time() > deadline:
+                print '- Out of time, left out: %s' % ', '.join(path for path, _ in sources[index:])
+                sources = sources[:index]
+                break
+
+            self.compiler = CompileTags(source_module_name=ModuleLoader.module_name_for_path(source_path),
+                                        session=self.session)
+            if self.compiler.compile_source(source_path=source_path, source=source):
+                compiled_cnt += 1
+                if checker and checker.fail_fast and checker.check_records(self.compiler.tag_records):
+                    sources = sources[:index + 1]
+                    break
+            else:
+                print '- Failed to compile the tags from %s without importing it' % source_path
+
+        if self.session.memory_profiler:
+            self.session.memory_checkpoint('compile', model=self.session.test_module_details)
+
+        if checker:
+            if not checker.fail_fast:
+                checker.check_model(self.session.test_module_details)
+        elif compiled_cnt:
+            self.process_referenced_test_modules(deadline=deadline)
+        return compiled_cnt == len(sources)
+
+    def _compile_serial(self, module_names, cache=None, checker=None):
+        """
+        Compiles the modules one after the other, taking the tags from the cache where it has them.
+        :param module_names: The list of modules to compile
+        :param cache: Optional TagCache
+        :param checker: Optional TagChecker to check each module's tags with as it's compiled. It stops
+                        the compile at the first missing test.
+        :returns: The count of modules that compiled
+        :unit_test: compile_serial_cached
+        :unit_test: compile_serial_checker
+        """
+        compiled_cnt = 0
+        for module_name in module_names:
+            records = cache.get(module_name) if cache else None
+            if records is not None:
+                for record in records:
+                    self.session.add_tag_record(record)
+                compiled_cnt += 1
+            else:
+                self.compiler = CompileTags(source_module_name=module_name, session=self.session)
+                if not _compile_module(self.compiler):
+                    continue
+                compiled_cnt += 1
+                records = self.compiler.tag_records
+                if cache:
+                    cache.put(module_name, records)
+
+            if checker and checker.check_records(records):
+                break
+
+        return compiled_cnt
+
+    def _compile_parallel(self, module_names, jobs, cache=None):
+        """
+        Compiles the modules across a pool of worker processes. Each worker sends back the tag records
+        for a module, and they are merged in module_names order - the same order as a serial compile, so
+        the model (and the test modules generated from it) come out the same.
+        :param module_names: The list of modules to compile
+        :param jobs: The number of worker processes
+        :param cache: Optional TagCache. Cached modules aren't sent to the pool.
+        :returns: The count of modules that compiled
+        :unit_test: compile_parallel
+        """
+        cached = {}
+        if cache:
+            for module_name in module_names:
+                records = cache.get(module_name)
+                if records is not None:
+                    cached[module_name] = records
+        pending = [module_name for module_name in module_names if module_name not in cached]
+
+        if self.session.config['verbose']:
+            print '+ Compiling %d modules with %d jobs (%d cached)' % (len(pending), jobs, len(cached))
+
+        compiled = {}
+        if pending:
+            chunk_size = max(1, len(pending) // (jobs * 4))
+            pool = multiprocessing.Pool(processes=jobs, initializer=_init_compile_worker,
+                                        initargs=(self.session.module_loader, dict(self.session.config)))
+            try:
+                compiled = dict(zip(pending, pool.imap(_compile_worker, pending, chunk_size)))
+            finally:
+                pool.terminate()
+                pool.join()
+
+        # --> Merge in module order, whether the records were cached or just compiled
+        compiled_cnt = 0
+        for module_name in module_names:
+            if module_name in cached:
+                records = cached[module_name]
+            else:
+                success, records, counters, import_cost = compiled[module_name]
+                self.session.run_stats.merge_counters(counters)
+                if import_cost:
+                    self.session.module_loader.import_costs[module_name] = import_cost
+                if not success:
+                    continue
+                if cache:
+                    cache.put(module_name, records)
 
-    def process_referenced_test_modules(self):
+            compiled_cnt += 1
+            for record in records:
+                self.session.add_tag_record(record)
+
+        return compiled_cnt
+
+    def process_referenced_test_modules(self, deadline=None):
         """
         Will create a new file for the unit tests, or inject new tests into an existing
         test module.
+        :param deadline: Optional time.time() to be done by. The test modules not reached by then are left out.
         """
-        if not _test_module_details:
+        test_module_details = self.session.test_module_details
+        if not test_module_details:
             print 'No tags to generate unittests for'
             return
 
         # --> Iterate through each module
-        for key in _test_module_details:
-            ut_module = _test_module_details[key]
+        for key in test_module_details:
+            ut_module = test_module_details[key]
 
             if not ut_module.class_list:
-                if tddtags_config['verbose']:
+                if self.session.config['verbose']:
                     print '+ Skipping test module %s - nothing to do.' % ut_module.module_name
                 continue
 
+            if deadline and time.time() > deadline:
+                print '- Out of time, left out test module %s' % ut_module.module_name
+                continue
+
             # Does the module already exist to update? Must be the full package.module unless in the same package.
-            if tddtags_config['verbose']:
+            if self.session.config['verbose']:
                 print '+ Loading module %s' % ut_module.module_name
 
-            module = _module_loader.load_module(ut_module.module_name)
-            if module:
-                updater = ModuleUpdater(ut_module=ut_module)
-                updater.update(loaded_module=module)
+            module_path = self.session.module_loader.find_source(ut_module.module_name)
+            if module_path:
+                updater = ModuleUpdater(ut_module=ut_module, session=self.session)
+                updater.update(module_path=module_path)
             else:
                 # TODO: This should use the ModuleUpdater
                 self.gen_new_test_module(ut_module=ut_module)
@@ -725,15 +1856,30 @@ class TDDTag(object):
         """ Generates a new module to contain the unit tests.
         """
         # TODO gen_new_test_module should use the ModuleUpdater
-        source_file = open('%s.py' % ut_module.module_name, 'w')
-        self.gen_output(ut_module=ut_module, source_file=source_file)
-        source_file.close()
+        run_stats = self.session.run_stats
+        event_hooks = self.session.event_hooks
+        start = time.time()
+        file_name = '%s.py' % ut_module.module_name
+        with run_stats.phase('save'):
+            source_file = open(file_name, 'w')
+            with run_stats.phase('format'):
+                self.gen_output(ut_module=ut_module, source_file=source_file)
+            size = source_file.tell()
+            run_stats.count('bytes_written', size)
+            source_file.close()
+        run_stats.count('test_modules_touched')
+
+        if event_hooks:
+            for ut_class in ut_module.class_list.values():
+                event_hooks.fire(hooks.TEST_CLASS_CREATED, module_path=file_name, class_name=ut_class.class_name,
+                                 methods=len(ut_class.method_names), lines=None)
+            event_hooks.fire(hooks.MODULE_SAVED, path=file_name, size=size, changed=True, seconds=time.time() - start)
 
     def gen_output(self, ut_module, source_file):
         """
         Generates a new unittest source file for a ut_module
         """
-        formatter = Formatter()
+        formatter = Formatter(config=self.session.config)
 
         # for key in _test_module_details:
         #     module = _test_module_details[key]
@@ -749,18 +1895,63 @@ class TDDTag(object):
             formatter.gen_class_close(out_file=source_file, class_name=clazz.class_name)
 
 
+class SourceContext(object):
+    """
+    Stands in for a module, class or function when the tags are compiled from the source text
+    rather than from the imported module. It carries only what CompileTags.handle_context() reads
+    from a live object: the name, the docstring and the children to visit.
+    :unit_test_class: SourceContextTests
+    """
+    KIND_MODULE = 'module'
+    KIND_CLASS = 'class'
+    KIND_FUNCTION = 'function'
+
+    def __init__(self, name, doc, kind, children=None, line=None, end_line=None):
+        """
+        :param name: The name of the module, class or function
+        :param doc: The docstring text, or None
+        :param kind: One of the KIND_* values
+        :param children: List of (name, SourceContext) tuples, ordered as inspect.getmembers() would
+        :param line: The 1 based line the definition starts on, if known. A module starts on line 1.
+        :param end_line: The last line of the definition, if known - up to the next statement after it,
+                         so the blank lines and comments that follow are counted in
+        :unit_test: create_instance
+        """
+        self.__name__ = name
+        self.__doc__ = doc
+        self.kind = kind
+        self.children = children or []
+        self.line = line
+        self.end_line = end_line
+
+    def __str__(self):
+        return '%s %s' % (self.kind, self.__name__)
+
+
 class CompileTags(object):
     """
     Compiles a source module and extracts our tags from docstrings.
     :unit_test_class: CompileTagsTests
     """
-    re_keyword_line = r':(unit_test[_a-z]*): *([a-zA-Z_.]*) *(.*)'
+    keyword_prefix = ':unit_test'
+    re_keyword_line = re.compile(r':(unit_test[_a-z]*): *([a-zA-Z_.]*) *([^\r\n]*)')
 
-    def __init__(self, source_module_name):
+    # --> The most docstrings a session's keyword memo holds before it's cleared
+    keyword_memo_limit = 4096
+
+    # --> Values for tddtags_config['compile_mode']
+    MODE_IMPORT = 'import'
+    MODE_STATIC = 'static'
+    MODE_STATIC_ONLY = 'static_only'  # Never imports: a module whose docstrings are built at runtime fails
+
+    def __init__(self, source_module_name, session=None):
         """
+        :param source_module_name: The [package.]module to compile
+        :param session: The TDDTagSession to compile into. Default is the global session.
         :unit_test: create_instance
         :unit_test: create_invalid_module
         """
+        self.session = get_session(session)
         # m = re.search(r'([a-zA-Z_]+)[.py]?', source_module_name)
         # if not m:
         #     raise Exception('Invalid module name')
@@ -777,39 +1968,258 @@ class CompileTags(object):
         # TODO: Might want to camel case the module name for the default test name
         self.unit_test_class.append('%sTests' % self.module_name)
 
+        # --> The (test module, test class, test method) records compiled, in the order found
+        self.tag_records = []
+        # --> The (qualified source symbol, line) of each of the tag_records. The line is None if unknown.
+        self.tag_symbols = []
+        self._context_names = []  # The names from the module down to the context being handled
+
     def compile(self):
         """
         Runs the scanner over the module.
+
+        With the 'compile_mode' config set to static this first tries to parse the source, and
+        only imports the module if the tags can't be had without running it. A module whose source
+        doesn't parse fails to compile - it isn't imported. Set to static_only, a module that would
+        have to be imported fails too.
         :unit_test:
+        :unit_test: compile_static_mode
+        :unit_test: compile_static_mode_syntax_error
+        :unit_test: compile_static_only_mode
+        """
+        with self.session.run_stats.phase('compile'):
+            return self._compile()
+
+    def _compile(self):
+        compiled = None
+        compile_mode = self.session.config['compile_mode']
+        if compile_mode in (CompileTags.MODE_STATIC, CompileTags.MODE_STATIC_ONLY):
+            compiled = self.compile_static()
+            if compiled is False:
+                return False
+            if compiled is None and compile_mode == CompileTags.MODE_STATIC_ONLY:
+                print '- Not importing %s to compile its tags - name it as a target to import it' % self.module_full_name
+                return False
+            if compiled is None and self.session.config['verbose']:
+                print '+ Falling back to importing %s' % self.module_full_name
+
+        if not compiled:
+            module = self.session.module_loader.load_module(self.module_full_name, session=self.session)
+
+            if self.session.config['verbose']:
+                print '+ Compiling tags from %s' % self.module_full_name
+
+            # "Screw you guys - I'm going home!" -- Cartman
+            if not module:
+                print 'No module returned by the module loader: %s' % self.module_full_name
+                return False
+
+            self.handle_context(target=module, parent_context=module)
+
+        if self.session.config['verbose']:
+            test_module_details = self.session.test_module_details
+            counters = self.session.run_stats.counters
+            mods = len(test_module_details)
+            classes = sum(len(x.class_list) for x in test_module_details.values())
+            print '+ Found %d modules, %d classes (%d objects visited, %d tags found so far)' % (
+                mods, classes, counters['objects_visited'], counters['tags_found'])
+
+        return True
+
+    def compile_static(self):
         """
-        module = _module_loader.load_module(self.module_full_name)
+        Runs the scanner over the module's source text, without importing the module.
+        :returns: True if compiled, False if the source doesn't parse, None if the module has to be imported
+                  instead (no source found, or docstrings that are built at runtime)
+        :unit_test: compile_static
+        :unit_test: compile_static_unknown_module
+        :unit_test: compile_static_syntax_error
+        """
+        source_path = self.session.module_loader.find_source(self.module_full_name)
+        if not source_path:
+            return None
+        return self._compile_source(source_path=source_path)
 
-        if tddtags_config['verbose']:
-            print '+ Compiling tags from %s' % self.module_full_name
+    def compile_source(self, source_path, source):
+        """
+        Runs the scanner over the given source text instead of the module on disk - e.g. the content
+        git has staged for it. Never imports the module.
+        :param source_path: The path the source is for
+        :param source: The source text
+        :returns: True if compiled, False for a syntax error, None for docstrings that are built at runtime
+        :unit_test: compile_source
+        :unit_test: compile_source_runtime_docstring
+        """
+        with self.session.run_stats.phase('compile'):
+            return self._compile_source(source_path=source_path, source=source)
 
-        # "Screw you guys - I'm going home!" -- Cartman
-        if not module:
-            print 'No module returned by the module loader: %s' % self.module_full_name
+    def _compile_source(self, source_path, source=None):
+        start = time.time()
+        try:
+            module = CompileTags.parse_source(source_path=source_path, module_name=self.module_full_name, source=source,
+                                              strict=True, session=self.session)
+        except SyntaxError as ex:
+            print '- Failed to parse module source: %s -> %s' % (source_path, ex)
             return False
+        if not module:
+            return None
+        if self.session.event_hooks:
+            self.session.event_hooks.fire(hooks.MODULE_LOADED, name=self.module_full_name, path=source_path,
+                                          seconds=time.time() - start, static=True)
+
+        if self.session.config['verbose']:
+            print '+ Compiling tags from %s (static)' % source_path
 
         self.handle_context(target=module, parent_context=module)
+        return True
 
-        if tddtags_config['verbose']:
-            # TODO I think I'd also like to see total methods inspected and total tags found
-            mods = len(_test_module_details)
-            classes = sum(len(x.class_list) for x in _test_module_details.values())
-            print '+ Found %d modules, %d classes' % (mods, classes)
+    @classmethod
+    def parse_source(cls, source_path, module_name, source=None, strict=False, session=None):
+        """
+        Builds the SourceContext tree for a module from its source file. The children are ordered
+        the way inspect.getmembers() hands them to the import mode: a module's classes and then its
+        functions, a class's static methods and then its other methods, each sorted by name.
+
+        :param source_path: The path to the module's source file
+        :param module_name: The [package.]module name, used for the module's default test name
+        :param source: The source text, e.g. an editor's unsaved buffer. Default is to read source_path.
+        :param strict: Raise the SyntaxError for source that doesn't parse, rather than returning None
+        :param session: The TDDTagSession whose config says how chatty to be. Default is the global session.
+        :returns: The module's SourceContext, or None if the source can't be used (syntax error, or
+                  docstrings that are built at runtime)
+        :raises: SyntaxError, if strict
+        :unit_test: parse_source
+        :unit_test: parse_source_text
+        :unit_test: parse_source_runtime_docstring
+        :unit_test: parse_source_syntax_error
+        """
+        if source is None:
+            with open(source_path) as source_file:
+                source = source_file.read()
 
-        return True
+        try:
+            tree = ast.parse(source, source_path)
+        except SyntaxError as ex:
+            if strict:
+                raise
+            print '- Failed to parse module source: %s -> %s' % (source_path, ex)
+            return None
+
+        if cls._has_runtime_docstrings(tree):
+            if get_session(session).config['verbose']:
+                print '+ Docstrings are built at runtime in %s' % source_path
+            return None
+
+        # --> Later definitions of a name replace earlier ones, same as the module namespace
+        module_end_line = max(len(source.splitlines()), 1)
+        end_lines = cls._get_end_lines(tree.body, module_end_line)
+        members = {}
+        for node in tree.body:
+            if isinstance(node, ast.ClassDef):
+                members[node.name] = cls._class_context(node, end_lines[node])
+            elif isinstance(node, ast.FunctionDef):
+                members[node.name] = SourceContext(node.name, ast.get_docstring(node, clean=False), SourceContext.KIND_FUNCTION,
+                                                   line=node.lineno, end_line=end_lines[node])
+
+        children = cls._sorted_children(members, SourceContext.KIND_CLASS)
+        children.extend(cls._sorted_children(members, SourceContext.KIND_FUNCTION))
+        return SourceContext(module_name, ast.get_docstring(tree, clean=False), SourceContext.KIND_MODULE, children, line=1,
+                             end_line=module_end_line)
+
+    @staticmethod
+    def _get_end_lines(body, end_line):
+        """
+        :param body: A module's or class's list of statement nodes
+        :param end_line: The last line of the module or class
+        :returns: Dict of statement node -> its last line: the line before the next statement starts, or
+                  end_line for the last one
+        """
+        end_lines = {}
+        for node, next_node in zip(body, body[1:] + [None]):
+            end_lines[node] = next_node.lineno - 1 if next_node else end_line
+        return end_lines
+
+    @classmethod
+    def _class_context(cls, node, end_line=None):
+        """
+        Creates the SourceContext for a class definition node. Properties are skipped, since
+        the import mode doesn't see them as methods.
+        """
+        end_lines = cls._get_end_lines(node.body, end_line)
+        static_methods = {}
+        methods = {}
+        for item in node.body:
+            if not isinstance(item, ast.FunctionDef):
+                continue
+
+            static_methods.pop(item.name, None)
+            methods.pop(item.name, None)
+
+            decorators = [cls._decorator_name(decorator) for decorator in item.decorator_list]
+            if [name for name in decorators if name in ('property', 'setter', 'getter', 'deleter')]:
+                continue
+
+            context = SourceContext(item.name, ast.get_docstring(item, clean=False), SourceContext.KIND_FUNCTION, line=item.lineno,
+                                    end_line=end_lines[item])
+            if 'staticmethod' in decorators:
+                static_methods[item.name] = context
+            else:
+                methods[item.name] = context
+
+        children = sorted(static_methods.items())
+        children.extend(sorted(methods.items()))
+        return SourceContext(node.name, ast.get_docstring(node, clean=False), SourceContext.KIND_CLASS, children, line=node.lineno,
+                             end_line=end_line)
+
+    @staticmethod
+    def _sorted_children(members, kind):
+        return sorted((name, context) for name, context in members.items() if context.kind == kind)
+
+    @staticmethod
+    def _decorator_name(decorator):
+        if isinstance(decorator, ast.Call):
+            decorator = decorator.func
+        if isinstance(decorator, ast.Name):
+            return decorator.id
+        if isinstance(decorator, ast.Attribute):
+            return decorator.attr
+        return None
+
+    @staticmethod
+    def _has_runtime_docstrings(tree):
+        """
+        Checks for docstrings that only exist once the module runs: assignments to __doc__, and
+        docstrings built with an expression such as '...' % value or '...'.format(value).
+        """
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.Assign, ast.AugAssign)):
+                targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+                for target in targets:
+                    if isinstance(target, ast.Name) and target.id == '__doc__':
+                        return True
+                    if isinstance(target, ast.Attribute) and target.attr == '__doc__':
+                        return True
+
+            if isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef)) and node.body:
+                first = node.body[0]
+                if not isinstance(first, ast.Expr):
+                    continue
+                value = first.value
+                if isinstance(value, ast.BinOp) and isinstance(value.left, ast.Str):
+                    return True
+                if isinstance(value, ast.Call) and isinstance(value.func, ast.Attribute) and isinstance(value.func.value, ast.Str):
+                    return True
+        return False
 
     def dump(self):
         """
         """
-        print _test_module_details
-        print _test_module_details.keys()
+        test_module_details = self.session.test_module_details
+        print test_module_details
+        print test_module_details.keys()
 
-        for key in _test_module_details:
-            _test_module_details[key].dump()
+        for key in test_module_details:
+            test_module_details[key].dump()
 
     @staticmethod
     def get_default_test_name(context):
@@ -823,7 +2233,7 @@ class CompileTags(object):
         if not name:
             print 'No name found for context: %s' % str(context)
             return 'UnknownName'
-        if inspect.isclass(context):
+        if inspect.isclass(context) or getattr(context, 'kind', None) == SourceContext.KIND_CLASS:
             return name + 'Tests'
         else:
             return name
@@ -839,15 +2249,31 @@ class CompileTags(object):
         test_module_name = self.unit_test_module[-1]
         test_class_name = self.unit_test_class[-1]
 
-        if test_module_name not in _test_module_details:
-            _test_module_details[test_module_name] = UTModuleDetails(module_name=test_module_name)
-
-        gen_module = _test_module_details[test_module_name]
-        gen_class = gen_module.add_class(test_class_name, gen_module.test_base_class)
-
         method_name = test_name or CompileTags.get_default_test_name(context)
         # print '>> %s:%s %s' % (test_name, method_name, test_class_name)
-        gen_class.add_method(method_name=method_name)
+        record = (test_module_name, test_class_name, method_name)
+        self.tag_records.append(record)
+        self.tag_symbols.append(('.'.join(self._context_names) or self.module_full_name, CompileTags.get_context_line(context)))
+        self.session.add_tag_record(record)
+
+    @staticmethod
+    def get_context_line(context):
+        """
+        :returns: The 1 based line a module, class or function starts on, None if it can't be found
+        :unit_test: get_context_line
+        """
+        if isinstance(context, SourceContext):
+            return context.line
+        if inspect.ismodule(context):
+            return 1
+
+        code = getattr(getattr(context, '__func__', context), '__code__', None)
+        if code:
+            return code.co_firstlineno
+        try:
+            return inspect.findsource(context)[1] + 1
+        except (IOError, TypeError):
+            return None
 
     def push_modules_and_classes(self, modules, test_classes, context):
         """ Potentially pushes a test target module or test class.
@@ -883,16 +2309,27 @@ class CompileTags(object):
         """
         # if self.verbose:
         #     print 'handle_context: %s parent: %s' % (target, parent_context)
+        run_stats = self.session.run_stats
+        run_stats.count('objects_visited')
+        # --> An imported method's function is visited as a child of it, but it's the same symbol
+        is_method_function = target is not parent_context and getattr(parent_context, '__func__', None) is target
+        if not is_method_function:
+            self._context_names.append(target.__name__)
         modules = []
         test_classes = []
         # --> Extract the possible keywords in the docstrings
         if target.__doc__:
-            keywords = CompileTags.extract_keywords(target.__doc__)
+            start = time.time()
+            keywords = CompileTags.extract_keywords(target.__doc__, memo=self.session.keyword_memo)
+            run_stats.count('docstrings_scanned')
+            run_stats.count('tags_found', len(keywords))
+            if self.session.event_hooks:
+                self._fire_scan_events(target, keywords, time.time() - start)
 
             # --> What types of keywords we gotz?
-            unit_tests = [value for keyword, value in keywords if keyword == 'unit_test']
-            modules = [value for keyword, value in keywords if keyword == 'unit_test_module']
-            test_classes = [value for keyword, value in keywords if keyword == 'unit_test_class']
+            unit_tests = [value for keyword, value, description in keywords if keyword == 'unit_test']
+            modules = [value for keyword, value, description in keywords if keyword == 'unit_test_module']
+            test_classes = [value for keyword, value, description in keywords if keyword == 'unit_test_class']
 
             # --> Possibly push the output module name or test class container name
             self.push_modules_and_classes(modules=modules, test_classes=test_classes, context=target)
@@ -904,17 +2341,29 @@ class CompileTags(object):
         # --> Do I have any children I care about?
         # child_list = inspect.getmembers(target, inspect.isfunction)
         child_list = []
-        if inspect.ismodule(target):
-            child_list.extend(self.get_module_classes(target))
-            child_list.extend(inspect.getmembers(target, inspect.isfunction))
+        if isinstance(target, SourceContext):
+            child_list.extend(target.children)
         else:
-            child_list.extend(inspect.getmembers(target, inspect.isfunction))
-        child_list.extend(self.get_class_methods(target=target))
+            if inspect.ismodule(target):
+                child_list.extend(self.get_module_classes(target))
+                child_list.extend(inspect.getmembers(target, inspect.isfunction))
+            else:
+                child_list.extend(inspect.getmembers(target, inspect.isfunction))
+            child_list.extend(self.get_class_methods(target=target))
 
         self.iterate_child_list(children=child_list, context=target)
 
         # --> Unwind, if we pushed module name or class name
         self.pop_module_and_class(modules=modules, test_classes=test_classes)
+        if not is_method_function:
+            self._context_names.pop()
+
+    def _fire_scan_events(self, target, keywords, seconds):
+        name = getattr(target, '__name__', str(target))
+        event_hooks = self.session.event_hooks
+        event_hooks.fire(hooks.DOCSTRING_SCANNED, name=name, size=len(target.__doc__), tags=len(keywords), seconds=seconds)
+        for keyword, value, description in keywords:
+            event_hooks.fire(hooks.TAG_FOUND, name=name, keyword=keyword, value=value, description=description)
 
     def get_module_classes(self, target):
         """
@@ -955,21 +2404,138 @@ class CompileTags(object):
             self.handle_context(target=entity, parent_context=context)
 
     @classmethod
-    def extract_keywords(cls, docstrings):
-        """ Extracts our keywords from the docstrings
+    def extract_keywords(cls, docstrings, memo=None):
+        """ Extracts our keywords from the docstrings. Docstrings without any tags are skipped with a
+        substring check, and the results are remembered by docstring text.
         :param docstrings: The text from __doc__ for a context.
-        :returns: The list of keywords/values discovered as a tuple
+        :param memo: The docstring -> keywords dict to remember them in. Default is the global session's.
+        :returns: The list of (keyword, value, description) tuples discovered, in order. The description
+                  is any text after the value, '' if none.
         :unit_test:
+        :unit_test: extract_keywords_no_tags
+        :unit_test: extract_keywords_memo
         """
-        keywords = []
-        for line in docstrings.splitlines():
-            m = re.search(cls.re_keyword_line, line)
-            if not m:
-                continue
+        if cls.keyword_prefix not in docstrings:
+            return []
+
+        if memo is None:
+            memo = get_session().keyword_memo
+        keywords = memo.get(docstrings)
+        if keywords is None:
+            keywords = [(m.group(1), m.group(2), m.group(3).rstrip()) for m in cls.re_keyword_line.finditer(docstrings)]
+            if len(memo) >= cls.keyword_memo_limit:
+                memo.clear()
+            memo[docstrings] = keywords
+
+        return list(keywords)
+
+
+def add_tag_record(record, test_module_details=None):
+    """
+    Adds a compiled tag to the test module details.
+    :param record: The (test module, test class, test method) tuple
+    :param test_module_details: The model to add to. Default is the global session's.
+    :unit_test:
+    """
+    if test_module_details is None:
+        test_module_details = _test_module_details
+
+    test_module_name, test_class_name, method_name = record
+    if test_module_name not in test_module_details:
+        test_module_details[test_module_name] = UTModuleDetails(module_name=test_module_name)
+
+    gen_module = test_module_details[test_module_name]
+    gen_class = gen_module.add_class(test_class_name, gen_module.test_base_class)
+    gen_class.add_method(method_name=method_name)
+
+
+def memory_checkpoint(label, **retained):
+    """
+    Records a checkpoint with the global session's memory profiler, if there is one.
+    :param label: The phase the checkpoint ends
+    :param retained: Objects the run is holding on to, by name. Their retained sizes are recorded.
+    :unit_test:
+    """
+    return _global_session.memory_checkpoint(label, **retained)
 
-            keywords.append((m.group(1), m.group(2)))
 
-        return keywords
+_worker_session = None  # The TDDTagSession of a compile worker process
+
+
+def _init_compile_worker(module_loader, config):
+    """
+    Sets up a compile worker process with a session made from the parent's module loader and config.
+    """
+    global _worker_session
+    _worker_session = TDDTagSession(config=config, module_loader=module_loader)
+
+
+def _compile_module(compiler):
+    """
+    Compiles one module of a run, so that whatever goes wrong with it fails that module and not the run.
+    :returns: True if compiled
+    """
+    try:
+        return compiler.compile()
+    except Exception as ex:
+        print '- Failed to compile the tags from %s -> %s: %s' % (compiler.module_full_name, type(ex).__name__, ex)
+        return False
+
+
+def _compile_worker(module_name):
+    """
+    Compiles a single module in a worker process.
+    :returns: A tuple of (compiled, tag_records, the worker's stats counters for the module, the module's
+              ImportCost or None)
+    """
+    _worker_session.reset()
+    compiler = CompileTags(source_module_name=module_name, session=_worker_session)
+    compiled = _compile_module(compiler)
+    import_cost = _worker_session.module_loader.import_costs.pop(module_name, None)
+    return compiled, compiler.tag_records, _worker_session.run_stats.counters, import_cost
+
+
+def read_target_list(list_file):
+    """
+    Reads a newline-separated list of scan targets. Blank lines and # comments are skipped.
+    :unit_test:
+    """
+    targets = []
+    for line in list_file:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            targets.append(line)
+    return targets
+
+
+def expand_targets(targets, excludes=None, module_loader=None):
+    """
+    Expands the scan targets into the list of module names to compile, without duplicates and in
+    the order given. On top of what ModuleLoader.find_module_names() takes, a target of '-' reads a
+    list of targets from stdin and '@path' reads one from a file.
+    :param targets: The list of targets
+    :param excludes: Optional list of fnmatch patterns for files/directories to skip
+    :param module_loader: The ModuleLoader to find the modules with. Default is the global one.
+    :unit_test: expand_targets
+    :unit_test: expand_targets_list_file
+    """
+    module_loader = module_loader or _module_loader
+    names = []
+    seen = set()
+    for target in targets:
+        if target == '-':
+            expanded = expand_targets(read_target_list(sys.stdin), excludes=excludes, module_loader=module_loader)
+        elif target.startswith('@'):
+            with open(target[1:]) as list_file:
+                expanded = expand_targets(read_target_list(list_file), excludes=excludes, module_loader=module_loader)
+        else:
+            expanded = module_loader.find_module_names(target, excludes=excludes)
+
+        for name in expanded:
+            if name not in seen:
+                seen.add(name)
+                names.append(name)
+    return names
 
 
 def create_module_loader(anchor_dir=None):
@@ -985,3 +2551,115 @@ def create_module_loader(anchor_dir=None):
         anchor_dir = os.path.abspath(anchor_dir)
 
     _module_loader = ModuleLoader(anchor_dir=anchor_dir)
+
+
+class FrozenConfig(collections.Mapping):
+    """
+    A read-only copy of a config dictionary, so a session's config can't change under it mid-run.
+    :unit_test_class: FrozenConfigTests
+    """
+    def __init__(self, config):
+        """
+        :param config: The dictionary to copy
+        :unit_test: create_instance
+        """
+        self._config = dict(config)
+
+    def __getitem__(self, key):
+        return self._config[key]
+
+    def __iter__(self):
+        return iter(self._config)
+
+    def __len__(self):
+        return len(self._config)
+
+    def __repr__(self):
+        return 'FrozenConfig(%r)' % self._config
+
+
+class TDDTagSession(object):
+    """
+    The state of one tddtags scan: the config it runs with, the module loader, the compiled model,
+    the stats, the event hooks and the formatter. Two sessions in the same process don't see each
+    other's state, except for what the imports share through sys.modules and sys.path.
+    :unit_test_class: TDDTagSessionTests
+    """
+    def __init__(self, anchor_dir=None, config=None, module_loader=None, formatter=None):
+        """
+        :param anchor_dir: The directory to find modules from, for a new ModuleLoader. Default is the cwd.
+        :param config: Overrides for the tddtags_config defaults. The session takes a frozen copy.
+        :param module_loader: A ModuleLoader to use rather than making one
+        :param formatter: A Formatter to use rather than one made from the config
+        :unit_test: create_instance
+        :unit_test: create_instance_config
+        """
+        settings = dict(tddtags_config)
+        settings.update(config or {})
+        self.config = FrozenConfig(settings)
+
+        if module_loader is None:
+            module_loader = ModuleLoader(anchor_dir=os.path.abspath(anchor_dir or os.getcwd()))
+        self.module_loader = module_loader
+        self.formatter = formatter or Formatter(config=self.config)
+
+        self.test_module_details = {}
+        self.run_stats = RunStats()
+        self.event_hooks = EventHooks()
+        self.memory_profiler = None  # A stats.MemoryProfiler when --memprofile is on
+        self.keyword_memo = {}  # Docstring -> extracted keywords. Shared and inherited docstrings are only scanned once.
+
+    def add_tag_record(self, record):
+        """
+        :unit_test:
+        """
+        add_tag_record(record, test_module_details=self.test_module_details)
+
+    def memory_checkpoint(self, label, **retained):
+        """
+        Records a checkpoint with the memory profiler, if there is one.
+        :param label: The phase the checkpoint ends
+        :param retained: Objects the run is holding on to, by name. Their retained sizes are recorded.
+        :unit_test:
+        """
+        if not self.memory_profiler:
+            return None
+        sizes = dict((name, retained_size(obj)) for name, obj in retained.items())
+        return self.memory_profiler.checkpoint(label, **sizes)
+
+    def reset(self):
+        """
+        Drops the compiled model and zeroes the stats, to run the session again.
+        :unit_test:
+        """
+        self.test_module_details.clear()
+        self.run_stats.reset()
+
+
+class _GlobalSession(TDDTagSession):
+    """
+    The session used when none is given. It reads and writes the module globals, so code that sets
+    tddtags_config, _module_loader or default_formatter directly keeps working.
+    """
+    def __init__(self):
+        pass
+
+    config = property(lambda self: tddtags_config)
+    module_loader = property(lambda self: _module_loader)
+    formatter = property(lambda self: default_formatter)
+    test_module_details = property(lambda self: _test_module_details)
+    run_stats = property(lambda self: _run_stats)
+    event_hooks = property(lambda self: _event_hooks)
+    memory_profiler = property(lambda self: _memory_profiler)
+    keyword_memo = property(lambda self: _keyword_memo)
+
+
+_global_session = _GlobalSession()
+
+
+def get_session(session=None):
+    """
+    :returns: session, or the global session if it's None
+    :unit_test:
+    """
+    return session if session is not None else _global_session
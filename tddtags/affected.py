@@ -0,0 +1,186 @@
+"""
+Test impact selection from the tags. The tags already say which tests belong to which code, so the
+tests to run for a change are the ones tagged on the functions and classes it touched:
+
+- git says which lines of which .py files changed since a ref
+- each changed file is compiled from its source, and every changed line is put down to the innermost
+  function or class around it - or to the module, for a line outside of them all
+- a tag is affected if it's on a changed symbol, within one (a class or module change covers what's in
+  it) or around one (a class or module tag covers what's in it)
+- the affected tags that have a test method are the tests to run
+
+--> The related default test [package.]module to update
+:unit_test_module: tests.test_affected
+--> The default TestCase class for module-level functions
+:unit_test_class: AffectedGlobalTests
+"""
+import os
+
+from tddtags import vcs
+from tddtags._core import CompileTags, ModuleLoader, UTModuleContainer, get_session
+
+
+class AffectedTest(object):
+    """
+    A test method to run.
+    :unit_test_class: AffectedTestTests
+    """
+    def __init__(self, path, module_name, class_name, method_name):
+        """
+        :param path: The path of the test module
+        :param module_name: The test [package.]module name
+        :param class_name: The test class
+        :param method_name: The test method
+        :unit_test: create_instance
+        """
+        self.path = path
+        self.module_name = module_name
+        self.class_name = class_name
+        self.method_name = method_name
+
+    def __eq__(self, other):
+        return isinstance(other, AffectedTest) and self.key() == other.key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def key(self):
+        return self.path, self.class_name, self.method_name
+
+    def pytest_id(self, root_dir=None):
+        """
+        :param root_dir: The directory pytest runs from. Default is getcwd().
+        :returns: The pytest node id, path/to/test_x.py::FooTests::test_bar
+        :unit_test: pytest_id
+        """
+        return '%s::%s::%s' % (os.path.relpath(self.path, root_dir or os.getcwd()), self.class_name, self.method_name)
+
+    def unittest_id(self):
+        """
+        :returns: The unittest name, package.test_x.FooTests.test_bar
+        :unit_test: unittest_id
+        """
+        return '%s.%s.%s' % (self.module_name, self.class_name, self.method_name)
+
+
+def get_symbol_spans(context, prefix=''):
+    """
+    Lists where each module, class and function in a parsed module is.
+    :param context: The SourceContext from CompileTags.parse_source()
+    :param prefix: The qualified name of the context's parent
+    :returns: List of (qualified symbol, first line, last line), outer ones before the ones within them
+    :unit_test: get_symbol_spans
+    """
+    symbol = prefix + '.' + context.__name__ if prefix else context.__name__
+    spans = [(symbol, context.line, context.end_line)]
+    for name, child in context.children:
+        spans.extend(get_symbol_spans(child, prefix=symbol))
+    return spans
+
+
+def find_changed_symbols(module, changed_lines):
+    """
+    :param module: The module's SourceContext
+    :param changed_lines: The set of line numbers that changed
+    :returns: The set of qualified symbols: the innermost function, class or module around each changed line
+    :unit_test: find_changed_symbols
+    """
+    spans = get_symbol_spans(module)
+    changed = set()
+    for line in changed_lines:
+        innermost = [symbol for symbol, first, last in spans if first <= line <= last]
+        changed.add(innermost[-1] if innermost else module.__name__)
+    return changed
+
+
+def is_affected(symbol, changed_symbols):
+    """
+    :returns: True if a tag on symbol is affected by the changes to changed_symbols: the same symbol, or
+              one within the other
+    :unit_test: is_affected
+    """
+    for changed in changed_symbols:
+        if symbol == changed or symbol.startswith(changed + '.') or changed.startswith(symbol + '.'):
+            return True
+    return False
+
+
+def select_tags(source_path, changed_lines, session=None):
+    """
+    Compiles a changed source file and picks out the tags that the changed lines affect. A module whose
+    docstrings are built at runtime can't be mapped to lines, so all of its tags are picked.
+    :param source_path: The path of the source file
+    :param changed_lines: The set of line numbers that changed
+    :param session: The TDDTagSession to compile in. Default is the global session.
+    :returns: (list of affected (test module, test class, test method) records, set of changed symbols)
+    :unit_test: select_tags
+    :unit_test: select_tags_runtime_docstrings
+    """
+    session = get_session(session)
+    module_name = ModuleLoader.module_name_for_path(source_path)
+    compiler = CompileTags(source_module_name=module_name, session=session)
+
+    module = CompileTags.parse_source(source_path=source_path, module_name=module_name, session=session)
+    if module:
+        changed_symbols = find_changed_symbols(module, changed_lines)
+        compiler.handle_context(target=module, parent_context=module)
+    else:
+        changed_symbols = set([module_name])
+        if not compiler.compile():
+            return [], set()
+
+    records = [record for record, (symbol, line) in zip(compiler.tag_records, compiler.tag_symbols)
+               if is_affected(symbol, changed_symbols)]
+    return records, changed_symbols
+
+
+def resolve_tests(records, session=None):
+    """
+    Turns tag records into the test methods to run. A tag whose test module, class or method
+    hasn't been written yet has nothing to run, and is left out.
+    :param records: The (test module, test class, test method) records
+    :param session: The TDDTagSession whose module loader finds the test modules. Default is the global session.
+    :returns: The list of AffectedTests, sorted by test module path, class and method
+    :unit_test: resolve_tests
+    """
+    session = get_session(session)
+    paths = {}
+    test_names = {}
+    tests = set()
+    for module_name, class_name, method_name in records:
+        if module_name not in paths:
+            paths[module_name] = session.module_loader.find_source(module_name)
+            test_names[module_name] = UTModuleContainer.read_test_names(paths[module_name]) if paths[module_name] else {}
+        test_method = 'test_' + method_name
+        if test_method in test_names[module_name].get(class_name, ()):
+            tests.add(AffectedTest(paths[module_name], module_name, class_name, test_method))
+    return sorted(tests, key=AffectedTest.key)
+
+
+def find_affected_tests(ref, session=None, excludes=None):
+    """
+    Finds the tests tagged on the source that changed since the merge base of ref and HEAD, under the
+    session's anchor directory.
+    :param ref: The branch, tag or commit to compare against
+    :param session: The TDDTagSession to work in. Default is the global session.
+    :param excludes: Optional list of fnmatch patterns for the files to leave out
+    :returns: (the list of AffectedTests, the sorted list of changed symbols)
+    :raises: vcs.GitError
+    :unit_test: find_affected_tests
+    """
+    session = get_session(session)
+    anchor_dir = os.path.realpath(session.module_loader.anchor_dir)
+    top_dir = vcs.get_top_dir(anchor_dir)
+
+    records = []
+    changed_symbols = set()
+    for path, changed_lines in sorted(vcs.get_changed_lines(top_dir, ref).items()):
+        if not path.startswith(os.path.join(anchor_dir, '')) or ModuleLoader.is_excluded(path, anchor_dir, excludes or []):
+            continue
+        file_records, file_symbols = select_tags(path, changed_lines, session=session)
+        records.extend(file_records)
+        changed_symbols.update(file_symbols)
+    return resolve_tests(records, session=session), sorted(changed_symbols)
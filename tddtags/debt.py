@@ -0,0 +1,227 @@
+"""
+The stub debt: the generated test methods that nobody has written yet. A stub's body is still the
+configured test_method_body, so the test modules are read a line at a time for the test methods, by
+the same rules as UTModuleContainer, and the ones whose body matches it are counted. Nothing is
+imported, and the files are spread over a pool of worker processes.
+
+The owning source module of a stub is the one whose tag calls for it, looked up in the tag index
+(see tddtags.index) when there is one.
+
+--> The related default test [package.]module to update
+:unit_test_module: tests.test_debt
+--> The default TestCase class for module-level functions
+:unit_test_class: DebtGlobalTests
+"""
+import os
+import time
+import fnmatch
+import multiprocessing
+
+from tddtags._core import ModuleLoader, UTModuleContainer, get_session, get_stub_lines
+
+DEFAULT_TEST_PATTERN = 'test*.py'
+
+# --> A stub with no tag in the index, or scanned without an index
+UNKNOWN_SOURCE = '?'
+
+
+class StubDebt(object):
+    """
+    The stubs found in a set of test modules, and the counts of them by test module, class and source module.
+    :unit_test_class: StubDebtTests
+    """
+    def __init__(self):
+        """
+        :unit_test: create_instance
+        """
+        self.test_modules = 0
+        self.test_methods = 0
+        self.stubs = []  # (test module, test class, test method, path, line), in the order found
+        self.sources = {}  # test id -> list of the source modules whose tags call for it
+        self.seconds = 0.0
+
+    def add(self, module_name, path, method_count, stubs):
+        """
+        Adds a scanned test module.
+        :param module_name: The test [package.]module name
+        :param path: Its path
+        :param method_count: The count of test methods in it
+        :param stubs: Its stubs, as (test class, test method, line)
+        :unit_test: add
+        """
+        self.test_modules += 1
+        self.test_methods += method_count
+        for class_name, method_name, line in stubs:
+            self.stubs.append((module_name, class_name, method_name, path, line))
+
+    def resolve_sources(self, index):
+        """
+        Looks up the owning source modules of the stubs in a tag index, a test module at a time.
+        :param index: The tddtags.index.TagIndex
+        :unit_test: resolve_sources
+        """
+        for module_name in sorted(set(stub[0] for stub in self.stubs)):
+            for row in index.find_sources(module_name):
+                owners = self.sources.setdefault(row['test_id'], [])
+                if row['source_module'] not in owners:
+                    owners.append(row['source_module'])
+
+    def count_by(self, key):
+        """
+        :param key: 'module', 'class' or 'source'
+        :returns: List of (name, stub count), the most stubs first. A stub with more than one source module
+                  counts for each.
+        :unit_test: count_by
+        """
+        counts = {}
+        for module_name, class_name, method_name, path, line in self.stubs:
+            if key == 'module':
+                names = [module_name]
+            elif key == 'class':
+                names = ['%s.%s' % (module_name, class_name)]
+            else:
+                names = self.sources.get('%s.%s.%s' % (module_name, class_name, method_name)) or [UNKNOWN_SOURCE]
+            for name in names:
+                counts[name] = counts.get(name, 0) + 1
+        return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+    def to_dict(self):
+        """
+        :unit_test: to_dict
+        """
+        return {
+            'test_modules': self.test_modules,
+            'test_methods': self.test_methods,
+            'stubs': len(self.stubs),
+            'seconds': round(self.seconds, 3),
+            'by_module': dict(self.count_by('module')),
+            'by_class': dict(self.count_by('class')),
+            'by_source': dict(self.count_by('source')),
+            'stub_methods': [{'test_id': '%s.%s.%s' % (module_name, class_name, method_name), 'path': path, 'line': line}
+                             for module_name, class_name, method_name, path, line in self.stubs],
+        }
+
+    def format_report(self, top=None):
+        """
+        :param top: The most lines to list for each count. Default is all of them.
+        :returns: The report as a list of lines
+        :unit_test: format_report
+        """
+        percent = 100.0 * len(self.stubs) / self.test_methods if self.test_methods else 0.0
+        lines = ['Stub debt: %d of %d test methods (%.1f%%) in %d test modules are unimplemented stubs (%.2fs)'
+                 % (len(self.stubs), self.test_methods, percent, self.test_modules, self.seconds)]
+        for title, key in [('test module', 'module'), ('test class', 'class'), ('source module', 'source')]:
+            counts = self.count_by(key)
+            if not counts:
+                continue
+            lines.append('')
+            lines.append('By %s:' % title)
+            for name, count in counts[:top]:
+                lines.append('  %6d  %s' % (count, name))
+            if top and len(counts) > top:
+                lines.append('  ... and %d more' % (len(counts) - top))
+        return lines
+
+
+def find_stubs(path, stub_lines):
+    """
+    Reads a test module for its test methods, and the ones whose body is only the stub. Blank and
+    comment lines in a body are ignored.
+    :param path: The path of the test module
+    :param stub_lines: The stub body from get_stub_lines()
+    :returns: (the count of test methods, list of the stubs as (test class, test method, line))
+    :raises: IOError
+    :unit_test: find_stubs
+    """
+    method_count = 0
+    stubs = []
+    class_name = None
+    method = None  # (class, method, line, body lines) of the test method being read
+    with open(path) as module_file:
+        for number, line in enumerate(module_file, 1):
+            if method is not None:
+                stripped = line.strip()
+                if not stripped or stripped.startswith('#'):
+                    continue
+                if line.startswith('        '):
+                    method[3].append(stripped)
+                    continue
+                if method[3] == stub_lines:
+                    stubs.append(method[:3])
+                method = None
+
+            if not line.startswith(' '):
+                m = UTModuleContainer.re_any_class_line.match(line)
+                if m:
+                    class_name = m.group(1)
+                elif line.strip() and not line.startswith('#'):
+                    class_name = None  # Top level code ends the class
+            elif class_name and line.startswith('    def test'):
+                m = UTModuleContainer.re_method_line.match(line)
+                if m:
+                    method_count += 1
+                    method = (class_name, m.group(1), number, [])
+
+    if method is not None and method[3] == stub_lines:
+        stubs.append(method[:3])
+    return method_count, stubs
+
+
+def find_test_modules(top_dir, pattern=DEFAULT_TEST_PATTERN, excludes=None):
+    """
+    :param top_dir: The directory to walk
+    :param pattern: The fnmatch pattern for a test module's file name
+    :param excludes: Optional list of fnmatch patterns to skip
+    :returns: The sorted list of test module paths
+    :unit_test: find_test_modules
+    """
+    return [path for path in ModuleLoader.find_source_files(top_dir, excludes)
+            if fnmatch.fnmatch(os.path.basename(path), pattern)]
+
+
+def scan_debt(paths, session=None, jobs=1, index=None):
+    """
+    Finds the stubs in test modules.
+    :param paths: The test module paths
+    :param session: The TDDTagSession whose test_method_body is the stub. Default is the global session.
+    :param jobs: The number of processes to read the files with
+    :param index: Optional TagIndex to look up the owning source modules in
+    :returns: The StubDebt
+    :unit_test: scan_debt
+    :unit_test: scan_debt_parallel
+    """
+    session = get_session(session)
+    start = time.time()
+    stub_lines = get_stub_lines(session.config['test_method_body'])
+    work = [(path, stub_lines) for path in paths]
+
+    if jobs > 1 and len(work) > 1:
+        pool = multiprocessing.Pool(processes=min(jobs, len(work)))
+        try:
+            results = pool.map(_find_stubs_worker, work, max(1, len(work) // (jobs * 4)))
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        results = [_find_stubs_worker(item) for item in work]
+
+    debt = StubDebt()
+    for path, (method_count, stubs) in zip(paths, results):
+        if method_count is not None:
+            debt.add(ModuleLoader.module_name_for_path(path), path, method_count, stubs)
+    if index:
+        debt.resolve_sources(index)
+    debt.seconds = time.time() - start
+    return debt
+
+
+def _find_stubs_worker(item):
+    """
+    Reads one test module in a worker process.
+    :returns: find_stubs()'s result, or (None, None) if the file couldn't be read
+    """
+    path, stub_lines = item
+    try:
+        return find_stubs(path, stub_lines)
+    except IOError:
+        return None, None
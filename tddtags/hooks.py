@@ -0,0 +1,67 @@
+"""
+Event hooks, for tools that embed tddtags and want to watch what it does.
+
+--> The related default test [package.]module to update
+:unit_test_module: tests.test_hooks
+"""
+
+# --> The events, and the details each one is fired with
+MODULE_LOADED = 'module_loaded'                # name, path, seconds, static
+DOCSTRING_SCANNED = 'docstring_scanned'        # name, size, tags, seconds
+TAG_FOUND = 'tag_found'                        # name, keyword, value, description
+TEST_CLASS_CREATED = 'test_class_created'      # module_path, class_name, methods, lines
+TEST_METHOD_INSERTED = 'test_method_inserted'  # module_path, class_name, method_name, lines
+TEST_METHOD_REMOVED = 'test_method_removed'    # module_path, class_name, method_name, lines
+MODULE_SAVED = 'module_saved'                  # path, size, changed, seconds
+
+EVENTS = (MODULE_LOADED, DOCSTRING_SCANNED, TAG_FOUND, TEST_CLASS_CREATED, TEST_METHOD_INSERTED, TEST_METHOD_REMOVED,
+          MODULE_SAVED)
+
+
+class EventHooks(object):
+    """
+    The callbacks registered for each event. A callback is called as callback(event, **details).
+    Callers check the hooks are truthy before building the details, so an empty registry costs
+    next to nothing.
+    :unit_test_class: EventHooksTests
+    """
+    def __init__(self):
+        """
+        :unit_test: create_instance
+        """
+        self.callbacks = {}
+
+    def __nonzero__(self):
+        return bool(self.callbacks)
+
+    def add(self, event, callback):
+        """
+        :raises: ValueError for an unknown event
+        :unit_test:
+        :unit_test: add_unknown_event
+        """
+        if event not in EVENTS:
+            raise ValueError('Unknown tddtags event: %s' % event)
+        self.callbacks.setdefault(event, []).append(callback)
+
+    def remove(self, event, callback):
+        """
+        Removes a callback. Removing one that isn't registered is a no-op.
+        :unit_test:
+        """
+        callbacks = self.callbacks.get(event, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if not callbacks:
+            self.callbacks.pop(event, None)
+
+    def clear(self):
+        self.callbacks = {}
+
+    def fire(self, event, **details):
+        """
+        Calls the event's callbacks in the order they were added. Exceptions from a callback are not caught.
+        :unit_test:
+        """
+        for callback in self.callbacks.get(event, ()):
+            callback(event, **details)
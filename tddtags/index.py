@@ -0,0 +1,183 @@
+"""
+A SQLite index of the tags: where each one is in the source and the test it calls for. It's kept up
+to date a source file at a time, and answers "which tests cover this symbol" and "which symbols feed
+this test" with indexed lookups - without importing or scanning anything, so other tooling can use
+it in place of a scan. The tags table has a row per tag:
+
+    source_path     The absolute path of the source file
+    source_module   The [package.]module name of the source
+    symbol          The qualified name of what the tag is on: pkg.mod, pkg.mod.Class or pkg.mod.Class.method
+    line            The 1 based line that starts on, NULL if not known
+    test_module     The test [package.]module
+    test_class      The test class
+    test_method     The test method - test_ and the tag's name
+    test_id         test_module.test_class.test_method
+
+--> The related default test [package.]module to update
+:unit_test_module: tests.test_index
+--> The default TestCase class for module-level functions
+:unit_test_class: IndexGlobalTests
+"""
+import os
+import sqlite3
+
+from tddtags._core import CompileTags, TDDTagSession, get_session
+
+DEFAULT_INDEX_NAME = '.tddtags.db'
+
+# --> Bumped when the tables change. An index with another version is rebuilt from scratch.
+SCHEMA_VERSION = 1
+
+SCHEMA = [
+    'CREATE TABLE sources (path TEXT PRIMARY KEY, module TEXT NOT NULL, mtime REAL NOT NULL, size INTEGER NOT NULL)',
+    'CREATE TABLE tags (source_path TEXT NOT NULL, source_module TEXT NOT NULL, symbol TEXT NOT NULL, line INTEGER,'
+    ' test_module TEXT NOT NULL, test_class TEXT NOT NULL, test_method TEXT NOT NULL, test_id TEXT NOT NULL)',
+    'CREATE INDEX tags_source_path ON tags (source_path)',
+    'CREATE INDEX tags_symbol ON tags (symbol)',
+    'CREATE INDEX tags_test_id ON tags (test_id)',
+]
+
+
+class TagIndex(object):
+    """
+    The tag index for a session's modules.
+    :unit_test_class: TagIndexTests
+    """
+    def __init__(self, path, session=None):
+        """
+        :param path: The SQLite database file. It's created if it doesn't exist.
+        :param session: The TDDTagSession whose module loader and config are used. Default is the global session.
+        :unit_test: create_instance
+        :unit_test: create_instance_old_schema
+        """
+        self.session = get_session(session)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self._index_session = None
+        self._create_schema()
+
+    def _create_schema(self):
+        if self.connection.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION:
+            return
+
+        self.connection.execute('DROP TABLE IF EXISTS tags')
+        self.connection.execute('DROP TABLE IF EXISTS sources')
+        for statement in SCHEMA:
+            self.connection.execute(statement)
+        self.connection.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, module_names):
+        """
+        Brings the index up to date for the modules. Only a module whose source file changed since it
+        was indexed is compiled again, and its rows replaced. Files that have gone away are dropped.
+        :param module_names: The [package.]module names
+        :returns: The count of modules (re)indexed
+        :unit_test: update
+        :unit_test: update_unchanged
+        """
+        updated = 0
+        for module_name in module_names:
+            source_path = self.session.module_loader.find_source(module_name)
+            if source_path and self.update_source(module_name=module_name, source_path=source_path):
+                updated += 1
+        self.prune()
+        self.connection.commit()
+        return updated
+
+    def update_source(self, module_name, source_path):
+        """
+        Re-indexes a source file if it changed since it was indexed. The tags are compiled from the
+        source where they can be, into a session of the index's own so the run's model isn't added to.
+        A file that fails to compile is dropped, to be tried again next time.
+        :returns: True if re-indexed
+        :unit_test: update_source
+        :unit_test: update_source_failed
+        """
+        source_path = os.path.abspath(source_path)
+        stat = os.stat(source_path)
+        row = self.connection.execute('SELECT mtime, size FROM sources WHERE path = ?', (source_path,)).fetchone()
+        if row and (row['mtime'], row['size']) == (stat.st_mtime, stat.st_size):
+            return False
+
+        session = self._get_index_session()
+        compiler = CompileTags(source_module_name=module_name, session=session)
+        compiled = compiler.compile()
+        session.reset()
+
+        self.connection.execute('DELETE FROM tags WHERE source_path = ?', (source_path,))
+        if not compiled:
+            self.connection.execute('DELETE FROM sources WHERE path = ?', (source_path,))
+            return False
+
+        # --> An import compile can visit a tag twice, so keep the first of each
+        rows = []
+        seen = set()
+        for (test_module, test_class, method_name), (symbol, line) in zip(compiler.tag_records, compiler.tag_symbols):
+            test_method = 'test_' + method_name
+            row = (source_path, module_name, symbol, line, test_module, test_class, test_method,
+                   '%s.%s.%s' % (test_module, test_class, test_method))
+            if row not in seen:
+                seen.add(row)
+                rows.append(row)
+        self.connection.executemany('INSERT INTO tags VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self.connection.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)',
+                                (source_path, module_name, stat.st_mtime, stat.st_size))
+        return True
+
+    def _get_index_session(self):
+        if not self._index_session:
+            config = dict(self.session.config, compile_mode=CompileTags.MODE_STATIC, verbose=False)
+            self._index_session = TDDTagSession(config=config, module_loader=self.session.module_loader)
+        return self._index_session
+
+    def prune(self):
+        """
+        Drops the source files that no longer exist.
+        :returns: The count dropped
+        :unit_test: prune
+        """
+        paths = [row['path'] for row in self.connection.execute('SELECT path FROM sources')]
+        gone = [(path,) for path in paths if not os.path.isfile(path)]
+        self.connection.executemany('DELETE FROM tags WHERE source_path = ?', gone)
+        self.connection.executemany('DELETE FROM sources WHERE path = ?', gone)
+        return len(gone)
+
+    def find_tests(self, symbol):
+        """
+        Which tests cover a symbol. A module or class covers the symbols within it too.
+        :param symbol: pkg.mod, pkg.mod.Class or pkg.mod.Class.method
+        :returns: The list of tag rows as dicts, by test_id
+        :unit_test: find_tests
+        """
+        return self._find('symbol', symbol)
+
+    def find_sources(self, test_name):
+        """
+        Which source symbols feed a test. A test module or class is fed by the tags of all its tests.
+        :param test_name: tests.test_x, tests.test_x.FooTests or tests.test_x.FooTests.test_bar
+        :returns: The list of tag rows as dicts, by test_id
+        :unit_test: find_sources
+        """
+        return self._find('test_id', test_name)
+
+    def _find(self, column, name):
+        # --> name, or a name within it. Those sort in [name, name + '/') since '.' is the only character
+        #     of a dotted name that sorts before '/'. One range scan of the column's index.
+        cursor = self.connection.execute('SELECT * FROM tags WHERE %s >= ? AND %s < ? ORDER BY test_id, symbol'
+                                         % (column, column), (name, name + '/'))
+        return [dict(zip(row.keys(), row)) for row in cursor]
+
+
+def get_index_path(anchor_dir, index_path=None):
+    """
+    :returns: The index's path: index_path if given, else DEFAULT_INDEX_NAME in the anchor directory
+    :unit_test: get_index_path
+    """
+    if index_path:
+        return os.path.abspath(index_path)
+    return os.path.join(anchor_dir or os.getcwd(), DEFAULT_INDEX_NAME)
@@ -0,0 +1,647 @@
+"""
+A Language Server Protocol server for tddtags, over stdio. It shows a diagnostic on each :unit_test: tag
+that has no test method yet, with a code action that adds the stub to the test module - through the
+same UTModuleContainer and Formatter that the command line uses.
+
+The tags of an open module are kept per top-level class and function. An edit inside one of them only
+recompiles that span; an edit to the module header, or one that adds or removes a top-level definition,
+recompiles the module. The test modules are read from the editor's buffer when they're open, and from
+disk (again only when the file changes) when they aren't.
+
+--> The related default test [package.]module to update
+:unit_test_module: tests.test_lsp
+--> The default TestCase class for module-level functions
+:unit_test_class: LspGlobalTests
+"""
+import os
+import re
+import sys
+import json
+import bisect
+import urllib
+import urlparse
+import StringIO
+
+from tddtags import __version__
+from tddtags._core import CompileTags, ModuleLoader, UTModuleContainer, UTModuleDetails, TDDTag, get_session
+
+# --> The LSP constants we use
+SYNC_INCREMENTAL = 2
+SEVERITY_INFORMATION = 3
+ERROR_METHOD_NOT_FOUND = -32601
+ERROR_INTERNAL = -32603
+
+DIAGNOSTIC_SOURCE = 'tddtags'
+DIAGNOSTIC_CODE = 'missing-test'
+
+re_span_start = re.compile(r'(class|def)\b|@')
+
+
+def uri_to_path(uri):
+    """
+    :unit_test:
+    """
+    return urllib.unquote(urlparse.urlparse(uri).path)
+
+
+def path_to_uri(path):
+    """
+    :unit_test:
+    """
+    return 'file://' + urllib.quote(os.path.abspath(path))
+
+
+def find_span_starts(lines, start=0, end=None):
+    """
+    Finds the lines that start a top-level class or function, counting its decorators as part of it.
+    :param lines: The module's lines
+    :param start: The first line to look at
+    :param end: The line to stop before. Default is the end of the module.
+    :returns: The sorted list of 0 based line indexes
+    :unit_test:
+    """
+    starts = []
+    in_decorators = False
+    for index in xrange(start, len(lines) if end is None else end):
+        m = re_span_start.match(lines[index])
+        if m and not in_decorators:
+            starts.append(index)
+        if m:
+            in_decorators = m.group(0) == '@'
+    return starts
+
+
+def make_text_edit(old_lines, new_lines):
+    """
+    Makes the single LSP TextEdit that turns old_lines into new_lines, replacing only the lines between
+    what they have in common at the start and at the end.
+    :unit_test:
+    """
+    prefix = 0
+    limit = min(len(old_lines), len(new_lines))
+    while prefix < limit and old_lines[prefix] == new_lines[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old_lines[-1 - suffix] == new_lines[-1 - suffix]:
+        suffix += 1
+
+    return {
+        'range': {'start': {'line': prefix, 'character': 0}, 'end': {'line': len(old_lines) - suffix, 'character': 0}},
+        'newText': ''.join(new_lines[prefix:len(new_lines) - suffix]),
+    }
+
+
+class JsonRpcStream(object):
+    """
+    Reads and writes the LSP's JSON-RPC messages, each with a Content-Length header.
+    :unit_test_class: JsonRpcStreamTests
+    """
+    def __init__(self, in_file, out_file):
+        """
+        :unit_test: create_instance
+        """
+        self.in_file = in_file
+        self.out_file = out_file
+
+    def read_message(self):
+        """
+        :returns: The decoded message, None at the end of the input
+        :unit_test:
+        :unit_test: read_message_eof
+        """
+        length = None
+        while True:
+            line = self.in_file.readline()
+            if not line:
+                return None
+            line = line.strip()
+            if not line:
+                if length is not None:
+                    break
+                continue
+            name, _, value = line.partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+        return json.loads(self.in_file.read(length))
+
+    def write_message(self, message):
+        """
+        :unit_test:
+        """
+        body = json.dumps(message)
+        self.out_file.write('Content-Length: %d\r\n\r\n%s' % (len(body), body))
+        self.out_file.flush()
+
+
+class TagLocator(CompileTags):
+    """
+    Compiles a module's tags, remembering the context each :unit_test: tag came from so that the tag
+    can be found in the source text.
+    :unit_test_class: TagLocatorTests
+    """
+    def __init__(self, source_module_name, session=None):
+        """
+        :unit_test: create_instance
+        """
+        super(TagLocator, self).__init__(source_module_name=source_module_name, session=session)
+        self.tag_contexts = []  # (tag record, SourceContext), in the order compiled
+
+    def process_unit_test(self, test_name, context):
+        super(TagLocator, self).process_unit_test(test_name=test_name, context=context)
+        self.tag_contexts.append((self.tag_records[-1], context))
+
+    def locate(self, lines, skip_context=None):
+        """
+        Finds where each tag is. A context's tags are compiled in the order they appear in its docstring,
+        so the nth tag of a context is the nth :unit_test: after the line the context starts on.
+        :param lines: The module's lines
+        :param skip_context: A context whose tags to leave out
+        :returns: The list of TagLocations
+        :unit_test:
+        """
+        locations = []
+        counts = {}
+        for record, context in self.tag_contexts:
+            if context is skip_context:
+                continue
+            nth = counts.get(id(context), 0)
+            counts[id(context)] = nth + 1
+            location = TagLocator.find_tag(lines, (context.line or 1) - 1, nth)
+            if location:
+                locations.append(TagLocation(record, *location))
+        return locations
+
+    @staticmethod
+    def find_tag(lines, start, nth):
+        """
+        :returns: The (line, start character, end character) of the nth :unit_test: tag from the start line,
+                  None if there aren't that many
+        """
+        for index in xrange(start, len(lines)):
+            m = CompileTags.re_keyword_line.search(lines[index])
+            if m and m.group(1) == 'unit_test':
+                if not nth:
+                    return index, m.start(), m.end(2)
+                nth -= 1
+        return None
+
+
+class TagLocation(object):
+    """
+    A :unit_test: tag in an open module: the (test module, test class, test method) it calls for, and where
+    it is.
+    """
+    def __init__(self, record, line, start, end):
+        self.record = record
+        self.line = line
+        self.start = start
+        self.end = end
+
+    def to_range(self):
+        return {'start': {'line': self.line, 'character': self.start}, 'end': {'line': self.line, 'character': self.end}}
+
+
+class SourceSpan(object):
+    """
+    A top-level class or function of an open module, and the tags compiled from it.
+    """
+    def __init__(self, start, end, tags=None):
+        self.start = start
+        self.end = end
+        self.tags = tags or []
+
+    def shift(self, delta):
+        self.start += delta
+        self.end += delta
+        for tag in self.tags:
+            tag.line += delta
+
+
+class SourceDocument(object):
+    """
+    A module open in the editor: its text, and the tags of its header and of each top-level span.
+    :unit_test_class: SourceDocumentTests
+    """
+    def __init__(self, uri, text, version=None):
+        """
+        :unit_test: create_instance
+        """
+        self.uri = uri
+        self.path = uri_to_path(uri)
+        self.module_name = ModuleLoader.module_name_for_path(self.path)
+        self.version = version
+        self.revision = 0  # Counts the changes, for editors that don't send versions
+        self.lines = text.splitlines(True)
+        self.module_doc = None
+        self.header_tags = []
+        self.spans = None  # The list of SourceSpans, None until the module compiles
+
+    def get_tags(self):
+        """
+        :unit_test:
+        """
+        tags = list(self.header_tags)
+        for span in self.spans or []:
+            tags.extend(span.tags)
+        return sorted(tags, key=lambda tag: (tag.line, tag.start))
+
+    def get_source(self, start=0, end=None):
+        """
+        :returns: The source of the lines from start to end, as utf-8 with the lines before start blanked, so
+                  the line numbers the parser reports are the module's
+        """
+        return '\n' * start + u''.join(self.lines[start:end]).encode('utf-8')
+
+    def compile(self, session=None):
+        """
+        Compiles the whole module. If it doesn't parse (say it's half way through an edit) the tags are left
+        as they were, and the next edit compiles the whole module again.
+        :returns: True if compiled
+        :unit_test:
+        :unit_test: compile_syntax_error
+        """
+        if not self.path.endswith('.py'):
+            return False
+
+        module = CompileTags.parse_source(source_path=self.path, module_name=self.module_name, source=self.get_source(),
+                                          session=session)
+        if module is None:
+            self.spans = None
+            return False
+
+        locator = TagLocator(source_module_name=self.module_name, session=session)
+        locator.handle_context(target=module, parent_context=module)
+
+        starts = find_span_starts(self.lines)
+        self.module_doc = module.__doc__
+        self.header_tags = []
+        self.spans = [SourceSpan(start, end) for start, end in zip(starts, starts[1:] + [len(self.lines)])]
+        for tag in locator.locate(self.lines):
+            index = bisect.bisect_right(starts, tag.line) - 1
+            if index < 0:
+                self.header_tags.append(tag)
+            else:
+                self.spans[index].tags.append(tag)
+        return True
+
+    def compile_span(self, span, session=None):
+        """
+        Compiles one top-level span, under the module docstring's test module and class.
+        :returns: True if compiled. If not, the span keeps the tags it had.
+        :unit_test:
+        """
+        module = CompileTags.parse_source(source_path=self.path, module_name=self.module_name,
+                                          source=self.get_source(span.start, span.end), session=session)
+        if module is None:
+            return False
+
+        module.__doc__ = self.module_doc
+        locator = TagLocator(source_module_name=self.module_name, session=session)
+        locator.handle_context(target=module, parent_context=module)
+        span.tags = locator.locate(self.lines, skip_context=module)
+        return True
+
+    def _find_span(self, start_line, end_line):
+        """
+        :returns: The index of the span holding all of the lines, None if there isn't one
+        """
+        for index, span in enumerate(self.spans or []):
+            if span.start <= start_line and end_line < span.end:
+                return index
+        return None
+
+    def apply_change(self, change, session=None):
+        """
+        Applies an LSP content change - a range edit or the whole text - and recompiles as little as it can.
+        :returns: True if the tags were compiled
+        :unit_test:
+        :unit_test: apply_change_full_text
+        :unit_test: apply_change_new_span
+        """
+        self.revision += 1
+        if 'range' not in change:
+            self.lines = change['text'].splitlines(True)
+            return self.compile(session=session)
+
+        start = change['range']['start']
+        end = change['range']['end']
+        index = self._find_span(start['line'], end['line'])
+
+        prefix = self.lines[start['line']][:start['character']] if start['line'] < len(self.lines) else u''
+        suffix = self.lines[end['line']][end['character']:] if end['line'] < len(self.lines) else u''
+        replaced = (prefix + change['text'] + suffix).splitlines(True)
+        replaced_cnt = len(self.lines[start['line']:end['line'] + 1])
+        self.lines[start['line']:end['line'] + 1] = replaced
+        delta = len(replaced) - replaced_cnt
+
+        if index is None:
+            return self.compile(session=session)
+
+        span = self.spans[index]
+        span.end += delta
+        if find_span_starts(self.lines, span.start, span.end) != [span.start]:
+            return self.compile(session=session)
+        for later in self.spans[index + 1:]:
+            later.shift(delta)
+        return self.compile_span(span, session=session)
+
+
+class LanguageServer(object):
+    """
+    Answers the editor's LSP requests for a session.
+    :unit_test_class: LanguageServerTests
+    """
+    # --> LSP method -> handler
+    methods = {
+        'initialize': 'do_initialize',
+        'initialized': 'do_nothing',
+        'shutdown': 'do_shutdown',
+        'exit': 'do_exit',
+        'textDocument/didOpen': 'do_did_open',
+        'textDocument/didChange': 'do_did_change',
+        'textDocument/didSave': 'do_did_save',
+        'textDocument/didClose': 'do_did_close',
+        'textDocument/codeAction': 'do_code_action',
+    }
+
+    def __init__(self, stream, session=None):
+        """
+        :param stream: The JsonRpcStream to the editor
+        :param session: The TDDTagSession to run in. Default is the global session.
+        :unit_test: create_instance
+        """
+        self.stream = stream
+        self.session = get_session(session)
+        self.documents = {}  # URI -> SourceDocument
+        self.containers = {}  # Test module path -> (version or file stat, UTModuleContainer)
+        self.sources = {}  # Module name -> source path
+        self.shutdown_requested = False
+        self.exited = False
+
+    def run(self):
+        """
+        Handles messages until the editor says exit, or closes the stream.
+        :returns: The exit code - 0 if the editor asked for a shutdown first
+        """
+        while not self.exited:
+            message = self.stream.read_message()
+            if message is None:
+                break
+            self.handle_message(message)
+        return 0 if self.shutdown_requested else 1
+
+    def handle_message(self, message):
+        """
+        :unit_test:
+        :unit_test: handle_message_unknown
+        """
+        method = message.get('method')
+        msg_id = message.get('id')
+        if method is None:
+            return  # A response - we don't send any requests
+
+        handler = getattr(self, self.methods.get(method, ''), None)
+        if not handler:
+            if msg_id is not None:
+                self.send_error(msg_id, ERROR_METHOD_NOT_FOUND, 'Unknown method: %s' % method)
+            return
+
+        try:
+            result = handler(message.get('params') or {})
+        except Exception as ex:
+            if msg_id is None:
+                print >> sys.stderr, '- Failed to handle %s -> %s' % (method, ex)
+                return
+            self.send_error(msg_id, ERROR_INTERNAL, '%s: %s' % (ex.__class__.__name__, ex))
+            return
+        if msg_id is not None:
+            self.stream.write_message({'jsonrpc': '2.0', 'id': msg_id, 'result': result})
+
+    def send_error(self, msg_id, code, message):
+        self.stream.write_message({'jsonrpc': '2.0', 'id': msg_id, 'error': {'code': code, 'message': message}})
+
+    def send_notification(self, method, params):
+        self.stream.write_message({'jsonrpc': '2.0', 'method': method, 'params': params})
+
+    def find_source(self, module_name):
+        path = self.sources.get(module_name)
+        if path and os.path.isfile(path):
+            return path
+        path = self.session.module_loader.find_source(module_name)
+        if path:
+            self.sources[module_name] = path
+        return path
+
+    def get_test_container(self, module_path):
+        """
+        :returns: The UTModuleContainer for a test module, from the editor's buffer if it's open
+        :unit_test:
+        """
+        document = self.documents.get(path_to_uri(module_path))
+        if document:
+            key = ('open', id(document), document.revision)
+        else:
+            try:
+                stat = os.stat(module_path)
+            except OSError:
+                return None
+            key = ('disk', stat.st_size, stat.st_mtime)
+
+        entry = self.containers.get(module_path)
+        if entry and entry[0] == key:
+            return entry[1]
+        lines = list(document.lines) if document else None
+        container = UTModuleContainer(module_path=module_path, session=self.session, lines=lines)
+        self.containers[module_path] = (key, container)
+        return container
+
+    def get_missing_tags(self, document):
+        """
+        :returns: The document's tags whose test methods don't exist yet
+        :unit_test:
+        """
+        missing = []
+        for tag in document.get_tags():
+            test_module_name, test_class_name, method_name = tag.record
+            module_path = self.find_source(test_module_name)
+            container = self.get_test_container(module_path) if module_path else None
+            span = container.class_spans.get(test_class_name) if container else None
+            if not span or 'test_' + method_name not in span.method_names:
+                missing.append(tag)
+        return missing
+
+    def publish(self, document):
+        diagnostics = []
+        for tag in self.get_missing_tags(document):
+            test_module_name, test_class_name, method_name = tag.record
+            diagnostics.append({
+                'range': tag.to_range(),
+                'severity': SEVERITY_INFORMATION,
+                'source': DIAGNOSTIC_SOURCE,
+                'code': DIAGNOSTIC_CODE,
+                'message': 'No test method test_%s in %s.%s' % (method_name, test_module_name, test_class_name),
+                'data': {'record': list(tag.record)},
+            })
+        self.send_notification('textDocument/publishDiagnostics',
+                               {'uri': document.uri, 'version': document.version, 'diagnostics': diagnostics})
+
+    def publish_affected(self, document):
+        """
+        Publishes the diagnostics for a changed document, and for the open documents whose tags refer to it
+        as their test module.
+        """
+        if document.spans is not None and document.uri in self.documents:
+            self.publish(document)
+        for other in self.documents.values():
+            if other is document or other.spans is None:
+                continue
+            if any(self.find_source(tag.record[0]) == document.path for tag in other.get_tags()):
+                self.publish(other)
+
+    def do_nothing(self, params):
+        return None
+
+    def do_initialize(self, params):
+        """
+        :unit_test:
+        """
+        return {
+            'capabilities': {
+                'textDocumentSync': {'openClose': True, 'change': SYNC_INCREMENTAL, 'save': True},
+                'codeActionProvider': {'codeActionKinds': ['quickfix', 'source']},
+            },
+            'serverInfo': {'name': 'tddtags', 'version': __version__},
+        }
+
+    def do_shutdown(self, params):
+        self.shutdown_requested = True
+        return None
+
+    def do_exit(self, params):
+        self.exited = True
+        return None
+
+    def do_did_open(self, params):
+        """
+        :unit_test:
+        """
+        item = params['textDocument']
+        document = SourceDocument(uri=item['uri'], text=item['text'], version=item.get('version'))
+        self.documents[document.uri] = document
+        self.session.test_module_details.clear()
+        document.compile(session=self.session)
+        self.publish_affected(document)
+
+    def do_did_change(self, params):
+        """
+        :unit_test:
+        """
+        document = self.documents.get(params['textDocument']['uri'])
+        if not document:
+            return
+        document.version = params['textDocument'].get('version')
+        self.session.test_module_details.clear()
+        for change in params['contentChanges']:
+            document.apply_change(change, session=self.session)
+        self.publish_affected(document)
+
+    def do_did_save(self, params):
+        document = self.documents.get(params['textDocument']['uri'])
+        if document:
+            self.publish_affected(document)
+
+    def do_did_close(self, params):
+        """
+        :unit_test:
+        """
+        document = self.documents.pop(params['textDocument']['uri'], None)
+        if not document:
+            return
+        self.containers.pop(document.path, None)
+        self.send_notification('textDocument/publishDiagnostics', {'uri': document.uri, 'diagnostics': []})
+        self.publish_affected(document)
+
+    def do_code_action(self, params):
+        """
+        Offers to add the stub for each missing test tagged in the range, and for all of the document's
+        missing tests.
+        :unit_test:
+        """
+        document = self.documents.get(params['textDocument']['uri'])
+        if not document or document.spans is None:
+            return []
+
+        first_line = params['range']['start']['line']
+        last_line = params['range']['end']['line']
+        missing = self.get_missing_tags(document)
+
+        actions = []
+        for tag in missing:
+            if first_line <= tag.line <= last_line:
+                test_module_name, test_class_name, method_name = tag.record
+                actions.append({
+                    'title': 'Add test stub test_%s to %s.%s' % (method_name, test_module_name, test_class_name),
+                    'kind': 'quickfix',
+                    'edit': self.make_stub_edit([tag]),
+                })
+        if len(missing) > 1:
+            actions.append({
+                'title': 'Add the %d missing test stubs for %s' % (len(missing), document.module_name),
+                'kind': 'source',
+                'edit': self.make_stub_edit(missing),
+            })
+        return actions
+
+    def make_stub_edit(self, tags):
+        """
+        Makes the WorkspaceEdit that adds the test methods for the tags, creating test classes and modules
+        as needed.
+        :unit_test:
+        :unit_test: make_stub_edit_new_module
+        """
+        modules = {}
+        for tag in tags:
+            test_module_name, test_class_name, method_name = tag.record
+            ut_module = modules.setdefault(test_module_name, UTModuleDetails(module_name=test_module_name))
+            ut_module.add_class(class_name=test_class_name).add_method(method_name)
+
+        changes = []
+        for test_module_name in sorted(modules):
+            ut_module = modules[test_module_name]
+            module_path = self.find_source(test_module_name)
+            if module_path:
+                changes.append(self._update_module_edit(module_path, ut_module))
+            else:
+                changes.extend(self._new_module_edits(ut_module))
+        return {'documentChanges': changes}
+
+    def _update_module_edit(self, module_path, ut_module):
+        old_lines = self.get_test_container(module_path).lines
+        container = UTModuleContainer(module_path=module_path, session=self.session, lines=list(old_lines))
+        for class_name, ut_class in sorted(ut_module.class_list.items()):
+            span = container.class_spans.get(class_name)
+            if not span:
+                container.append_class(ut_class=ut_class)
+                continue
+            for method_name in ut_class.method_names:
+                if 'test_' + method_name not in span.method_names:
+                    container.add_class_method(class_name=class_name, method_name='test_' + method_name)
+
+        uri = path_to_uri(module_path)
+        document = self.documents.get(uri)
+        return {
+            'textDocument': {'uri': uri, 'version': document.version if document else None},
+            'edits': [make_text_edit(old_lines, container.lines)],
+        }
+
+    def _new_module_edits(self, ut_module):
+        anchor_dir = self.session.module_loader.anchor_dir
+        uri = path_to_uri(os.path.join(anchor_dir, *ut_module.module_name.split('.')) + '.py')
+        output = StringIO.StringIO()
+        TDDTag(session=self.session).gen_output(ut_module=ut_module, source_file=output)
+        position = {'line': 0, 'character': 0}
+        return [
+            {'kind': 'create', 'uri': uri, 'options': {'ignoreIfExists': True}},
+            {'textDocument': {'uri': uri, 'version': None},
+             'edits': [{'range': {'start': position, 'end': position}, 'newText': output.getvalue()}]},
+        ]
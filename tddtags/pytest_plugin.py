@@ -0,0 +1,57 @@
+"""
+An optional pytest plugin for test impact selection. With --tddtags-since REF only the tests tagged
+on the source that changed since REF are run, and everything else is deselected. Without the option
+it does nothing. Installing tddtags registers it; otherwise enable it with -p tddtags.pytest_plugin.
+
+--> The related default test [package.]module to update
+:unit_test_module: tests.test_affected
+--> The default TestCase class for module-level functions
+:unit_test_class: PytestPluginTests
+"""
+import os
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('tddtags')
+    group.addoption('--tddtags-since', action='store', dest='tddtags_since', metavar='REF',
+                    help='Only run the tests tagged on the source that changed since the merge base of REF and HEAD')
+    group.addoption('--tddtags-anchor', action='store', dest='tddtags_anchor', metavar='DIR',
+                    help='The tddtags anchor directory. Default is the rootdir.')
+
+
+def pytest_collection_modifyitems(session, config, items):
+    """
+    Deselects the collected tests that the changes since --tddtags-since don't affect.
+    :unit_test: collection_modifyitems
+    """
+    ref = config.getoption('tddtags_since')
+    if not ref:
+        return
+
+    # --> Imported here, so that having the plugin registered costs nothing when it isn't used
+    import pytest
+    from tddtags import vcs
+    from tddtags._core import TDDTagSession
+    from tddtags.affected import find_affected_tests
+
+    tag_session = TDDTagSession(anchor_dir=config.getoption('tddtags_anchor') or str(config.rootdir))
+    try:
+        tests, changed_symbols = find_affected_tests(ref, session=tag_session)
+    except vcs.GitError as ex:
+        raise pytest.UsageError('--tddtags-since: %s' % ex)
+
+    wanted = set((os.path.realpath(test.path), test.class_name, test.method_name) for test in tests)
+    selected = []
+    deselected = []
+    for item in items:
+        cls = getattr(item, 'cls', None)
+        name = getattr(item, 'originalname', None) or item.name
+        key = (os.path.realpath(str(item.fspath)), cls.__name__ if cls else None, name)
+        if key in wanted:
+            selected.append(item)
+        else:
+            deselected.append(item)
+
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = selected
@@ -0,0 +1,342 @@
+"""
+A tddtags daemon on a Unix domain socket, so that editors and git hooks don't pay the interpreter
+start up and the cold imports on every call. The server keeps the compiled tags of each source
+module, the parsed test modules and the module paths warm, and only recompiles or re-reads a
+file when it has changed.
+
+The protocol is one JSON object per line each way. A request is {"command": ..., ...} and the
+response always has "ok", with "error" when it's false. The commands are:
+
+    ping                                 - Is the server up?
+    scan [targets] [excludes]            - Compile the targets, returning the tests their tags call for
+    check [targets] [excludes]           - As scan, returning the tests that are missing from the test modules
+    update [targets] [excludes]          - As scan, then add the missing tests to the test modules
+    shutdown                             - Stop the server
+
+Without targets the anchor directory is walked, and then nothing is imported, so a setup.py or a
+script in it isn't run - a module whose docstrings are built at runtime has to be named as a target.
+
+--> The related default test [package.]module to update
+:unit_test_module: tests.test_server
+--> The default TestCase class for module-level functions
+:unit_test_class: ServerGlobalTests
+"""
+import os
+import json
+import time
+import errno
+import socket
+import SocketServer
+
+from tddtags import hooks
+from tddtags._core import CompileTags, ModuleUpdater, UTModuleContainer, TDDTag, TDDTagSession, expand_targets, \
+    get_session
+
+DEFAULT_SOCKET_NAME = '.tddtags.sock'
+
+
+class TagServer(object):
+    """
+    Answers the requests for a session, keeping the compiled tags and the test modules between them.
+    :unit_test_class: TagServerTests
+    """
+    def __init__(self, session=None):
+        """
+        :param session: The TDDTagSession to run in. Default is the global session.
+        :unit_test: create_instance
+        """
+        self.session = get_session(session)
+        self.compiled = {}  # Module name -> (source stat, tag records)
+        self.containers = {}  # Test module path -> (stat, UTModuleContainer)
+        self.sources = {}  # Module name -> source path
+        self.stopped = False
+        self._static_session = None
+
+    @staticmethod
+    def get_stat(path):
+        """
+        :returns: The (size, mtime) of the file, None if it's gone
+        """
+        try:
+            stat = os.stat(path)
+        except (OSError, TypeError):
+            return None
+        return stat.st_size, stat.st_mtime
+
+    def find_source(self, module_name):
+        """
+        Finds a module's source with the module loader, remembering the path while the file is there.
+        :unit_test:
+        """
+        path = self.sources.get(module_name)
+        if path and os.path.isfile(path):
+            return path
+        path = self.session.module_loader.find_source(module_name)
+        if path:
+            self.sources[module_name] = path
+        else:
+            self.sources.pop(module_name, None)
+        return path
+
+    def handle_request(self, request):
+        """
+        :param request: The decoded request
+        :returns: The response, to be encoded
+        :unit_test:
+        :unit_test: handle_request_unknown
+        :unit_test: handle_request_error
+        """
+        command = request.get('command') if isinstance(request, dict) else None
+        handler = getattr(self, 'do_%s' % command, None) if command else None
+        if not handler:
+            return {'ok': False, 'error': 'Unknown command: %s' % command}
+
+        start = time.time()
+        try:
+            response = handler(request)
+        except KeyboardInterrupt:
+            raise
+        except BaseException as ex:  # SystemExit too - a module that exits on import mustn't stop the server
+            return {'ok': False, 'error': '%s: %s' % (ex.__class__.__name__, ex)}
+        response.setdefault('ok', True)
+        response['seconds'] = time.time() - start
+        return response
+
+    def compile_targets(self, targets, excludes=None, static_only=False):
+        """
+        Builds the session's model for the targets, recompiling only the modules whose source changed
+        since they were last compiled.
+        :param static_only: Compile without importing anything. A module that would need to be imported fails.
+        :returns: A tuple of (module names, names of the modules that failed, count of modules compiled)
+        :unit_test:
+        :unit_test: compile_targets_changed
+        :unit_test: compile_targets_static_only
+        """
+        session = self.session
+        module_names = expand_targets(targets, excludes=excludes, module_loader=session.module_loader)
+        session.reset()
+        compile_session = self._get_static_session() if static_only else session
+        if static_only:
+            compile_session.reset()
+
+        failed = []
+        compiled_cnt = 0
+        for module_name in module_names:
+            stat = self.get_stat(self.find_source(module_name))
+            entry = self.compiled.get(module_name)
+            if entry and stat and entry[0] == stat:
+                records = entry[1]
+            else:
+                session.module_loader.unload_module(module_name)
+                compiler = CompileTags(source_module_name=module_name, session=compile_session)
+                compiled_cnt += 1
+                if not compiler.compile():
+                    self.compiled.pop(module_name, None)
+                    failed.append(module_name)
+                    continue
+                records = compiler.tag_records
+                self.compiled[module_name] = (stat, records)
+
+            for record in records:
+                session.add_tag_record(record)
+
+        return module_names, failed, compiled_cnt
+
+    def _get_static_session(self):
+        if not self._static_session:
+            config = dict(self.session.config, compile_mode=CompileTags.MODE_STATIC_ONLY)
+            self._static_session = TDDTagSession(config=config, module_loader=self.session.module_loader,
+                                                 formatter=self.session.formatter)
+        return self._static_session
+
+    def get_container(self, module_path):
+        """
+        :returns: The UTModuleContainer for a test module, read again only if the file changed
+        :unit_test:
+        """
+        stat = self.get_stat(module_path)
+        entry = self.containers.get(module_path)
+        if entry and entry[0] == stat:
+            return entry[1]
+        container = UTModuleContainer(module_path=module_path, session=self.session)
+        self.containers[module_path] = (stat, container)
+        return container
+
+    def _scan(self, request):
+        targets = request.get('targets')
+        module_names, failed, compiled_cnt = self.compile_targets(targets or [self.session.module_loader.anchor_dir],
+                                                                  excludes=request.get('excludes'), static_only=not targets)
+        return {'ok': not failed, 'modules': len(module_names), 'compiled': compiled_cnt, 'failed': failed}
+
+    def do_ping(self, request):
+        return {'pid': os.getpid(), 'anchor_dir': self.session.module_loader.anchor_dir}
+
+    def do_scan(self, request):
+        """
+        :unit_test:
+        """
+        response = self._scan(request)
+        response['tests'] = dict((name, dict((class_name, list(ut_class.method_names))
+                                             for class_name, ut_class in ut_module.class_list.items()))
+                                 for name, ut_module in self.session.test_module_details.items())
+        return response
+
+    def do_check(self, request):
+        """
+        :unit_test:
+        """
+        response = self._scan(request)
+        missing = {}
+        for name, ut_module in self.session.test_module_details.items():
+            if not ut_module.class_list:
+                continue
+            module_path = self.find_source(name)
+            if not module_path:
+                missing[name] = dict((class_name, ['test_' + method_name for method_name in ut_class.method_names])
+                                     for class_name, ut_class in ut_module.class_list.items())
+                continue
+            updater = ModuleUpdater(ut_module=ut_module, session=self.session)
+            module_missing = updater.get_missing_tests(container=self.get_container(module_path))
+            if module_missing:
+                missing[name] = module_missing
+        response['missing'] = missing
+        return response
+
+    def do_update(self, request):
+        """
+        :unit_test:
+        """
+        response = self._scan(request)
+        saved = []
+
+        def on_saved(event, path, changed, **details):
+            if changed:
+                saved.append(path)
+
+        event_hooks = self.session.event_hooks
+        event_hooks.add(hooks.MODULE_SAVED, on_saved)
+        try:
+            TDDTag(session=self.session).process_referenced_test_modules()
+        finally:
+            event_hooks.remove(hooks.MODULE_SAVED, on_saved)
+        response['saved'] = saved
+        return response
+
+    def do_shutdown(self, request):
+        self.stopped = True
+        return {}
+
+
+class TagRequestHandler(SocketServer.StreamRequestHandler):
+    """
+    Answers each request line on a connection until the client closes it.
+    """
+    def handle(self):
+        tag_server = self.server.tag_server
+        for line in iter(self.rfile.readline, ''):
+            try:
+                request = json.loads(line)
+            except ValueError as ex:
+                response = {'ok': False, 'error': 'Bad request: %s' % ex}
+            else:
+                response = tag_server.handle_request(request)
+            self.wfile.write(json.dumps(response) + '\n')
+            self.wfile.flush()
+            if tag_server.stopped:
+                break
+
+
+class UnixTagServer(SocketServer.UnixStreamServer):
+    """
+    The socket side of a TagServer. Requests are answered one at a time, since the session isn't
+    thread safe.
+    :unit_test_class: UnixTagServerTests
+    """
+    def __init__(self, socket_path, tag_server):
+        """
+        :param socket_path: The path to listen on. A stale socket left by a server that died is replaced.
+        :param tag_server: The TagServer to answer the requests with
+        :raises: socket.error if another server is listening on the path
+        :unit_test: create_instance
+        :unit_test: create_instance_in_use
+        :unit_test: create_instance_stale_socket
+        """
+        self.tag_server = tag_server
+        self.socket_path = socket_path
+        self.remove_stale_socket(socket_path)
+
+        old_umask = os.umask(0o177)  # Only the user may connect
+        try:
+            SocketServer.UnixStreamServer.__init__(self, socket_path, TagRequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    @staticmethod
+    def remove_stale_socket(socket_path):
+        """
+        :raises: socket.error if a server is listening on the path
+        """
+        if not os.path.exists(socket_path):
+            return
+        try:
+            TagClient(socket_path).request('ping')
+        except socket.error as ex:
+            if ex.errno not in (errno.ECONNREFUSED, errno.ENOENT):
+                raise
+            os.remove(socket_path)
+        else:
+            raise socket.error(errno.EADDRINUSE, 'A tddtags server is already listening on %s' % socket_path)
+
+    def run(self):
+        """
+        Answers requests until a shutdown request.
+        """
+        try:
+            while not self.tag_server.stopped:
+                self.handle_request()
+        finally:
+            self.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+class TagClient(object):
+    """
+    Sends requests to a tddtags server.
+    :unit_test_class: TagClientTests
+    """
+    def __init__(self, socket_path, timeout=None):
+        """
+        :param socket_path: The server's socket
+        :param timeout: Optional seconds to wait for a response
+        :unit_test: create_instance
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def request(self, command, **params):
+        """
+        :returns: The decoded response
+        :raises: socket.error if the server isn't there
+        :unit_test:
+        """
+        params['command'] = command
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps(params) + '\n')
+            line = sock.makefile('r').readline()
+        finally:
+            sock.close()
+        if not line:
+            raise socket.error(errno.ECONNRESET, 'No response from the tddtags server at %s' % self.socket_path)
+        return json.loads(line)
+
+
+def get_socket_path(anchor_dir, socket_path=None):
+    """
+    :returns: The socket path given, or the default one in the anchor directory
+    :unit_test:
+    """
+    return os.path.abspath(socket_path or os.path.join(anchor_dir or os.getcwd(), DEFAULT_SOCKET_NAME))
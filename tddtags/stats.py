@@ -0,0 +1,269 @@
+"""
+Phase timers, counters, the per-phase profiler and the memory profiler for a tddtags run.
+
+--> The related default test [package.]module to update
+:unit_test_module: tests.test_stats
+--> The default TestCase class for module-level functions
+:unit_test_class: StatsGlobalTests
+"""
+import os
+import sys
+import time
+import json
+import cProfile
+import contextlib
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None  # Python < 3.4: MemoryProfiler falls back to the peak RSS
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class RunStats(object):
+    """
+    Collects the wall and CPU time spent in each phase of a run, and counters of the work done.
+    Phases nest: time spent in an inner phase (say load, within compile) is charged to the inner
+    phase only, so the phase times add up to the time measured.
+    :unit_test_class: RunStatsTests
+    """
+    PHASES = ('load', 'compile', 'diff', 'format', 'save')
+    COUNTERS = ('modules_imported', 'objects_visited', 'docstrings_scanned', 'tags_found',
+                'test_modules_touched', 'lines_inserted', 'bytes_written')
+
+    def __init__(self):
+        """
+        :unit_test: create_instance
+        """
+        self.profile = False  # True to run a cProfile.Profile per phase
+        self.reset()
+
+    def reset(self):
+        """
+        Zeroes the timers and counters, and drops any profile data.
+        :unit_test:
+        """
+        self.wall = dict.fromkeys(self.PHASES, 0.0)
+        self.cpu = dict.fromkeys(self.PHASES, 0.0)
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.profilers = {}
+        self.stack = []
+        self.mark = None
+
+    @staticmethod
+    def _now():
+        user, system = os.times()[:2]
+        return time.time(), user + system
+
+    def _charge(self):
+        now = self._now()
+        if self.stack:
+            phase = self.stack[-1]
+            self.wall[phase] = self.wall.get(phase, 0.0) + now[0] - self.mark[0]
+            self.cpu[phase] = self.cpu.get(phase, 0.0) + now[1] - self.mark[1]
+        self.mark = now
+
+    def _switch_profiler(self, old_phase, new_phase):
+        if not self.profile or old_phase == new_phase:
+            return
+        if old_phase:
+            self.profilers[old_phase].disable()
+        if new_phase:
+            if new_phase not in self.profilers:
+                self.profilers[new_phase] = cProfile.Profile()
+            self.profilers[new_phase].enable()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Times the block as the named phase.
+        :unit_test: phase
+        :unit_test: phase_nested
+        """
+        self._charge()
+        old_phase = self.stack[-1] if self.stack else None
+        self.stack.append(name)
+        self._switch_profiler(old_phase, name)
+        try:
+            yield
+        finally:
+            self._charge()
+            self.stack.pop()
+            self._switch_profiler(name, self.stack[-1] if self.stack else None)
+
+    def count(self, name, amount=1):
+        """
+        :unit_test:
+        """
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def merge_counters(self, counters):
+        """
+        Adds in the counters from another RunStats, e.g. a compile worker's.
+        :unit_test:
+        """
+        for name, amount in counters.items():
+            self.count(name, amount)
+
+    def to_dict(self):
+        """
+        :unit_test:
+        """
+        phases = dict((name, {'wall': self.wall[name], 'cpu': self.cpu[name]}) for name in self.wall)
+        return {
+            'phases': phases,
+            'total': {'wall': sum(self.wall.values()), 'cpu': sum(self.cpu.values())},
+            'counters': dict(self.counters),
+        }
+
+    def format_report(self):
+        """
+        :returns: The report as a list of lines
+        :unit_test:
+        """
+        lines = ['%-10s %10s %10s' % ('phase', 'wall (s)', 'cpu (s)')]
+        for name in self.PHASES:
+            lines.append('%-10s %10.3f %10.3f' % (name, self.wall[name], self.cpu[name]))
+        lines.append('%-10s %10.3f %10.3f' % ('total', sum(self.wall.values()), sum(self.cpu.values())))
+        lines.append('')
+        for name in self.COUNTERS:
+            lines.append('%-22s %10d' % (name, self.counters[name]))
+        return lines
+
+    def save_json(self, path):
+        """
+        :unit_test:
+        """
+        with open(path, 'w') as json_file:
+            json.dump(self.to_dict(), json_file, indent=2, sort_keys=True)
+
+    def dump_profiles(self, path):
+        """
+        Writes the profile data for each phase to path.<phase>, for pstats or snakeviz.
+        :returns: The list of files written
+        :unit_test:
+        """
+        paths = []
+        for name in sorted(self.profilers):
+            phase_path = '%s.%s' % (path, name)
+            self.profilers[name].dump_stats(phase_path)
+            paths.append(phase_path)
+        return paths
+
+
+def retained_size(obj, seen=None):
+    """
+    Estimates the memory an object keeps alive: its size plus that of the containers, instance
+    dictionaries and values it refers to. Objects shared between references are counted once.
+    :unit_test:
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(retained_size(key, seen) + retained_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(retained_size(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__') and not isinstance(obj, type):
+        size += retained_size(obj.__dict__, seen)
+    return size
+
+
+class MemoryProfiler(object):
+    """
+    Records the memory in use and its peak at checkpoints through a run, with the top allocation sites
+    since the previous checkpoint. Uses tracemalloc; without it (Python 2) only the peak RSS of the
+    process is recorded, and there are no allocation sites.
+    :unit_test_class: MemoryProfilerTests
+    """
+    def __init__(self, top=10):
+        """
+        :param top: The number of allocation sites to keep per checkpoint
+        :unit_test: create_instance
+        """
+        self.top = top
+        self.checkpoints = []
+        self.snapshot = None
+
+    @staticmethod
+    def is_tracing():
+        return bool(tracemalloc and tracemalloc.is_tracing())
+
+    def start(self):
+        """
+        :unit_test:
+        """
+        if tracemalloc:
+            tracemalloc.start()
+            self.snapshot = tracemalloc.take_snapshot()
+
+    def stop(self):
+        if self.is_tracing():
+            tracemalloc.stop()
+        self.snapshot = None
+
+    @staticmethod
+    def get_peak_rss():
+        """
+        :returns: The peak resident set size of the process in bytes, None if not known
+        """
+        if not resource:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024  # Linux reports KB
+
+    def checkpoint(self, label, **retained):
+        """
+        Records the memory at the end of a phase.
+        :param label: The phase, e.g. 'compile' or 'update tests.test_foo'
+        :param retained: Optional sizes (from retained_size()) of what the run is holding on to, by name
+        :unit_test:
+        """
+        checkpoint = {'label': label, 'current': None, 'peak': self.get_peak_rss(), 'top': [], 'retained': retained}
+        if self.is_tracing():
+            checkpoint['current'], checkpoint['peak'] = tracemalloc.get_traced_memory()
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()  # So the next checkpoint's peak is its own
+
+            snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+            for stat in snapshot.compare_to(self.snapshot, 'lineno')[:self.top]:
+                frame = stat.traceback[0]
+                checkpoint['top'].append({'site': '%s:%d' % (frame.filename, frame.lineno),
+                                          'size_diff': stat.size_diff, 'count_diff': stat.count_diff})
+            self.snapshot = snapshot
+
+        self.checkpoints.append(checkpoint)
+        return checkpoint
+
+    def to_dict(self):
+        """
+        :unit_test:
+        """
+        return {'tracemalloc': bool(tracemalloc), 'checkpoints': self.checkpoints}
+
+    def format_report(self):
+        """
+        :returns: The report as a list of lines
+        :unit_test:
+        """
+        def kb(size):
+            return '%10.1f' % (size / 1024.0) if size is not None else '%10s' % '-'
+
+        peak_name = 'peak (KB)' if tracemalloc else 'peak RSS (KB)'
+        lines = ['%-40s %10s %13s  %s' % ('phase', 'now (KB)', peak_name, 'retained (KB)')]
+        for checkpoint in self.checkpoints:
+            retained = ', '.join('%s %.1f' % (name, size / 1024.0) for name, size in sorted(checkpoint['retained'].items()))
+            lines.append('%-40s %s %13s  %s' % (checkpoint['label'], kb(checkpoint['current']), kb(checkpoint['peak']).strip(), retained))
+            for site in checkpoint['top']:
+                lines.append('    %+10.1f KB %+7d  %s' % (site['size_diff'] / 1024.0, site['count_diff'], site['site']))
+        if not tracemalloc:
+            lines.append('(tracemalloc is not available on this Python - showing the peak RSS, without allocation sites)')
+        return lines
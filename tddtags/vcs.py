@@ -0,0 +1,172 @@
+"""
+The git plumbing tddtags needs to scan only what changed: which source files are staged or differ
+from a ref, and what the index holds for them. Runs the local git command line, so there's no
+library to install.
+
+--> The related default test [package.]module to update
+:unit_test_module: tests.test_vcs
+--> The default TestCase class for module-level functions
+:unit_test_class: VcsGlobalTests
+"""
+import os
+import re
+import subprocess
+
+# --> A hunk header: @@ -old_start[,old_count] +new_start[,new_count] @@. A count that's left out is 1.
+re_hunk_header = re.compile(r'^@@ -\d+(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+class GitError(Exception):
+    """
+    Raised when git isn't installed, the directory isn't in a work tree, or a git command fails.
+    """
+    pass
+
+
+def run_git(args, cwd=None, input_data=None):
+    """
+    Runs a git command and returns what it wrote to stdout.
+    :param args: The arguments after 'git'
+    :param cwd: The directory to run in. Default is getcwd().
+    :param input_data: Optional text to feed to git's stdin
+    :raises: GitError if git can't be run or exits non-zero
+    :unit_test: run_git
+    :unit_test: run_git_error
+    """
+    try:
+        process = subprocess.Popen(['git'] + list(args), cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   stdin=subprocess.PIPE if input_data is not None else None)
+    except OSError as ex:
+        raise GitError('Failed to run git -> %s' % ex)
+
+    out, err = process.communicate(input_data)
+    if process.returncode:
+        raise GitError('git %s failed -> %s' % (args[0], err.strip()))
+    return out
+
+
+def get_top_dir(cwd=None):
+    """
+    :returns: The top directory of the work tree that cwd is in
+    :raises: GitError if it isn't in one
+    :unit_test: get_top_dir
+    """
+    return run_git(['rev-parse', '--show-toplevel'], cwd=cwd).rstrip('\n')
+
+
+def get_staged_files(top_dir, suffix='.py'):
+    """
+    Lists the files that are added, copied, modified or renamed in the index - what the next commit
+    brings in. Deleted files are left out since there's nothing to scan.
+    :param top_dir: The top directory of the work tree
+    :param suffix: Only the files whose names end with this. None for all of them.
+    :returns: The list of absolute paths, in git's (sorted) order
+    :unit_test: get_staged_files
+    """
+    out = run_git(['diff', '--cached', '--name-only', '--diff-filter=ACMR', '-z'], cwd=top_dir)
+    return _split_names(out, top_dir, suffix)
+
+
+def get_changed_files(top_dir, ref, suffix='.py'):
+    """
+    Lists the files that are added, copied, modified or renamed since the merge base of ref and HEAD,
+    counting the changes that aren't committed yet - everything a branch brings in against ref. A module
+    that's renamed is listed by its new name, and deleted files are left out. Untracked files aren't
+    listed, since git doesn't know about them.
+    :param top_dir: The top directory of the work tree
+    :param ref: The branch, tag or commit to compare against, e.g. origin/master
+    :param suffix: Only the files whose names end with this. None for all of them.
+    :returns: The list of absolute paths, in git's (sorted) order
+    :raises: GitError for a ref that git doesn't know
+    :unit_test: get_changed_files
+    :unit_test: get_changed_files_bad_ref
+    """
+    base = run_git(['merge-base', ref, 'HEAD'], cwd=top_dir).strip()
+    out = run_git(['diff', '--name-only', '--diff-filter=ACMR', '-z', base, '--'], cwd=top_dir)
+    return _split_names(out, top_dir, suffix)
+
+
+def get_changed_lines(top_dir, ref, suffix='.py'):
+    """
+    Finds the lines that changed in each file since the merge base of ref and HEAD, counting the
+    changes that aren't committed yet, from a diff with no context lines. The line numbers are for
+    the working tree's version of the file. Where lines were only removed, the lines either side of
+    the gap are counted as changed.
+    :param top_dir: The top directory of the work tree
+    :param ref: The branch, tag or commit to compare against
+    :param suffix: Only the files whose names end with this. None for all of them.
+    :returns: Dict of absolute path -> set of 1 based line numbers, for the files that are added, copied,
+              modified or renamed
+    :raises: GitError for a ref that git doesn't know
+    :unit_test: get_changed_lines
+    :unit_test: get_changed_lines_removed
+    """
+    base = run_git(['merge-base', ref, 'HEAD'], cwd=top_dir).strip()
+    out = run_git(['diff', '-U0', '--no-color', '--no-ext-diff', '--diff-filter=ACMR', base, '--'], cwd=top_dir)
+
+    changed = {}
+    lines = None
+    pending = 0  # The lines left in the current hunk's body
+    for line in out.split('\n'):
+        if line.startswith('\\'):
+            continue  # "\ No newline at end of file" isn't counted in a hunk
+        if pending:
+            pending -= 1
+        elif line.startswith('+++ '):
+            name = line[4:]
+            lines = None
+            if name.startswith('b/') and (suffix is None or name.endswith(suffix)):
+                lines = changed.setdefault(os.path.join(top_dir, name[2:]), set())
+        elif line.startswith('@@ '):
+            m = re_hunk_header.match(line)
+            if not m:
+                continue
+            old_count = int(m.group(1) or 1)
+            new_start, new_count = int(m.group(2)), int(m.group(3) or 1)
+            pending = old_count + new_count
+            if lines is None:
+                continue
+            if new_count:
+                lines.update(xrange(new_start, new_start + new_count))
+            else:
+                lines.update([max(new_start, 1), new_start + 1])
+    return changed
+
+
+def _split_names(out, top_dir, suffix):
+    """
+    :returns: The absolute paths for git's NUL separated list of names, filtered by suffix
+    """
+    return [os.path.join(top_dir, name) for name in out.split('\0')
+            if name and (suffix is None or name.endswith(suffix))]
+
+
+def read_staged(paths, top_dir):
+    """
+    Reads the content that's staged for each file, which can differ from the working tree when only
+    part of a change has been added. All the files are read through one 'git cat-file --batch'.
+    :param paths: The file paths, absolute or relative to top_dir
+    :param top_dir: The top directory of the work tree
+    :returns: A dict of path -> staged content. A file that isn't in the index is left out.
+    :unit_test: read_staged
+    :unit_test: read_staged_missing
+    """
+    if not paths:
+        return {}
+
+    names = [os.path.relpath(os.path.join(top_dir, path), top_dir) for path in paths]
+    out = run_git(['cat-file', '--batch'], cwd=top_dir, input_data=''.join(':%s\n' % name for name in names))
+
+    # --> Each object comes back as "<sha> blob <size>\n<content>\n", or "<name> missing\n"
+    contents = {}
+    pos = 0
+    for path in paths:
+        end = out.index('\n', pos)
+        header = out[pos:end].split(' ')
+        pos = end + 1
+        if len(header) != 3 or header[1] != 'blob':
+            continue
+        size = int(header[2])
+        contents[path] = out[pos:pos + size]
+        pos += size + 1
+    return contents
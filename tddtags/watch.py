@@ -0,0 +1,311 @@
+"""
+Watch mode for tddtags: stays running and regenerates the unit test skeletons for source modules
+as they are saved.
+
+--> The related default test [package.]module to update
+:unit_test_module: tests.test_watch
+--> The default TestCase class for module-level functions
+:unit_test_class: WatchGlobalTests
+"""
+import os
+import time
+import errno
+import fnmatch
+import select
+import struct
+import ctypes
+import ctypes.util
+
+from tddtags._core import ModuleLoader, CompileTags, TDDTag
+
+# --> The inotify(7) constants we use
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+
+class PollingWatcher(object):
+    """
+    Watches a directory tree for changed .py files by comparing mtimes. The fallback for when
+    inotify isn't available.
+    :unit_test_class: PollingWatcherTests
+    """
+    def __init__(self, top_dir, excludes=None, interval=0.5):
+        """
+        :param top_dir: The directory tree to watch
+        :param excludes: Optional list of fnmatch patterns for files/directories to skip
+        :param interval: Seconds between polls
+        :unit_test: create_instance
+        """
+        self.top_dir = top_dir
+        self.excludes = excludes or []
+        self.interval = interval
+        self.mtimes = self.snapshot()
+
+    def snapshot(self):
+        """
+        :returns: Dictionary of path to mtime for the .py files in the tree
+        :unit_test:
+        """
+        mtimes = {}
+        for path in ModuleLoader.find_source_files(self.top_dir, self.excludes):
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                pass  # Deleted between the walk and the stat
+        return mtimes
+
+    def poll(self):
+        """
+        :returns: The set of paths added or modified since the last poll
+        :unit_test:
+        """
+        mtimes = self.snapshot()
+        changed = set(path for path, mtime in mtimes.items() if self.mtimes.get(path) != mtime)
+        self.mtimes = mtimes
+        return changed
+
+    def wait(self, timeout=None):
+        """
+        Waits for changes.
+        :param timeout: Seconds to wait, or None to wait until there is a change
+        :returns: The set of changed paths, empty if the timeout ran out
+        :unit_test: wait_timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            delay = self.interval if deadline is None else max(0, min(self.interval, deadline - time.time()))
+            time.sleep(delay)
+            changed = self.poll()
+            if changed or (deadline is not None and time.time() >= deadline):
+                return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """
+    Watches a directory tree for changed .py files with Linux inotify, through ctypes. New
+    directories are added to the watch as they are created.
+    :unit_test_class: InotifyWatcherTests
+    """
+    event_mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    event_header = struct.Struct('iIII')
+
+    _libc = None
+
+    def __init__(self, top_dir, excludes=None):
+        """
+        :param top_dir: The directory tree to watch
+        :param excludes: Optional list of fnmatch patterns for files/directories to skip
+        :raises: OSError if inotify can't be set up
+        :unit_test: create_instance
+        """
+        self.top_dir = top_dir
+        self.excludes = excludes or []
+        self.watch_dirs = {}
+
+        libc = InotifyWatcher.get_libc()
+        if not libc:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+
+        self.fd = libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+        self._add_tree(top_dir)
+
+    @classmethod
+    def get_libc(cls):
+        """
+        :returns: The C library, if it has inotify, otherwise None
+        :unit_test:
+        """
+        if cls._libc is None:
+            cls._libc = False
+            library = ctypes.util.find_library('c')
+            if library:
+                libc = ctypes.CDLL(library, use_errno=True)
+                if hasattr(libc, 'inotify_init') and hasattr(libc, 'inotify_add_watch'):
+                    cls._libc = libc
+        return cls._libc
+
+    def _excluded(self, path):
+        name = os.path.basename(path)
+        rel_path = os.path.relpath(path, self.top_dir)
+        return [pattern for pattern in self.excludes if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(rel_path, pattern)]
+
+    def _add_tree(self, top_dir):
+        for path, dir_names, file_names in os.walk(top_dir):
+            dir_names[:] = [name for name in dir_names if not name.startswith('.') and name != '__pycache__'
+                            and not self._excluded(os.path.join(path, name))]
+            wd = InotifyWatcher.get_libc().inotify_add_watch(self.fd, path, self.event_mask)
+            if wd < 0:
+                print 'Warning: Failed to watch %s (errno %d)' % (path, ctypes.get_errno())
+                continue
+            self.watch_dirs[wd] = path
+
+    def read_events(self, buff):
+        """
+        Parses a buffer of inotify events.
+        :returns: The set of .py paths that changed
+        :unit_test:
+        """
+        changed = set()
+        offset = 0
+        while offset + self.event_header.size <= len(buff):
+            wd, mask, cookie, name_len = self.event_header.unpack_from(buff, offset)
+            offset += self.event_header.size
+            name = buff[offset:offset + name_len].rstrip('\0')
+            offset += name_len
+
+            if mask & IN_Q_OVERFLOW:
+                print 'Warning: inotify queue overflowed - some changes were missed'
+                continue
+            if wd not in self.watch_dirs or mask & IN_IGNORED:
+                continue
+
+            path = os.path.join(self.watch_dirs[wd], name)
+            if self._excluded(path):
+                continue
+            if mask & IN_ISDIR:
+                if mask & IN_CREATE and not name.startswith('.'):
+                    self._add_tree(path)
+            elif name.endswith('.py') and mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                changed.add(path)
+        return changed
+
+    def wait(self, timeout=None):
+        """
+        Waits for changes.
+        :param timeout: Seconds to wait, or None to wait until there is a change
+        :returns: The set of changed paths, empty if the timeout ran out
+        :unit_test: wait_timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if readable:
+                changed = self.read_events(os.read(self.fd, 65536))
+                if changed:
+                    return changed
+            if deadline is not None and time.time() >= deadline:
+                return set()
+
+    def close(self):
+        os.close(self.fd)
+
+
+def create_watcher(top_dir, excludes=None, poll=False):
+    """
+    Creates the inotify watcher, or the polling watcher if asked for or if inotify isn't available.
+    :unit_test:
+    """
+    if not poll:
+        try:
+            return InotifyWatcher(top_dir=top_dir, excludes=excludes)
+        except OSError as ex:
+            print '- inotify not available (%s), polling for changes instead' % ex
+    return PollingWatcher(top_dir=top_dir, excludes=excludes)
+
+
+class TagWatcher(object):
+    """
+    Re-runs the compile and update steps for the source modules that change. A burst of saves
+    is debounced into one update, and the most recently saved module is handled first.
+    :unit_test_class: TagWatcherTests
+    """
+    def __init__(self, watcher, debounce=0.05, session=None):
+        """
+        :param watcher: The InotifyWatcher or PollingWatcher
+        :param debounce: Seconds of quiet that end a burst of changes
+        :param session: The TDDTagSession to run in. Default is the global session.
+        :unit_test: create_instance
+        """
+        self.watcher = watcher
+        self.debounce = debounce
+        self.tag = TDDTag(session=session)
+        self.session = self.tag.session
+        self.written = {}  # Test module path -> mtime after we updated it, so our own saves are ignored
+
+    def run(self, targets, excludes=None, jobs=1):
+        """
+        Brings the test modules up to date with a full run over the targets, then updates them
+        as the sources change. Runs until interrupted.
+        """
+        self.tag.run(source_module_name=targets, excludes=excludes, jobs=jobs)
+        print 'Watching %s for changes (Ctrl-C to stop)' % self.watcher.top_dir
+        try:
+            while True:
+                self.update(self.collect_changes())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.watcher.close()
+
+    def collect_changes(self):
+        """
+        Waits for a change, then keeps collecting until the burst goes quiet.
+        :returns: The set of changed paths
+        :unit_test:
+        """
+        changed = self.watcher.wait()
+        while True:
+            more = self.watcher.wait(timeout=self.debounce)
+            if not more:
+                return changed
+            changed |= more
+
+    def order_changes(self, paths):
+        """
+        Orders the changed paths newest first, leaving out deleted files and the test modules
+        we saved ourselves.
+        :unit_test:
+        :unit_test: order_changes_skips_written
+        """
+        mtimes = {}
+        for path in paths:
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            if self.written.get(path) == mtime:
+                continue
+            mtimes[path] = mtime
+        return sorted(mtimes, key=lambda path: (-mtimes[path], path))
+
+    def update(self, paths):
+        """
+        Compiles each changed source module and updates just the test modules its tags refer to.
+        :param paths: The changed source file paths
+        :returns: The count of modules updated
+        :unit_test:
+        """
+        loader = self.session.module_loader
+        updated_cnt = 0
+        for path in self.order_changes(paths):
+            module_name = ModuleLoader.module_name_for_path(path)
+            if self.session.config['verbose']:
+                print '+ Changed: %s (%s)' % (module_name, path)
+
+            # --> Start from an empty model, so only this module's test modules are touched
+            self.session.test_module_details.clear()
+            loader.unload_module(module_name)
+            compiler = CompileTags(source_module_name=module_name, session=self.session)
+            if not compiler.compile():
+                continue
+
+            test_module_names = list(self.session.test_module_details)
+            self.tag.process_referenced_test_modules()
+            updated_cnt += 1
+
+            for test_module_name in test_module_names:
+                test_path = loader.find_source(test_module_name)
+                if test_path:
+                    self.written[test_path] = os.stat(test_path).st_mtime
+
+        return updated_cnt
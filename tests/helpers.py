@@ -0,0 +1,45 @@
+"""
+helpers.py
+----------------------------------
+
+Fixtures shared by the test modules.
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+
+class TempDirMixin(object):
+    """
+    Gives each test an empty temporary directory, self.top_dir, and removes it afterwards - with the
+    sys.path entry that a session's module loader adds when it's the anchor directory.
+    """
+    def setUp(self):
+        super(TempDirMixin, self).setUp()
+        self.top_dir = os.path.realpath(tempfile.mkdtemp())
+
+    def tearDown(self):
+        super(TempDirMixin, self).tearDown()
+        while self.top_dir in sys.path:
+            sys.path.remove(self.top_dir)
+        shutil.rmtree(self.top_dir)
+
+    def write(self, path, text, mtime_offset=0):
+        """
+        Writes a file, making its directory if needed.
+        :param path: The file's path, or its name under top_dir
+        :param text: The file's text
+        :param mtime_offset: Seconds to move the file's mtime on by, so the change shows even within the
+                             filesystem's mtime resolution
+        :returns: The file's path
+        """
+        path = os.path.join(self.top_dir, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(text)
+        if mtime_offset:
+            stat = os.stat(path)
+            os.utime(path, (stat.st_atime, stat.st_mtime + mtime_offset))
+        return path
@@ -0,0 +1,191 @@
+"""
+test_affected.py
+----------------------------------
+
+Tests for the `tddtags.affected` and `tddtags.pytest_plugin` modules.
+"""
+import os
+from unittest import TestCase
+import mock
+
+from tddtags.core import CompileTags, TDDTagSession
+from tddtags.affected import AffectedTest, get_symbol_spans, find_changed_symbols, is_affected, select_tags, \
+    resolve_tests, find_affected_tests
+from tddtags import pytest_plugin
+from tests.test_vcs import GitRepoMixin
+
+SOURCE_TEXT = '''"""
+:unit_test_module: test_aff
+:unit_test_class: AffTests
+:unit_test: module_level
+"""
+LIMIT = 1
+
+
+def foo():
+    """
+    :unit_test: foo
+    """
+    return LIMIT
+
+
+class Bar(object):
+    """
+    :unit_test_class: BarTests
+    :unit_test: bar
+    """
+    def baz(self):
+        """
+        :unit_test: baz
+        """
+        return 1
+
+    def qux(self):
+        """
+        :unit_test: qux
+        """
+        return 2
+'''
+
+TEST_TEXT = '''from unittest import TestCase
+
+
+class AffTests(TestCase):
+    def test_module_level(self):
+        pass
+
+    def test_foo(self):
+        pass
+
+
+class BarTests(TestCase):
+    def test_bar(self):
+        pass
+
+    def test_baz(self):
+        pass
+
+    def test_qux(self):
+        pass
+'''
+
+
+class AffectedRepoMixin(GitRepoMixin):
+    def setUp(self):
+        super(AffectedRepoMixin, self).setUp()
+        self.source_path = self.write('aff_src.py', SOURCE_TEXT)
+        self.test_path = self.write('test_aff.py', TEST_TEXT)
+        self.commit()
+        self.session = TDDTagSession(anchor_dir=self.top_dir)
+
+    def change(self, old, new):
+        self.write('aff_src.py', SOURCE_TEXT.replace(old, new), stage=False)
+
+    def get_test_names(self, tests):
+        return ['%s.%s' % (test.class_name, test.method_name) for test in tests]
+
+
+class AffectedTestTests(TestCase):
+    def setUp(self):
+        self.test = AffectedTest('/top/tests/test_x.py', 'tests.test_x', 'FooTests', 'test_bar')
+
+    def test_create_instance(self):
+        self.assertEqual((self.test.path, self.test.module_name), ('/top/tests/test_x.py', 'tests.test_x'))
+        self.assertEqual(self.test, AffectedTest('/top/tests/test_x.py', 'tests.test_x', 'FooTests', 'test_bar'))
+        self.assertNotEqual(self.test, AffectedTest('/top/tests/test_x.py', 'tests.test_x', 'FooTests', 'test_baz'))
+
+    def test_pytest_id(self):
+        self.assertEqual(self.test.pytest_id('/top'), 'tests/test_x.py::FooTests::test_bar')
+
+    def test_unittest_id(self):
+        self.assertEqual(self.test.unittest_id(), 'tests.test_x.FooTests.test_bar')
+
+    # -- TDDTag: /AffectedTestTests ---
+
+
+class AffectedGlobalTests(AffectedRepoMixin, TestCase):
+    def parse(self):
+        return CompileTags.parse_source(source_path=self.source_path, module_name='aff_src')
+
+    def test_get_symbol_spans(self):
+        self.assertEqual(get_symbol_spans(self.parse()), [
+            ('aff_src', 1, 31), ('aff_src.Bar', 16, 31), ('aff_src.Bar.baz', 21, 26), ('aff_src.Bar.qux', 27, 31),
+            ('aff_src.foo', 9, 15)])
+
+    def test_find_changed_symbols(self):
+        self.assertEqual(find_changed_symbols(self.parse(), set([6, 13, 26])), set(['aff_src', 'aff_src.foo', 'aff_src.Bar.baz']))
+        self.assertEqual(find_changed_symbols(self.parse(), set([100])), set(['aff_src']))
+
+    def test_is_affected(self):
+        self.assertTrue(is_affected('pkg.mod.Bar.baz', set(['pkg.mod.Bar.baz'])))
+        self.assertTrue(is_affected('pkg.mod.Bar.baz', set(['pkg.mod.Bar'])))
+        self.assertTrue(is_affected('pkg.mod.Bar', set(['pkg.mod.Bar.baz'])))
+        self.assertFalse(is_affected('pkg.mod.Bar.qux', set(['pkg.mod.Bar.baz'])))
+        self.assertFalse(is_affected('pkg.mod.Barn', set(['pkg.mod.Bar'])))
+
+    def test_select_tags(self):
+        self.change('return 1', 'return 3')
+        records, changed_symbols = select_tags(self.source_path, set([26]), session=self.session)
+        self.assertEqual(changed_symbols, set(['aff_src.Bar.baz']))
+        self.assertEqual(sorted(records), [('test_aff', 'AffTests', 'module_level'), ('test_aff', 'BarTests', 'bar'),
+                                           ('test_aff', 'BarTests', 'baz')])
+
+    def test_select_tags_runtime_docstrings(self):
+        """Verify all of a module's tags are picked when its lines can't be mapped"""
+        with mock.patch('tddtags.core.CompileTags.parse_source', spec=True) as parse_source:
+            parse_source.return_value = None
+            records, changed_symbols = select_tags(self.source_path, set([26]), session=self.session)
+        self.assertEqual(changed_symbols, set(['aff_src']))
+        self.assertEqual(len(set(records)), 5)
+
+    def test_resolve_tests(self):
+        tests = resolve_tests([('test_aff', 'BarTests', 'baz'), ('test_aff', 'BarTests', 'baz'), ('test_aff', 'BarTests', 'unwritten'),
+                               ('test_aff', 'NoTests', 'baz'), ('no_such_test_module', 'BarTests', 'baz')], session=self.session)
+        self.assertEqual(tests, [AffectedTest(self.test_path, 'test_aff', 'BarTests', 'test_baz')])
+
+    def test_find_affected_tests(self):
+        self.assertEqual(find_affected_tests('HEAD', session=self.session), ([], []))
+
+        self.change('return 2', 'return 4')
+        tests, changed_symbols = find_affected_tests('HEAD', session=self.session)
+        self.assertEqual(changed_symbols, ['aff_src.Bar.qux'])
+        self.assertEqual(self.get_test_names(tests), ['AffTests.test_module_level', 'BarTests.test_bar', 'BarTests.test_qux'])
+
+        # --> A module-level change covers everything in the module
+        self.change('LIMIT = 1', 'LIMIT = 2')
+        tests, changed_symbols = find_affected_tests('HEAD', session=self.session)
+        self.assertEqual(changed_symbols, ['aff_src'])
+        self.assertEqual(len(tests), 5)
+        self.assertEqual(find_affected_tests('HEAD', session=self.session, excludes=['aff_*']), ([], []))
+
+    # -- TDDTag: /AffectedGlobalTests ---
+
+
+class PytestPluginTests(AffectedRepoMixin, TestCase):
+    def create_item(self, path, cls, name):
+        item = mock.Mock(fspath=path, originalname=None)
+        item.cls = cls
+        item.name = name
+        return item
+
+    def test_collection_modifyitems(self):
+        class BarTests(object):
+            pass
+
+        self.change('return 1', 'return 3')
+        config = mock.Mock()
+        config.getoption.side_effect = {'tddtags_since': 'HEAD', 'tddtags_anchor': self.top_dir}.get
+        items = [self.create_item(self.test_path, BarTests, 'test_baz'), self.create_item(self.test_path, BarTests, 'test_qux'),
+                 self.create_item(os.path.join(self.top_dir, 'other.py'), None, 'test_baz')]
+        pytest_plugin.pytest_collection_modifyitems(session=None, config=config, items=items)
+        self.assertEqual([item.name for item in items], ['test_baz'])
+        self.assertEqual(len(config.hook.pytest_deselected.call_args[1]['items']), 2)
+
+    def test_collection_modifyitems_off(self):
+        config = mock.Mock()
+        config.getoption.return_value = None
+        items = [self.create_item(self.test_path, None, 'test_baz')]
+        pytest_plugin.pytest_collection_modifyitems(session=None, config=config, items=items)
+        self.assertEqual(len(items), 1)
+
+    # -- TDDTag: /PytestPluginTests ---
@@ -0,0 +1,38 @@
+"""
+test_bench.py
+----------------------------------
+
+Smoke test for benchmarks/bench_tddtags.py.
+"""
+import os
+import sys
+import json
+import subprocess
+from unittest import TestCase
+
+from tests.helpers import TempDirMixin
+
+BENCH_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'bench_tddtags.py')
+
+
+class BenchTests(TempDirMixin, TestCase):
+    def test_run_tiny_corpus(self):
+        output_path = os.path.join(self.top_dir, 'bench.json')
+        process = subprocess.Popen([sys.executable, BENCH_PATH, '--sizes', '2', '--many-classes', '5', '--repeat', '1',
+                                    '--output', output_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        self.assertEqual(process.returncode, 0, stderr)
+        with open(output_path) as f:
+            results = json.load(f)
+        self.assertEqual(results['sizes']['2']['modules'], 4)
+        self.assertTrue(results['sizes']['2']['test_modules'])
+        self.assertEqual(len(results['sizes']['2']['phases']['compile']['warm']), 1)
+
+    def test_run_json_on_stdout(self):
+        process = subprocess.Popen([sys.executable, BENCH_PATH, '--sizes', '2', '--many-classes', '5', '--repeat', '1'],
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        self.assertEqual(process.returncode, 0, stderr)
+        self.assertEqual(json.loads(stdout)['meta']['repeat'], 1)
+
+    # -- TDDTag: /BenchTests ---
@@ -0,0 +1,152 @@
+"""
+test_debt.py
+----------------------------------
+
+Tests for the `tddtags.debt` module.
+"""
+import os
+from unittest import TestCase
+import mock
+
+from tddtags.core import TDDTagSession
+from tddtags.debt import StubDebt, UNKNOWN_SOURCE, find_stubs, find_test_modules, scan_debt
+from tests.helpers import TempDirMixin
+
+STUB = "self.fail('Test not implemented yet')"
+
+TEST_TEXT = '''""" test_owed - Generated and updated by TDDTag """
+
+from unittest import TestCase
+
+
+class FooTests(TestCase):
+    """
+    Generated by TDDTag
+    """
+    def setUp(self):
+        super(FooTests, self).setUp()
+
+    def test_stub(self):
+        self.fail('Test not implemented yet')
+
+    def test_written(self):
+        self.assertEqual(1, 1)
+
+    def test_stub_with_comment(self):
+        # TODO
+        self.fail('Test not implemented yet')
+
+    def test_started(self):
+        self.fail('Test not implemented yet')
+        self.assertEqual(1, 1)
+
+    def helper(self):
+        self.fail('Test not implemented yet')
+
+    # -- TDDTag: /FooTests ---
+
+STUB_LIMIT = 1
+
+
+class BarTests(TestCase):
+    def test_last(self):
+        self.fail('Test not implemented yet')
+'''
+
+
+class DebtDirMixin(TempDirMixin):
+    def setUp(self):
+        super(DebtDirMixin, self).setUp()
+        self.test_path = self.write('test_owed.py', TEST_TEXT)
+
+
+class StubDebtTests(TestCase):
+    def setUp(self):
+        self.debt = StubDebt()
+        self.debt.add('tests.test_a', '/t/test_a.py', 4, [('FooTests', 'test_x', 10), ('FooTests', 'test_y', 13),
+                                                          ('BarTests', 'test_x', 30)])
+        self.debt.add('tests.test_b', '/t/test_b.py', 2, [('BazTests', 'test_z', 8)])
+
+    def create_index(self):
+        rows = {
+            'tests.test_a': [{'test_id': 'tests.test_a.FooTests.test_x', 'source_module': 'pkg.a'},
+                             {'test_id': 'tests.test_a.FooTests.test_x', 'source_module': 'pkg.a'},
+                             {'test_id': 'tests.test_a.FooTests.test_y', 'source_module': 'pkg.a'},
+                             {'test_id': 'tests.test_a.FooTests.test_y', 'source_module': 'pkg.b'}],
+            'tests.test_b': [],
+        }
+        index = mock.Mock()
+        index.find_sources.side_effect = rows.get
+        return index
+
+    def test_create_instance(self):
+        debt = StubDebt()
+        self.assertEqual((debt.test_modules, debt.test_methods, debt.stubs, debt.sources), (0, 0, [], {}))
+
+    def test_add(self):
+        self.assertEqual((self.debt.test_modules, self.debt.test_methods), (2, 6))
+        self.assertEqual(self.debt.stubs[-1], ('tests.test_b', 'BazTests', 'test_z', '/t/test_b.py', 8))
+
+    def test_resolve_sources(self):
+        self.debt.resolve_sources(self.create_index())
+        self.assertEqual(self.debt.sources, {'tests.test_a.FooTests.test_x': ['pkg.a'],
+                                             'tests.test_a.FooTests.test_y': ['pkg.a', 'pkg.b']})
+
+    def test_count_by(self):
+        self.assertEqual(self.debt.count_by('module'), [('tests.test_a', 3), ('tests.test_b', 1)])
+        self.assertEqual(self.debt.count_by('class'), [('tests.test_a.FooTests', 2), ('tests.test_a.BarTests', 1),
+                                                       ('tests.test_b.BazTests', 1)])
+        self.assertEqual(self.debt.count_by('source'), [(UNKNOWN_SOURCE, 4)])
+        self.debt.resolve_sources(self.create_index())
+        self.assertEqual(self.debt.count_by('source'), [(UNKNOWN_SOURCE, 2), ('pkg.a', 2), ('pkg.b', 1)])
+
+    def test_to_dict(self):
+        data = self.debt.to_dict()
+        self.assertEqual((data['test_modules'], data['test_methods'], data['stubs']), (2, 6, 4))
+        self.assertEqual(data['by_module'], {'tests.test_a': 3, 'tests.test_b': 1})
+        self.assertEqual(data['stub_methods'][0], {'test_id': 'tests.test_a.FooTests.test_x', 'path': '/t/test_a.py', 'line': 10})
+
+    def test_format_report(self):
+        lines = self.debt.format_report()
+        self.assertTrue(lines[0].startswith('Stub debt: 4 of 6 test methods (66.7%) in 2 test modules'))
+        self.assertTrue('       3  tests.test_a' in lines)
+        self.assertTrue('By source module:' in lines)
+
+        lines = self.debt.format_report(top=1)
+        self.assertTrue('  ... and 2 more' in lines)
+        self.assertEqual(StubDebt().format_report(), ['Stub debt: 0 of 0 test methods (0.0%) in 0 test modules are '
+                                                      'unimplemented stubs (0.00s)'])
+
+    # -- TDDTag: /StubDebtTests ---
+
+
+class DebtGlobalTests(DebtDirMixin, TestCase):
+    def test_find_stubs(self):
+        method_count, stubs = find_stubs(self.test_path, [STUB])
+        self.assertEqual(method_count, 5)
+        self.assertEqual(stubs, [('FooTests', 'test_stub', 13), ('FooTests', 'test_stub_with_comment', 19),
+                                 ('BarTests', 'test_last', 36)])
+
+    def test_find_test_modules(self):
+        self.write('pkg/test_more.py', '')
+        self.write('pkg/tests_not.txt', '')
+        self.write('pkg/helpers.py', '')
+        self.write('build/test_built.py', '')
+        self.assertEqual(find_test_modules(self.top_dir, excludes=['build']),
+                         [self.test_path, os.path.join(self.top_dir, 'pkg', 'test_more.py')])
+        self.assertEqual(find_test_modules(self.top_dir, pattern='help*.py'), [os.path.join(self.top_dir, 'pkg', 'helpers.py')])
+
+    def test_scan_debt(self):
+        session = TDDTagSession(anchor_dir=self.top_dir, config={'test_method_body': "self.assertEqual(1, 1)"})
+        debt = scan_debt([self.test_path, os.path.join(self.top_dir, 'test_gone.py')], session=session)
+        self.assertEqual((debt.test_modules, debt.test_methods), (1, 5))
+        self.assertEqual(debt.stubs, [('test_owed', 'FooTests', 'test_written', self.test_path, 16)])
+
+    def test_scan_debt_parallel(self):
+        paths = [self.test_path] + [self.write('test_owed%d.py' % n, TEST_TEXT) for n in range(3)]
+        serial = scan_debt(paths, session=TDDTagSession(anchor_dir=self.top_dir))
+        parallel = scan_debt(paths, session=TDDTagSession(anchor_dir=self.top_dir), jobs=2)
+        self.assertEqual(len(parallel.stubs), 12)
+        self.assertEqual(parallel.stubs, serial.stubs)
+
+    # -- TDDTag: /DebtGlobalTests ---
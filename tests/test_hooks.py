@@ -0,0 +1,47 @@
+"""
+test_hooks.py
+----------------------------------
+
+Tests for the `tddtags.hooks` module.
+"""
+from unittest import TestCase
+
+from tddtags import hooks
+from tddtags.hooks import EventHooks
+
+
+class EventHooksTests(TestCase):
+    def setUp(self):
+        self.hooks = EventHooks()
+        self.calls = []
+
+    def record(self, event, **details):
+        self.calls.append((event, details))
+
+    def test_create_instance(self):
+        self.assertFalse(self.hooks)
+        self.assertEqual(self.hooks.callbacks, {})
+
+    def test_add(self):
+        self.hooks.add(hooks.TAG_FOUND, self.record)
+        self.assertTrue(self.hooks)
+        self.assertEqual(self.hooks.callbacks[hooks.TAG_FOUND], [self.record])
+
+    def test_add_unknown_event(self):
+        self.assertRaises(ValueError, self.hooks.add, 'no_such_event', self.record)
+        self.assertFalse(self.hooks)
+
+    def test_remove(self):
+        self.hooks.add(hooks.TAG_FOUND, self.record)
+        self.hooks.remove(hooks.TAG_FOUND, self.record)
+        self.assertFalse(self.hooks)
+        self.hooks.remove(hooks.TAG_FOUND, self.record)  # Safe to repeat
+
+    def test_fire(self):
+        self.hooks.fire(hooks.MODULE_SAVED, path='a.py')  # Nothing registered
+        self.hooks.add(hooks.MODULE_SAVED, self.record)
+        self.hooks.add(hooks.MODULE_SAVED, lambda event, **details: self.calls.append('second'))
+        self.hooks.fire(hooks.MODULE_SAVED, path='a.py', size=10)
+        self.assertEqual(self.calls, [(hooks.MODULE_SAVED, {'path': 'a.py', 'size': 10}), 'second'])
+
+    # -- TDDTag: /EventHooksTests ---
@@ -0,0 +1,136 @@
+"""
+test_index.py
+----------------------------------
+
+Tests for the `tddtags.index` module.
+"""
+import os
+import sqlite3
+from unittest import TestCase
+
+from tddtags.core import TDDTagSession
+from tddtags.index import TagIndex, SCHEMA_VERSION, get_index_path
+from tests.helpers import TempDirMixin
+
+SOURCE_TEXT = '''"""
+:unit_test_module: tests.test_idx
+:unit_test_class: IdxTests
+"""
+
+
+def foo():
+    """
+    :unit_test: foo
+    """
+
+
+class Bar(object):
+    """
+    :unit_test_class: BarTests
+    """
+    def baz(self):
+        """
+        :unit_test: baz
+        :unit_test: baz_again
+        """
+'''
+
+
+class IndexDirMixin(TempDirMixin):
+    def setUp(self):
+        super(IndexDirMixin, self).setUp()
+        self.source_path = os.path.join(self.top_dir, 'idx_src.py')
+        self.write(self.source_path, SOURCE_TEXT)
+        self.session = TDDTagSession(anchor_dir=self.top_dir)
+        self.index = TagIndex(os.path.join(self.top_dir, 'tags.db'), session=self.session)
+
+    def tearDown(self):
+        self.index.close()
+        super(IndexDirMixin, self).tearDown()
+
+    def get_test_ids(self, rows):
+        return [row['test_id'] for row in rows]
+
+
+class TagIndexTests(IndexDirMixin, TestCase):
+    def test_create_instance(self):
+        self.assertEqual(self.index.connection.execute('PRAGMA user_version').fetchone()[0], SCHEMA_VERSION)
+        self.assertEqual(self.index.find_tests('idx_src'), [])
+
+    def test_create_instance_old_schema(self):
+        """Verify an index from another version of the tables is rebuilt"""
+        path = os.path.join(self.top_dir, 'old.db')
+        connection = sqlite3.connect(path)
+        connection.execute('CREATE TABLE tags (symbol TEXT)')
+        connection.commit()
+        connection.close()
+        index = TagIndex(path, session=self.session)
+        try:
+            self.assertEqual(index.update(['idx_src']), 1)
+            self.assertEqual(len(index.find_tests('idx_src')), 3)
+        finally:
+            index.close()
+
+    def test_update(self):
+        self.assertEqual(self.index.update(['idx_src', 'no_such_module']), 1)
+        rows = self.index.find_tests('idx_src.foo')
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0], {
+            'source_path': self.source_path, 'source_module': 'idx_src', 'symbol': 'idx_src.foo', 'line': 7,
+            'test_module': 'tests.test_idx', 'test_class': 'IdxTests', 'test_method': 'test_foo',
+            'test_id': 'tests.test_idx.IdxTests.test_foo'})
+        self.assertFalse(self.session.test_module_details)
+
+    def test_update_unchanged(self):
+        self.index.update(['idx_src'])
+        self.assertEqual(self.index.update(['idx_src']), 0)
+        self.write(self.source_path, SOURCE_TEXT.replace(':unit_test: foo', ':unit_test: foo_renamed'), mtime_offset=10)
+        self.assertEqual(self.index.update(['idx_src']), 1)
+        self.assertEqual(self.get_test_ids(self.index.find_tests('idx_src.foo')), ['tests.test_idx.IdxTests.test_foo_renamed'])
+
+    def test_update_source(self):
+        self.assertTrue(self.index.update_source('idx_src', self.source_path))
+        self.assertFalse(self.index.update_source('idx_src', self.source_path))
+
+    def test_update_source_failed(self):
+        """Verify a file that no longer compiles is dropped"""
+        self.index.update_source('idx_src', self.source_path)
+        self.write(self.source_path, 'import no_such_module_xyz\n\n\ndef foo():\n    pass\nfoo.__doc__ = ":unit_test: foo"\n',
+                   mtime_offset=10)
+        self.assertFalse(self.index.update_source('idx_src', self.source_path))
+        self.assertEqual(self.index.find_tests('idx_src'), [])
+        self.assertEqual(self.index.connection.execute('SELECT COUNT(*) FROM sources').fetchone()[0], 0)
+
+    def test_prune(self):
+        self.index.update(['idx_src'])
+        self.assertEqual(self.index.prune(), 0)
+        os.remove(self.source_path)
+        self.assertEqual(self.index.prune(), 1)
+        self.assertEqual(self.index.find_tests('idx_src'), [])
+
+    def test_find_tests(self):
+        self.index.update(['idx_src'])
+        self.assertEqual(self.get_test_ids(self.index.find_tests('idx_src.Bar')),
+                         ['tests.test_idx.BarTests.test_baz', 'tests.test_idx.BarTests.test_baz_again'])
+        self.assertEqual(self.get_test_ids(self.index.find_tests('idx_src.Bar.baz')),
+                         ['tests.test_idx.BarTests.test_baz', 'tests.test_idx.BarTests.test_baz_again'])
+        self.assertEqual(len(self.index.find_tests('idx_src')), 3)
+        self.assertEqual(self.index.find_tests('idx_src.Ba'), [])
+
+    def test_find_sources(self):
+        self.index.update(['idx_src'])
+        self.assertEqual([row['symbol'] for row in self.index.find_sources('tests.test_idx.BarTests')],
+                         ['idx_src.Bar.baz', 'idx_src.Bar.baz'])
+        self.assertEqual([(row['symbol'], row['line']) for row in self.index.find_sources('tests.test_idx.IdxTests.test_foo')],
+                         [('idx_src.foo', 7)])
+        self.assertEqual(self.index.find_sources('tests.test_idx.IdxTests.test_fo'), [])
+
+    # -- TDDTag: /TagIndexTests ---
+
+
+class IndexGlobalTests(TestCase):
+    def test_get_index_path(self):
+        self.assertEqual(get_index_path('/a/b'), '/a/b/.tddtags.db')
+        self.assertEqual(get_index_path('/a/b', 'x.db'), os.path.abspath('x.db'))
+
+    # -- TDDTag: /IndexGlobalTests ---
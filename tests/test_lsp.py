@@ -0,0 +1,337 @@
+"""
+test_lsp.py
+----------------------------------
+
+Tests for the `tddtags.lsp` module.
+"""
+import os
+import sys
+import json
+import StringIO
+from unittest import TestCase
+
+import mock
+
+from tddtags.core import TDDTagSession, CompileTags
+from tddtags.lsp import JsonRpcStream, TagLocator, SourceDocument, LanguageServer, uri_to_path, path_to_uri, \
+    find_span_starts, make_text_edit, ERROR_METHOD_NOT_FOUND
+from tests.helpers import TempDirMixin
+
+SOURCE_TEXT = u'''"""
+:unit_test_module: lsp_test
+:unit_test_class: LspTests
+"""
+
+
+def foo():
+    """
+    :unit_test: foo
+    :unit_test: bar
+    """
+
+
+class Thing(object):
+    """
+    :unit_test_class: ThingTests
+    """
+    def go(self):
+        """
+        :unit_test:
+        """
+'''
+
+TEST_TEXT = '''from unittest import TestCase
+
+
+class LspTests(TestCase):
+    def test_bar(self):
+        pass
+
+    # -- TDDTag: /LspTests ---
+
+
+class ThingTests(TestCase):
+    def test_other(self):
+        pass
+
+    # -- TDDTag: /ThingTests ---
+'''
+
+
+class FakeStream(object):
+    def __init__(self, messages=None):
+        self.messages = list(messages or [])
+        self.written = []
+
+    def read_message(self):
+        return self.messages.pop(0) if self.messages else None
+
+    def write_message(self, message):
+        self.written.append(message)
+
+    def notifications(self, method):
+        return [message['params'] for message in self.written if message.get('method') == method]
+
+
+class LspDirMixin(TempDirMixin):
+    def setUp(self):
+        super(LspDirMixin, self).setUp()
+        self.source_path = self.write('lsp_src.py', SOURCE_TEXT)
+        self.test_path = self.write('lsp_test.py', TEST_TEXT)
+        self.session = TDDTagSession(anchor_dir=self.top_dir)
+        self.source_uri = path_to_uri(self.source_path)
+
+    def insert(self, line, text):
+        position = {'line': line, 'character': 0}
+        return {'range': {'start': position, 'end': position}, 'text': text}
+
+
+class JsonRpcStreamTests(TestCase):
+    def test_create_instance(self):
+        stream = JsonRpcStream(sys.stdin, sys.stdout)
+        self.assertEqual((stream.in_file, stream.out_file), (sys.stdin, sys.stdout))
+
+    def test_write_message(self):
+        output = StringIO.StringIO()
+        JsonRpcStream(None, output).write_message({'id': 1})
+        self.assertEqual(output.getvalue(), 'Content-Length: 9\r\n\r\n{"id": 1}')
+
+    def test_read_message(self):
+        text = 'Content-Length: 9\r\nContent-Type: application/vscode-jsonrpc\r\n\r\n{"id": 1}Content-Length: 2\r\n\r\n{}'
+        stream = JsonRpcStream(StringIO.StringIO(text), None)
+        self.assertEqual(stream.read_message(), {'id': 1})
+        self.assertEqual(stream.read_message(), {})
+
+    def test_read_message_eof(self):
+        self.assertEqual(JsonRpcStream(StringIO.StringIO(''), None).read_message(), None)
+
+    # -- TDDTag: /JsonRpcStreamTests ---
+
+
+class TagLocatorTests(TestCase):
+    def test_create_instance(self):
+        locator = TagLocator(source_module_name='lsp_src', session=TDDTagSession())
+        self.assertEqual(locator.tag_contexts, [])
+
+    def test_locate(self):
+        lines = SOURCE_TEXT.splitlines(True)
+        module = CompileTags.parse_source(source_path='lsp_src.py', module_name='lsp_src', source=SOURCE_TEXT.encode('utf-8'))
+        locator = TagLocator(source_module_name='lsp_src', session=TDDTagSession())
+        locator.handle_context(target=module, parent_context=module)
+        locations = [(tag.record, tag.line, tag.start, tag.end) for tag in locator.locate(lines)]
+        self.assertEqual(locations, [(('lsp_test', 'ThingTests', 'go'), 19, 8, 19),
+                                     (('lsp_test', 'LspTests', 'foo'), 8, 4, 19),
+                                     (('lsp_test', 'LspTests', 'bar'), 9, 4, 19)])
+
+    # -- TDDTag: /TagLocatorTests ---
+
+
+class SourceDocumentTests(LspDirMixin, TestCase):
+    def setUp(self):
+        super(SourceDocumentTests, self).setUp()
+        self.document = SourceDocument(uri=self.source_uri, text=SOURCE_TEXT, version=1)
+
+    def tag_lines(self):
+        return sorted((tag.line, tag.record[2]) for tag in self.document.get_tags())
+
+    def test_create_instance(self):
+        self.assertEqual(self.document.path, self.source_path)
+        self.assertEqual(self.document.module_name, 'lsp_src')
+        self.assertEqual(self.document.spans, None)
+
+    def test_get_tags(self):
+        self.assertEqual(self.document.get_tags(), [])
+        self.document.compile(session=self.session)
+        self.assertEqual(self.tag_lines(), [(8, 'foo'), (9, 'bar'), (19, 'go')])
+
+    def test_compile(self):
+        self.assertTrue(self.document.compile(session=self.session))
+        self.assertEqual([(span.start, span.end) for span in self.document.spans], [(6, 13), (13, 21)])
+        self.assertEqual(self.document.header_tags, [])
+
+        # --> Only Python modules are compiled
+        self.assertFalse(SourceDocument(uri=path_to_uri('notes.txt'), text=SOURCE_TEXT).compile(session=self.session))
+
+    def test_compile_syntax_error(self):
+        document = SourceDocument(uri=self.source_uri, text=SOURCE_TEXT + 'def broken(:\n')
+        self.assertFalse(document.compile(session=self.session))
+        self.assertEqual(document.spans, None)
+
+    def test_compile_span(self):
+        self.document.compile(session=self.session)
+        span = self.document.spans[1]
+        span.tags = []
+        self.assertTrue(self.document.compile_span(span, session=self.session))
+        self.assertEqual([(tag.line, tag.record) for tag in span.tags], [(19, ('lsp_test', 'ThingTests', 'go'))])
+
+    def test_apply_change(self):
+        """Verify an edit within a function recompiles just that function, and moves the tags after it"""
+        self.document.compile(session=self.session)
+        with mock.patch.object(SourceDocument, 'compile') as compile_module:
+            self.assertTrue(self.document.apply_change(self.insert(10, u'    :unit_test: baz\n'), session=self.session))
+            self.assertEqual(compile_module.call_count, 0)
+        self.assertEqual(self.tag_lines(), [(8, 'foo'), (9, 'bar'), (10, 'baz'), (20, 'go')])
+        self.assertEqual([(span.start, span.end) for span in self.document.spans], [(6, 14), (14, 22)])
+
+        # --> A span that doesn't parse keeps its tags until it does
+        change = {'range': {'start': {'line': 7, 'character': 0}, 'end': {'line': 8, 'character': 0}}, 'text': u'    (\n'}
+        self.assertFalse(self.document.apply_change(change, session=self.session))
+        self.assertEqual(self.tag_lines(), [(8, 'foo'), (9, 'bar'), (10, 'baz'), (20, 'go')])
+
+    def test_apply_change_new_span(self):
+        self.document.compile(session=self.session)
+        with mock.patch.object(SourceDocument, 'compile', wraps=self.document.compile) as compile_module:
+            self.document.apply_change(self.insert(12, u'def spam():\n    """:unit_test: spam"""\n\n\n'), session=self.session)
+            self.assertEqual(compile_module.call_count, 1)
+        self.assertEqual(self.tag_lines(), [(8, 'foo'), (9, 'bar'), (13, 'spam'), (23, 'go')])
+        self.assertEqual(len(self.document.spans), 3)
+
+    def test_apply_change_full_text(self):
+        self.document.compile(session=self.session)
+        self.assertTrue(self.document.apply_change({'text': SOURCE_TEXT.replace(':unit_test: bar\n', '')}, session=self.session))
+        self.assertEqual(self.tag_lines(), [(8, 'foo'), (18, 'go')])
+        self.assertEqual(self.document.revision, 1)
+
+    # -- TDDTag: /SourceDocumentTests ---
+
+
+class LanguageServerTests(LspDirMixin, TestCase):
+    def setUp(self):
+        super(LanguageServerTests, self).setUp()
+        self.stream = FakeStream()
+        self.server = LanguageServer(stream=self.stream, session=self.session)
+
+    def open(self, path, text):
+        self.server.handle_message({'jsonrpc': '2.0', 'method': 'textDocument/didOpen',
+                                    'params': {'textDocument': {'uri': path_to_uri(path), 'version': 1, 'text': text}}})
+
+    def diagnostics(self, uri):
+        """The diagnostics last published for the uri"""
+        published = self.stream.notifications('textDocument/publishDiagnostics')
+        return [params['diagnostics'] for params in published if params['uri'] == uri][-1]
+
+    def test_create_instance(self):
+        self.assertEqual(self.server.documents, {})
+        self.assertFalse(self.server.shutdown_requested)
+
+    def test_run(self):
+        self.stream.messages = [{'jsonrpc': '2.0', 'id': 1, 'method': 'shutdown'}, {'jsonrpc': '2.0', 'method': 'exit'}]
+        self.assertEqual(self.server.run(), 0)
+        self.assertEqual(self.stream.written, [{'jsonrpc': '2.0', 'id': 1, 'result': None}])
+
+        # --> Without the shutdown, the editor went away
+        self.assertEqual(LanguageServer(stream=FakeStream(), session=self.session).run(), 1)
+
+    def test_handle_message(self):
+        self.server.handle_message({'jsonrpc': '2.0', 'id': 1, 'method': 'initialize', 'params': {}})
+        result = self.stream.written[0]['result']
+        self.assertEqual(result['serverInfo']['name'], 'tddtags')
+        self.assertTrue(result['capabilities']['codeActionProvider'])
+
+    def test_handle_message_unknown(self):
+        self.server.handle_message({'jsonrpc': '2.0', 'method': '$/cancelRequest', 'params': {'id': 1}})
+        self.assertEqual(self.stream.written, [])
+        self.server.handle_message({'jsonrpc': '2.0', 'id': 2, 'method': 'textDocument/hover', 'params': {}})
+        self.assertEqual(self.stream.written[0]['error']['code'], ERROR_METHOD_NOT_FOUND)
+
+    def test_do_initialize(self):
+        self.assertEqual(self.server.do_initialize({})['capabilities']['textDocumentSync']['change'], 2)
+
+    def test_do_did_open(self):
+        self.open(self.source_path, SOURCE_TEXT)
+        diagnostics = self.diagnostics(self.source_uri)
+        self.assertEqual([(item['range']['start']['line'], item['message']) for item in diagnostics],
+                         [(8, 'No test method test_foo in lsp_test.LspTests'), (19, 'No test method test_go in lsp_test.ThingTests')])
+
+    def test_do_did_change(self):
+        self.open(self.source_path, SOURCE_TEXT)
+        self.server.handle_message({'jsonrpc': '2.0', 'method': 'textDocument/didChange', 'params': {
+            'textDocument': {'uri': self.source_uri, 'version': 2},
+            'contentChanges': [self.insert(10, u'    :unit_test: baz\n')]}})
+        self.assertEqual(len(self.diagnostics(self.source_uri)), 3)
+
+        # --> Adding the tests in the open test module clears the diagnostics
+        self.open(self.test_path, TEST_TEXT)
+        text = TEST_TEXT.replace('    def test_bar', '    def test_foo(self):\n        pass\n\n    def test_baz(self):\n        pass\n\n    def test_bar')
+        self.server.handle_message({'jsonrpc': '2.0', 'method': 'textDocument/didChange', 'params': {
+            'textDocument': {'uri': path_to_uri(self.test_path), 'version': 2}, 'contentChanges': [{'text': text}]}})
+        self.assertEqual([item['range']['start']['line'] for item in self.diagnostics(self.source_uri)], [20])
+
+    def test_do_did_close(self):
+        self.open(self.source_path, SOURCE_TEXT)
+        self.server.handle_message({'jsonrpc': '2.0', 'method': 'textDocument/didClose',
+                                    'params': {'textDocument': {'uri': self.source_uri}}})
+        self.assertEqual(self.diagnostics(self.source_uri), [])
+        self.assertEqual(self.server.documents, {})
+
+    def test_get_test_container(self):
+        container = self.server.get_test_container(self.test_path)
+        self.assertTrue(self.server.get_test_container(self.test_path) is container)
+        self.assertEqual(self.server.get_test_container(os.path.join(self.top_dir, 'none.py')), None)
+
+        # --> The editor's buffer wins over the file
+        self.open(self.test_path, TEST_TEXT.replace('LspTests', 'OtherTests'))
+        self.assertTrue('OtherTests' in self.server.get_test_container(self.test_path).class_spans)
+
+    def test_get_missing_tags(self):
+        self.open(self.source_path, SOURCE_TEXT)
+        missing = self.server.get_missing_tags(self.server.documents[self.source_uri])
+        self.assertEqual(sorted(tag.record[2] for tag in missing), ['foo', 'go'])
+
+    def test_do_code_action(self):
+        self.open(self.source_path, SOURCE_TEXT)
+        position = {'line': 8, 'character': 6}
+        actions = self.server.do_code_action({'textDocument': {'uri': self.source_uri},
+                                              'range': {'start': position, 'end': position}, 'context': {'diagnostics': []}})
+        self.assertEqual([action['title'] for action in actions], ['Add test stub test_foo to lsp_test.LspTests',
+                                                                   'Add the 2 missing test stubs for lsp_src'])
+        change = actions[0]['edit']['documentChanges'][0]
+        self.assertEqual(change['textDocument'], {'uri': path_to_uri(self.test_path), 'version': None})
+        edit = change['edits'][0]
+        self.assertEqual(edit['range']['start']['line'], 7)
+        self.assertTrue('def test_foo(self):' in edit['newText'])
+        self.assertFalse('test_go' in edit['newText'])
+
+    def test_make_stub_edit(self):
+        self.open(self.source_path, SOURCE_TEXT)
+        edit = self.server.make_stub_edit(self.server.get_missing_tags(self.server.documents[self.source_uri]))
+        text_edit = edit['documentChanges'][0]['edits'][0]
+        lines = TEST_TEXT.splitlines(True)
+        start, end = text_edit['range']['start']['line'], text_edit['range']['end']['line']
+        updated = ''.join(lines[:start]) + text_edit['newText'] + ''.join(lines[end:])
+        self.assertTrue('def test_foo(self):' in updated and 'def test_go(self):' in updated)
+        self.assertTrue(updated.index('test_foo') < updated.index('/LspTests') < updated.index('test_go') < updated.index('/ThingTests'))
+
+    def test_make_stub_edit_new_module(self):
+        os.remove(self.test_path)
+        self.open(self.source_path, SOURCE_TEXT)
+        edit = self.server.make_stub_edit(self.server.get_missing_tags(self.server.documents[self.source_uri]))
+        create, text_change = edit['documentChanges']
+        self.assertEqual(create['kind'], 'create')
+        self.assertEqual(create['uri'], path_to_uri(self.test_path))
+        new_text = text_change['edits'][0]['newText']
+        self.assertTrue('class LspTests(TestCase):' in new_text and 'def test_bar(self):' in new_text)
+
+    # -- TDDTag: /LanguageServerTests ---
+
+
+class LspGlobalTests(TestCase):
+    def test_uri_to_path(self):
+        self.assertEqual(uri_to_path('file:///tmp/a%20b/c.py'), '/tmp/a b/c.py')
+
+    def test_path_to_uri(self):
+        self.assertEqual(path_to_uri('/tmp/a b/c.py'), 'file:///tmp/a%20b/c.py')
+
+    def test_find_span_starts(self):
+        lines = ['import os\n', '@decorate\n', '@more\n', 'def foo():\n', '    pass\n', 'class Bar:\n', '    def baz(self): pass\n']
+        self.assertEqual(find_span_starts(lines), [1, 5])
+        self.assertEqual(find_span_starts(lines, start=2, end=5), [2])
+
+    def test_make_text_edit(self):
+        old = ['a\n', 'b\n', 'c\n']
+        edit = make_text_edit(old, ['a\n', 'x\n', 'y\n', 'b\n', 'c\n'])
+        self.assertEqual(edit, {'range': {'start': {'line': 1, 'character': 0}, 'end': {'line': 1, 'character': 0}},
+                                'newText': 'x\ny\n'})
+        self.assertEqual(make_text_edit(old, old)['newText'], '')
+
+    # -- TDDTag: /LspGlobalTests ---
@@ -0,0 +1,118 @@
+"""
+test_main.py
+----------------------------------
+
+Tests for the `tddtags.__main__` command line.
+"""
+import os
+import sys
+from unittest import TestCase
+import mock
+
+from tddtags import __main__ as cli
+from tests.helpers import TempDirMixin
+
+
+class RunScanTests(TempDirMixin, TestCase):
+    def run_scan(self, argv):
+        """
+        :returns: (the exit code, the kwargs TDDTag.run was called with, the session it ran in)
+        """
+        with mock.patch('tddtags.__main__.TDDTag') as tddtag:
+            tddtag.return_value.run.return_value = True
+            result = cli.run_scan(['-a', self.top_dir] + argv)
+        return result, tddtag.return_value.run.call_args[1], tddtag.call_args[1]['session']
+
+    def test_cache(self):
+        result, kwargs, session = self.run_scan(['--cache', 'pkg'])
+        self.assertEqual((result, kwargs['source_module_name']), (0, ['pkg']))
+        self.assertEqual(session.config['cache_dir'], cli.DEFAULT_CACHE_DIR)
+
+        result, kwargs, session = self.run_scan(['--cache-dir', 'build/cache', 'pkg'])
+        self.assertEqual(kwargs['source_module_name'], ['pkg'])
+        self.assertEqual(session.config['cache_dir'], 'build/cache')
+
+        result, kwargs, session = self.run_scan(['pkg'])
+        self.assertEqual(session.config['cache_dir'], None)
+
+    def test_index(self):
+        with mock.patch('tddtags.index.TagIndex') as tag_index:
+            result, kwargs, session = self.run_scan(['--index', 'pkg'])
+            self.assertEqual(kwargs['source_module_name'], ['pkg'])
+            self.assertEqual(tag_index.call_args[0][0], os.path.join(self.top_dir, '.tddtags.db'))
+            self.assertTrue(kwargs['index'] is tag_index.return_value)
+
+            result, kwargs, session = self.run_scan(['--index-path', 'tags.db', 'pkg'])
+            self.assertEqual(kwargs['source_module_name'], ['pkg'])
+            self.assertEqual(tag_index.call_args[0][0], os.path.abspath('tags.db'))
+
+        result, kwargs, session = self.run_scan(['pkg'])
+        self.assertEqual(kwargs['index'], None)
+
+    # -- TDDTag: /RunScanTests ---
+
+
+class RunWatchTests(TempDirMixin, TestCase):
+    def setUp(self):
+        super(RunWatchTests, self).setUp()
+        self.write('setup.py', 'import os\nopen(os.path.join(os.path.dirname(__file__), "imported"), "w").close()\n'
+                               'raise SystemExit("error: invalid command \'watch\'")\n')
+        self.write('w_src.py', '"""\n:unit_test_module: w_test\n:unit_test_class: WTests\n"""\n\n\n'
+                               'def foo():\n    """\n    :unit_test: foo\n    """\n')
+        self.write('w_test.py', 'from unittest import TestCase\n\n\nclass WTests(TestCase):\n    pass\n')
+        sys.path.insert(0, self.top_dir)  # Ahead of this repo's own setup.py
+
+    def tearDown(self):
+        super(RunWatchTests, self).tearDown()
+        for name in ['setup', 'w_src', 'w_test']:
+            sys.modules.pop(name, None)
+
+    def test_run_watch_default_targets(self):
+        """Verify the default walk of the anchor doesn't import setup.py"""
+        with mock.patch('tddtags.watch.TagWatcher.collect_changes', spec=True) as collect_changes:
+            collect_changes.side_effect = KeyboardInterrupt
+            self.assertEqual(cli.run_watch(['-a', self.top_dir, '--poll']), 0)
+        self.assertFalse(os.path.exists(os.path.join(self.top_dir, 'imported')))
+        with open(os.path.join(self.top_dir, 'w_test.py')) as f:
+            self.assertTrue('def test_foo(self):' in f.read())
+
+    # -- TDDTag: /RunWatchTests ---
+
+
+class RunScanOrphansTests(TempDirMixin, TestCase):
+    SOURCE_TEXT = '"""\n:unit_test_module: orph_test\n:unit_test_class: OrphTests\n"""\n\n\ndef foo():\n    """\n    :unit_test: foo\n    """\n'
+    TEST_TEXT = ('from unittest import TestCase\n\n\nclass OrphTests(TestCase):\n'
+                 '    def test_foo(self):\n        pass\n\n'
+                 '    def test_written(self):\n        self.assertTrue(True)\n\n'
+                 '%s'
+                 '    # -- TDDTag: /OrphTests ---\n')
+    STUB_TEXT = "    def test_stub(self):\n        self.fail('Test not implemented yet')\n\n"
+
+    def setUp(self):
+        super(RunScanOrphansTests, self).setUp()
+        self.write('orph_src.py', self.SOURCE_TEXT)
+        self.test_path = os.path.join(self.top_dir, 'orph_test.py')
+
+    def scan(self, argv, stub=''):
+        self.write(self.test_path, self.TEST_TEXT % stub)
+        return cli.run_scan(['-a', self.top_dir, '--static'] + argv + ['orph_src'])
+
+    def test_written_orphan_passes(self):
+        self.assertEqual(self.scan(['--orphans']), 0)
+
+    def test_stub_orphan_fails(self):
+        self.assertEqual(self.scan(['--orphans'], stub=self.STUB_TEXT), 1)
+        self.assertEqual(self.scan(['--remove-orphans'], stub=self.STUB_TEXT), 0)
+        with open(self.test_path) as f:
+            text = f.read()
+        self.assertFalse('test_stub' in text)
+        self.assertTrue('test_written' in text)
+
+    def test_remove_orphans_nosave(self):
+        with mock.patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                self.scan(['--remove-orphans', '--nosave'], stub=self.STUB_TEXT)
+        with open(self.test_path) as f:
+            self.assertTrue('test_stub' in f.read())
+
+    # -- TDDTag: /RunScanOrphansTests ---
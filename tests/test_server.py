@@ -0,0 +1,218 @@
+"""
+test_server.py
+----------------------------------
+
+Tests for the `tddtags.server` module.
+"""
+import os
+import sys
+import errno
+import socket
+import tempfile
+import threading
+from unittest import TestCase
+import mock
+
+from tddtags.core import TDDTagSession
+from tddtags.server import TagServer, UnixTagServer, TagClient, get_socket_path
+from tests.helpers import TempDirMixin
+
+SOURCE_TEXT = '''"""
+:unit_test_module: srv_test
+:unit_test_class: SrvTests
+"""
+
+
+def foo():
+    """
+    :unit_test: foo
+    :unit_test: bar
+    """
+'''
+
+TEST_TEXT = '''from unittest import TestCase
+
+
+class SrvTests(TestCase):
+    def test_bar(self):
+        pass
+
+    # -- TDDTag: /SrvTests ---
+'''
+
+
+class ServerDirMixin(TempDirMixin):
+    def setUp(self):
+        super(ServerDirMixin, self).setUp()
+        self.source_path = os.path.join(self.top_dir, 'srv_src.py')
+        self.test_path = os.path.join(self.top_dir, 'srv_test.py')
+        self.write(self.source_path, SOURCE_TEXT)
+        self.write(self.test_path, TEST_TEXT)
+        self.session = TDDTagSession(anchor_dir=self.top_dir)
+        self.tag_server = TagServer(session=self.session)
+
+    def tearDown(self):
+        super(ServerDirMixin, self).tearDown()
+        sys.modules.pop('srv_src', None)
+
+
+class TagServerTests(ServerDirMixin, TestCase):
+    def test_create_instance(self):
+        self.assertTrue(self.tag_server.session is self.session)
+        self.assertEqual(self.tag_server.compiled, {})
+        self.assertFalse(self.tag_server.stopped)
+
+    def test_find_source(self):
+        self.assertEqual(self.tag_server.find_source('srv_test'), self.test_path)
+        self.assertEqual(self.tag_server.sources, {'srv_test': self.test_path})
+        os.remove(self.test_path)
+        self.assertEqual(self.tag_server.find_source('srv_test'), None)
+        self.assertEqual(self.tag_server.sources, {})
+
+    def test_handle_request(self):
+        response = self.tag_server.handle_request({'command': 'ping'})
+        self.assertTrue(response['ok'])
+        self.assertEqual(response['anchor_dir'], self.top_dir)
+        self.assertTrue(response['seconds'] >= 0)
+
+    def test_handle_request_unknown(self):
+        self.assertEqual(self.tag_server.handle_request({'command': 'nope'}), {'ok': False, 'error': 'Unknown command: nope'})
+        self.assertFalse(self.tag_server.handle_request(['ping'])['ok'])
+
+    def test_handle_request_error(self):
+        response = self.tag_server.handle_request({'command': 'scan', 'targets': ['@' + os.path.join(self.top_dir, 'none.txt')]})
+        self.assertFalse(response['ok'])
+        self.assertTrue(response['error'].startswith('IOError'))
+
+        with mock.patch.object(self.tag_server, 'do_ping', side_effect=SystemExit('bye')):
+            self.assertEqual(self.tag_server.handle_request({'command': 'ping'}), {'ok': False, 'error': 'SystemExit: bye'})
+
+    def test_compile_targets(self):
+        module_names, failed, compiled_cnt = self.tag_server.compile_targets(['srv_src'])
+        self.assertEqual((module_names, failed, compiled_cnt), (['srv_src'], [], 1))
+        self.assertEqual(self.session.test_module_details['srv_test'].class_list['SrvTests'].method_names, ['foo', 'bar'])
+
+        # --> The second time the tags come from what the server kept
+        module_names, failed, compiled_cnt = self.tag_server.compile_targets(['srv_src'])
+        self.assertEqual(compiled_cnt, 0)
+        self.assertEqual(self.session.test_module_details['srv_test'].class_list['SrvTests'].method_names, ['foo', 'bar'])
+
+    def test_compile_targets_changed(self):
+        self.tag_server.compile_targets(['srv_src'])
+        self.write(self.source_path, SOURCE_TEXT.replace(':unit_test: bar', ':unit_test: baz'), mtime_offset=10)
+        module_names, failed, compiled_cnt = self.tag_server.compile_targets(['srv_src'])
+        self.assertEqual(compiled_cnt, 1)
+        self.assertEqual(self.session.test_module_details['srv_test'].class_list['SrvTests'].method_names, ['foo', 'baz'])
+
+    def test_compile_targets_static_only(self):
+        """Verify a scan of the whole anchor doesn't import setup.py"""
+        self.write(os.path.join(self.top_dir, 'setup.py'), 'import os\nopen(os.path.join(os.path.dirname(__file__), "imported"), "w").close()\n'
+                                                           'raise SystemExit("error: invalid command")\n')
+        sys.path.insert(0, self.top_dir)  # Ahead of this repo's own setup.py
+        try:
+            response = self.tag_server.handle_request({'command': 'scan'})
+        finally:
+            sys.path.remove(self.top_dir)
+        self.assertTrue(response['ok'], response)
+        self.assertEqual(response['tests']['srv_test'], {'SrvTests': ['foo', 'bar']})
+        self.assertFalse(os.path.exists(os.path.join(self.top_dir, 'imported')))
+
+    def test_get_container(self):
+        container = self.tag_server.get_container(self.test_path)
+        self.assertTrue(self.tag_server.get_container(self.test_path) is container)
+        self.write(self.test_path, TEST_TEXT + '\n', mtime_offset=10)
+        self.assertFalse(self.tag_server.get_container(self.test_path) is container)
+
+    def test_do_scan(self):
+        response = self.tag_server.handle_request({'command': 'scan', 'targets': ['srv_src']})
+        self.assertTrue(response['ok'])
+        self.assertEqual(response['modules'], 1)
+        self.assertEqual(response['tests']['srv_test'], {'SrvTests': ['foo', 'bar']})
+
+    def test_do_check(self):
+        response = self.tag_server.handle_request({'command': 'check', 'targets': ['srv_src']})
+        self.assertTrue(response['ok'])
+        self.assertEqual(response['missing'], {'srv_test': {'SrvTests': ['test_foo']}})
+
+    def test_do_update(self):
+        response = self.tag_server.handle_request({'command': 'update', 'targets': ['srv_src']})
+        self.assertTrue(response['ok'])
+        self.assertEqual(response['saved'], [self.test_path])
+        with open(self.test_path) as f:
+            self.assertTrue('def test_foo(self):' in f.read())
+        self.assertEqual(self.tag_server.handle_request({'command': 'check', 'targets': ['srv_src']})['missing'], {})
+        self.assertFalse(self.session.event_hooks)
+
+    # -- TDDTag: /TagServerTests ---
+
+
+class UnixTagServerTests(ServerDirMixin, TestCase):
+    def setUp(self):
+        super(UnixTagServerTests, self).setUp()
+        self.socket_path = get_socket_path(self.top_dir)
+
+    def start_server(self):
+        server = UnixTagServer(socket_path=self.socket_path, tag_server=self.tag_server)
+        thread = threading.Thread(target=server.run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def test_create_instance(self):
+        server = UnixTagServer(socket_path=self.socket_path, tag_server=self.tag_server)
+        try:
+            self.assertTrue(os.path.exists(self.socket_path))
+            self.assertEqual(os.stat(self.socket_path).st_mode & 0o077, 0)
+        finally:
+            server.server_close()
+
+    def test_create_instance_in_use(self):
+        thread = self.start_server()
+        try:
+            with self.assertRaises(socket.error) as context:
+                UnixTagServer(socket_path=self.socket_path, tag_server=TagServer(session=self.session))
+            self.assertEqual(context.exception.errno, errno.EADDRINUSE)
+        finally:
+            TagClient(self.socket_path).request('shutdown')
+            thread.join(5)
+
+    def test_create_instance_stale_socket(self):
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.socket_path)
+        stale.close()
+        server = UnixTagServer(socket_path=self.socket_path, tag_server=self.tag_server)
+        server.server_close()
+
+    def test_run(self):
+        thread = self.start_server()
+        client = TagClient(self.socket_path, timeout=5)
+        self.assertTrue(client.request('ping')['ok'])
+        response = client.request('check', targets=['srv_src'])
+        self.assertEqual(response['missing'], {'srv_test': {'SrvTests': ['test_foo']}})
+        self.assertTrue(client.request('shutdown')['ok'])
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    # -- TDDTag: /UnixTagServerTests ---
+
+
+class TagClientTests(TestCase):
+    def test_create_instance(self):
+        client = TagClient('/tmp/x.sock', timeout=2)
+        self.assertEqual((client.socket_path, client.timeout), ('/tmp/x.sock', 2))
+
+    def test_request(self):
+        """Verify a missing server is reported as a socket.error"""
+        with self.assertRaises(socket.error):
+            TagClient(os.path.join(tempfile.gettempdir(), 'no-such-tddtags.sock')).request('ping')
+
+    # -- TDDTag: /TagClientTests ---
+
+
+class ServerGlobalTests(TestCase):
+    def test_get_socket_path(self):
+        self.assertEqual(get_socket_path('/a/b'), '/a/b/.tddtags.sock')
+        self.assertEqual(get_socket_path('/a/b', 'x.sock'), os.path.abspath('x.sock'))
+
+    # -- TDDTag: /ServerGlobalTests ---
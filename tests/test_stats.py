@@ -0,0 +1,181 @@
+"""
+test_stats.py
+----------------------------------
+
+Tests for the `tddtags.stats` module.
+"""
+import os
+import json
+import pstats
+import shutil
+import tempfile
+from unittest import TestCase
+
+import mock
+
+import tddtags.core
+import tddtags.stats
+from tddtags.core import CompileTags, TDDTagSession, memory_checkpoint
+from tddtags.stats import RunStats, MemoryProfiler, retained_size
+
+
+class RunStatsTests(TestCase):
+    def setUp(self):
+        self.stats = RunStats()
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_create_instance(self):
+        self.assertFalse(self.stats.profile)
+        self.assertEqual(set(self.stats.wall), set(RunStats.PHASES))
+        self.assertEqual(set(self.stats.counters), set(RunStats.COUNTERS))
+        self.assertFalse(any(self.stats.counters.values()))
+
+    def test_reset(self):
+        with self.stats.phase('load'):
+            self.stats.count('tags_found', 3)
+        self.stats.reset()
+        self.assertEqual(self.stats.counters['tags_found'], 0)
+        self.assertEqual(self.stats.wall['load'], 0.0)
+
+    def test_phase(self):
+        with self.stats.phase('compile'):
+            sum(xrange(100000))
+        self.assertTrue(self.stats.wall['compile'] > 0)
+        self.assertFalse(self.stats.stack)
+
+    def test_phase_nested(self):
+        with self.stats.phase('compile'):
+            with self.stats.phase('load'):
+                sum(xrange(100000))
+        self.assertTrue(self.stats.wall['load'] > 0)
+
+        # --> The inner phase isn't charged to the outer one as well
+        total = self.stats.to_dict()['total']['wall']
+        self.assertAlmostEqual(total, self.stats.wall['compile'] + self.stats.wall['load'])
+        self.assertTrue(self.stats.wall['compile'] < total)
+
+    def test_count(self):
+        self.stats.count('tags_found')
+        self.stats.count('tags_found', 4)
+        self.stats.count('something_new')
+        self.assertEqual(self.stats.counters['tags_found'], 5)
+        self.assertEqual(self.stats.counters['something_new'], 1)
+
+    def test_merge_counters(self):
+        self.stats.count('objects_visited', 2)
+        self.stats.merge_counters({'objects_visited': 3, 'tags_found': 1})
+        self.assertEqual(self.stats.counters['objects_visited'], 5)
+        self.assertEqual(self.stats.counters['tags_found'], 1)
+
+    def test_to_dict(self):
+        self.stats.count('bytes_written', 10)
+        result = self.stats.to_dict()
+        self.assertEqual(set(result['phases']), set(RunStats.PHASES))
+        self.assertEqual(result['counters']['bytes_written'], 10)
+        self.assertEqual(set(result['total']), set(['wall', 'cpu']))
+
+    def test_format_report(self):
+        lines = self.stats.format_report()
+        self.assertEqual(len(lines), 1 + len(RunStats.PHASES) + 2 + len(RunStats.COUNTERS))
+        self.assertTrue(lines[-1].startswith('bytes_written'))
+
+    def test_save_json(self):
+        path = os.path.join(self.tmp_dir, 'stats.json')
+        self.stats.count('tags_found', 2)
+        self.stats.save_json(path)
+        with open(path) as json_file:
+            self.assertEqual(json.load(json_file)['counters']['tags_found'], 2)
+
+    def test_dump_profiles(self):
+        self.stats.profile = True
+        with self.stats.phase('compile'):
+            with self.stats.phase('load'):
+                sum(xrange(1000))
+        paths = self.stats.dump_profiles(os.path.join(self.tmp_dir, 'prof'))
+        self.assertEqual([os.path.basename(path) for path in paths], ['prof.compile', 'prof.load'])
+        self.assertTrue(pstats.Stats(paths[0]))
+
+    def test_core_counters(self):
+        """Verify the compiler counts the docstrings it scans and the tags it finds in its session's stats"""
+        session = TDDTagSession(anchor_dir=os.getcwd())
+        tddtags.core._run_stats.reset()
+        self.assertTrue(CompileTags(source_module_name='tddtags.sample', session=session).compile())
+        counters = session.run_stats.counters
+        self.assertTrue(counters['docstrings_scanned'] > 0)
+        self.assertTrue(counters['tags_found'] >= len(session.test_module_details))
+        self.assertTrue(counters['objects_visited'] >= counters['docstrings_scanned'])
+        self.assertEqual(tddtags.core._run_stats.counters['tags_found'], 0)
+
+    # -- TDDTag: /RunStatsTests ---
+
+
+class MemoryProfilerTests(TestCase):
+    def setUp(self):
+        self.profiler = MemoryProfiler(top=3)
+
+    def tearDown(self):
+        self.profiler.stop()
+
+    def test_create_instance(self):
+        self.assertEqual(self.profiler.top, 3)
+        self.assertEqual(self.profiler.checkpoints, [])
+
+    def test_start(self):
+        self.profiler.start()
+        self.assertEqual(self.profiler.is_tracing(), bool(tddtags.stats.tracemalloc))
+
+    def test_checkpoint(self):
+        self.profiler.start()
+        checkpoint = self.profiler.checkpoint('compile', model=100)
+        self.assertEqual(checkpoint['label'], 'compile')
+        self.assertEqual(checkpoint['retained'], {'model': 100})
+        self.assertTrue(checkpoint['peak'] > 0)
+        self.assertTrue(len(checkpoint['top']) <= 3)
+        self.assertEqual(self.profiler.checkpoints, [checkpoint])
+
+    def test_checkpoint_without_tracemalloc(self):
+        with mock.patch('tddtags.stats.tracemalloc', None):
+            self.profiler.start()
+            checkpoint = self.profiler.checkpoint('save')
+        self.assertEqual(checkpoint['current'], None)
+        self.assertEqual(checkpoint['top'], [])
+        self.assertEqual(checkpoint['peak'], MemoryProfiler.get_peak_rss())
+
+    def test_to_dict(self):
+        self.profiler.checkpoint('compile')
+        result = self.profiler.to_dict()
+        self.assertEqual(result['tracemalloc'], bool(tddtags.stats.tracemalloc))
+        self.assertEqual(len(result['checkpoints']), 1)
+
+    def test_format_report(self):
+        self.profiler.checkpoint('update tests.test_foo', lines=2048)
+        lines = self.profiler.format_report()
+        self.assertTrue(lines[1].startswith('update tests.test_foo'))
+        self.assertTrue('lines 2.0' in lines[1])
+
+    # -- TDDTag: /MemoryProfilerTests ---
+
+
+class StatsGlobalTests(TestCase):
+    def test_retained_size(self):
+        shared = 'x' * 1000
+        self.assertTrue(retained_size([shared]) > 1000)
+
+        # --> Shared objects are counted once
+        self.assertEqual(retained_size([shared, shared]) - retained_size([shared]), retained_size([None, None]) - retained_size([None]))
+
+        class Holder(object):
+            def __init__(self):
+                self.lines = [shared]
+        self.assertTrue(retained_size(Holder()) > 1000)
+
+    def test_memory_checkpoint(self):
+        self.assertEqual(memory_checkpoint('compile', model={}), None)
+        with mock.patch('tddtags.core._memory_profiler', MemoryProfiler()):
+            checkpoint = memory_checkpoint('compile', model=['x' * 1000])
+            self.assertTrue(checkpoint['retained']['model'] > 1000)
+
+    # -- TDDTag: /StatsGlobalTests ---
@@ -8,7 +8,10 @@ test_tddtags.py
 Tests for `tddtags` module.
 """
 import os
+import sys
+import __builtin__
 import shutil
+import tempfile
 import unittest
 from unittest import TestCase
 import mock
@@ -17,10 +20,50 @@ import inspect
 
 import tddtags.core
 from tddtags.core import CompileTags, UTClassDetails, UTModuleDetails, _test_module_details, UTModuleContainer, \
-    create_end_class_token, create_module_loader, ModuleUpdater, ModuleLoader, Formatter
+    create_end_class_token, create_module_loader, ModuleUpdater, ModuleLoader, Formatter, SourceContext, \
+    expand_targets, read_target_list, add_tag_record, TagCache, ClassSpan, ImportCost, TDDTagSession, FrozenConfig, \
+    get_session, TagChecker, OrphanFinder, get_stub_lines
 
 skip_not_impl = True
 
+ORPHAN_TEXT = '''from unittest import TestCase
+
+
+class KeptTests(TestCase):
+    """
+    Generated by TDDTag
+    """
+    def setUp(self):
+        super(KeptTests, self).setUp()
+
+    def test_tagged(self):
+        self.fail('Test not implemented yet')
+
+    def test_renamed(self):
+        self.fail('Test not implemented yet')
+
+    def test_written(self):
+        # Written by hand
+        self.assertTrue(True)
+
+    # -- TDDTag: /KeptTests ---
+
+    def test_after_token(self):
+        self.fail('Test not implemented yet')
+
+
+class DroppedTests(TestCase):
+    def test_old(self):
+        self.fail('Test not implemented yet')
+
+    # -- TDDTag: /DroppedTests ---
+
+
+class HandWrittenTests(TestCase):
+    def test_manual(self):
+        self.fail('Test not implemented yet')
+'''
+
 
 class MockHelperMixin(object):
     def setUp(self):
@@ -70,7 +113,7 @@ class CompileTagsTests(unittest.TestCase):
     :unit_test_module: some_module
     :unit_test_class: SomeClass
     :unit_test: a_feature
-    :unit_test: another_feature
+    :unit_test: another_feature Verify the description is kept
     :unit_test:
     """
 
@@ -144,15 +187,36 @@ class CompileTagsTests(unittest.TestCase):
         self.assertEqual(len(keywords), 5, keywords)
 
         kw = [
-            ('unit_test_module', 'some_module'),
-            ('unit_test_class', 'SomeClass'),
-            ('unit_test', 'a_feature'),
-            ('unit_test', 'another_feature'),
-            ('unit_test', '')
+            ('unit_test_module', 'some_module', ''),
+            ('unit_test_class', 'SomeClass', ''),
+            ('unit_test', 'a_feature', ''),
+            ('unit_test', 'another_feature', 'Verify the description is kept'),
+            ('unit_test', '', '')
         ]
 
         self.assertEqual(keywords, kw)
 
+    def test_extract_keywords_no_tags(self):
+        self.assertEqual(CompileTags.extract_keywords(docstrings='Nothing here\n:param x: Or here\n'), [])
+        self.assertEqual(CompileTags.extract_keywords(docstrings=':unit_testing is not a tag'), [])
+
+    def test_extract_keywords_memo(self):
+        docstrings = 'Shared\r\n:unit_test: shared_feature Some text \r\n'
+        keywords = CompileTags.extract_keywords(docstrings=docstrings)
+        self.assertEqual(keywords, [('unit_test', 'shared_feature', 'Some text')])
+        self.assertTrue(docstrings in get_session().keyword_memo)
+
+        # --> The caller gets its own list, so changing it doesn't change the memo
+        keywords.append(('unit_test', 'extra', ''))
+        self.assertEqual(len(CompileTags.extract_keywords(docstrings=docstrings)), 1)
+
+        # --> Each session remembers its own
+        session = TDDTagSession()
+        docstrings = ':unit_test: session_feature\n'
+        CompileTags.extract_keywords(docstrings=docstrings, memo=session.keyword_memo)
+        self.assertEqual(session.keyword_memo.keys(), [docstrings])
+        self.assertFalse(docstrings in get_session().keyword_memo)
+
     def test_push_modules_and_classes(self):
         modules = ['sample', 'a_name']
         test_classes = ['sampleTests', 'a_class_name']
@@ -258,6 +322,31 @@ class CompileTagsTests(unittest.TestCase):
         self.assertEqual(CompileTags.get_default_test_name(self.__class__), 'CompileTagsTestsTests')
         # This name will be a little silly since there is already "Tests" in the name...
 
+    def test_get_context_line(self):
+        import tddtags.sample
+        self.assertEqual(CompileTags.get_context_line(tddtags.sample), 1)
+        self.assertEqual(CompileTags.get_context_line(tddtags.sample.Sample), 33)
+        self.assertEqual(CompileTags.get_context_line(tddtags.sample.outside_function), 22)
+        self.assertEqual(CompileTags.get_context_line(tddtags.sample.Sample.drink_beer),
+                         tddtags.sample.Sample.drink_beer.__func__.__code__.co_firstlineno)
+        self.assertEqual(CompileTags.get_context_line(SourceContext('foo', None, SourceContext.KIND_FUNCTION, line=7)), 7)
+        self.assertEqual(CompileTags.get_context_line(None), None)
+
+    def test_tag_symbols(self):
+        """Verify each tag record has the qualified symbol and line it was found on, the same either way it's compiled"""
+        compiled = []
+        for compile_mode in [CompileTags.MODE_IMPORT, CompileTags.MODE_STATIC]:
+            gen = CompileTags(source_module_name='tddtags.sample', session=TDDTagSession(config={'compile_mode': compile_mode}))
+            self.assertTrue(gen.compile())
+            self.assertEqual(len(gen.tag_symbols), len(gen.tag_records))
+            compiled.append(set(zip(gen.tag_records, gen.tag_symbols)))
+        self.assertEqual(compiled[0], compiled[1])
+
+        symbols = dict((record[2], symbol) for record, symbol in compiled[0])
+        self.assertEqual(symbols['verify_sample'], ('tddtags.sample', 1))
+        self.assertEqual(symbols['outside_function'], ('tddtags.sample.outside_function', 22))
+        self.assertEqual(symbols['drink_beer_exception'][0], 'tddtags.sample.Sample.drink_beer')
+
     def test_get_default_test_name_no_context(self):
         """Verify that get_default_test_name raises if context is blank or invalid"""
         self.assertEqual(CompileTags.get_default_test_name(self.__class__), 'CompileTagsTestsTests')
@@ -288,6 +377,7 @@ class CompileTagsTests(unittest.TestCase):
         ut_module = _test_module_details['sample']
         ut_class = ut_module.class_list['sampleTests']
         self.assertTrue('some_test' in ut_class.method_names)
+        self.assertEqual(gen.tag_records, [('sample', 'sampleTests', 'some_test')])
 
     def test_process_ut_method_blank_name(self):
         gen = CompileTags(source_module_name='sample.py')
@@ -305,9 +395,145 @@ class CompileTagsTests(unittest.TestCase):
         gen = CompileTags(source_module_name='sample.py')
         self.assertRaises(AttributeError, gen.process_unit_test, test_name='', context=None)
 
+    def compiled_model(self, source_module_name):
+        _test_module_details.clear()
+        gen = CompileTags(source_module_name=source_module_name)
+        self.assertTrue(gen.compile())
+        return dict((key, dict((name, ut_class.method_names) for name, ut_class in ut_module.class_list.items()))
+                    for key, ut_module in _test_module_details.items())
+
+    def test_compile_static(self):
+        """Verify the static compile finds the same tags as the import compile"""
+        imported = self.compiled_model('tddtags.sample')
+        with mock.patch.dict(tddtags.core.tddtags_config, {'compile_mode': CompileTags.MODE_STATIC}):
+            with mock.patch('tddtags.core.ModuleLoader.load_module', spec=True):
+                parsed = self.compiled_model('tddtags.sample')
+                self.assertEqual(tddtags.core.ModuleLoader.load_module.call_count, 0)
+        self.assertEqual(parsed, imported)
+
+    def test_compile_static_unknown_module(self):
+        gen = CompileTags(source_module_name='tddtags.invalid')
+        self.assertEqual(gen.compile_static(), None)
+
+    def test_compile_static_syntax_error(self):
+        path = 'tests/tmp_syntax_error.py'
+        with open(path, 'w') as f:
+            f.write('def foo(:\n')
+        try:
+            gen = CompileTags(source_module_name='tests.tmp_syntax_error', session=TDDTagSession())
+            self.assertTrue(gen.compile_static() is False)
+        finally:
+            os.remove(path)
+
+    def test_compile_source(self):
+        """Verify the tags come from the source text given, not the file on disk"""
+        session = TDDTagSession()
+        source = '"""\n:unit_test_module: test_staged\n:unit_test_class: StagedTests\n"""\n\n\ndef foo():\n    """\n    :unit_test: foo_staged\n    """\n'
+        gen = CompileTags(source_module_name='tddtags.sample', session=session)
+        with mock.patch('tddtags.core.ModuleLoader.load_module', spec=True) as load_module:
+            self.assertTrue(gen.compile_source(source_path='tddtags/sample.py', source=source))
+            self.assertEqual(load_module.call_count, 0)
+        self.assertEqual(session.test_module_details.keys(), ['test_staged'])
+        self.assertEqual(session.test_module_details['test_staged'].class_list['StagedTests'].method_names, ['foo_staged'])
+
+    def test_compile_source_runtime_docstring(self):
+        session = TDDTagSession()
+        gen = CompileTags(source_module_name='tddtags.sample', session=session)
+        self.assertFalse(gen.compile_source(source_path='tddtags/sample.py', source='def foo():\n    pass\nfoo.__doc__ = "x"\n'))
+        self.assertEqual(session.test_module_details, {})
+
+    def test_compile_static_mode(self):
+        """Verify compile() falls back to the import when the static compile can't be used"""
+        with mock.patch.dict(tddtags.core.tddtags_config, {'compile_mode': CompileTags.MODE_STATIC}):
+            with mock.patch('tddtags.core.CompileTags.compile_static', spec=True) as compile_static:
+                compile_static.return_value = None
+                gen = CompileTags(source_module_name='tddtags.sample')
+                self.assertTrue(gen.compile())
+                self.assertEqual(compile_static.call_count, 1)
+
+    def test_compile_static_mode_syntax_error(self):
+        """Verify a module that doesn't parse fails to compile, without being imported"""
+        path = 'tests/tmp_syntax_error.py'
+        with open(path, 'w') as f:
+            f.write('def foo(:\n')
+        try:
+            session = TDDTagSession(config={'compile_mode': CompileTags.MODE_STATIC})
+            with mock.patch('tddtags.core.ModuleLoader.load_module', spec=True) as load_module:
+                self.assertFalse(CompileTags(source_module_name='tests.tmp_syntax_error', session=session).compile())
+                self.assertEqual(load_module.call_count, 0)
+        finally:
+            os.remove(path)
+
+    def test_compile_static_only_mode(self):
+        """Verify a module that would need to be imported fails to compile instead"""
+        session = TDDTagSession(config={'compile_mode': CompileTags.MODE_STATIC_ONLY})
+        with mock.patch('tddtags.core.ModuleLoader.load_module', spec=True) as load_module:
+            with mock.patch('tddtags.core.CompileTags.compile_static', spec=True) as compile_static:
+                compile_static.return_value = None
+                self.assertFalse(CompileTags(source_module_name='tddtags.sample', session=session).compile())
+            self.assertTrue(CompileTags(source_module_name='tddtags.sample', session=session).compile())
+            self.assertEqual(load_module.call_count, 0)
+        self.assertTrue('test_sample' in session.test_module_details)
+
+    def test_parse_source(self):
+        module = CompileTags.parse_source(source_path='tddtags/sample.py', module_name='tddtags.sample')
+        self.assertEqual(module.__name__, 'tddtags.sample')
+        self.assertTrue(':unit_test: verify_sample' in module.__doc__)
+        self.assertEqual([name for name, child in module.children], ['ChildSample', 'Sample', 'outside_function'])
+
+        sample = dict(module.children)['Sample']
+        self.assertEqual(sample.kind, SourceContext.KIND_CLASS)
+        self.assertEqual([name for name, child in sample.children], ['drink_beer', 'foo2'])
+        self.assertEqual((module.line, sample.line), (1, 33))
+        self.assertEqual((module.end_line, sample.end_line), (len(open('tddtags/sample.py').readlines()), 58))
+        self.assertEqual([child.end_line for name, child in sample.children], [54, 58])
+
+    def test_parse_source_text(self):
+        module = CompileTags.parse_source(source_path='unsaved.py', module_name='unsaved',
+                                          source='"""\n:unit_test: top\n"""\n\n\ndef foo():\n    """:unit_test:"""\n')
+        self.assertEqual(module.__name__, 'unsaved')
+        self.assertEqual([(name, child.line) for name, child in module.children], [('foo', 6)])
+
+    def test_parse_source_runtime_docstring(self):
+        path = 'tests/tmp_runtime_doc.py'
+        with open(path, 'w') as f:
+            f.write('def foo():\n    """:unit_test: %s"""\n\nfoo.__doc__ = foo.__doc__ % "bar"\n')
+        try:
+            self.assertFalse(CompileTags.parse_source(source_path=path, module_name='tests.tmp_runtime_doc'))
+
+            # --> Whether it says so is up to the session, not the global config
+            session = TDDTagSession(config={'verbose': True})
+            with mock.patch('sys.stdout', new_callable=StringIO.StringIO) as stdout:
+                CompileTags.parse_source(source_path=path, module_name='tests.tmp_runtime_doc', session=session)
+            self.assertTrue('Docstrings are built at runtime' in stdout.getvalue())
+        finally:
+            os.remove(path)
+
+    def test_parse_source_syntax_error(self):
+        path = 'tests/tmp_syntax_error.py'
+        with open(path, 'w') as f:
+            f.write('def foo(:\n')
+        try:
+            self.assertFalse(CompileTags.parse_source(source_path=path, module_name='tests.tmp_syntax_error'))
+            with self.assertRaises(SyntaxError):
+                CompileTags.parse_source(source_path=path, module_name='tests.tmp_syntax_error', strict=True)
+        finally:
+            os.remove(path)
+
     # --TDDTag: /CompileTagsTests ---
 
 
+class SourceContextTests(unittest.TestCase):
+    def test_create_instance(self):
+        context = SourceContext(name='Sample', doc=':unit_test:', kind=SourceContext.KIND_CLASS)
+        self.assertEqual(context.__name__, 'Sample')
+        self.assertEqual(context.__doc__, ':unit_test:')
+        self.assertEqual(CompileTags.get_default_test_name(context), 'SampleTests')
+        self.assertFalse(context.children)
+
+    # --TDDTag: /SourceContextTests ---
+
+
 class UTClassDetailsTests(unittest.TestCase):
     def test_create_instance(self):
         details = UTClassDetails(class_name='SomeClass', base_class='ABC')
@@ -362,6 +588,12 @@ class ModuleContainerTests(unittest.TestCase):
         self.assertEqual(self.container.module_path, os.path.abspath(self.path))
         self.assertTrue(self.container.lines)
 
+    def test_create_instance_lines(self):
+        lines = ['class SomeTests(TestCase):\n', '    def test_foo(self):\n', '        pass\n']
+        container = UTModuleContainer(module_path=self.path, lines=lines)
+        self.assertEqual(container.lines, lines)
+        self.assertEqual(container.class_spans.keys(), ['SomeTests'])
+
     def test_create_invalid_path(self):
         """Verify UTModuleContainer raises IOError on invalid path"""
         bad_path = self.path + 'xx'
@@ -457,6 +689,44 @@ class ModuleContainerTests(unittest.TestCase):
         import os
         self.assertFalse(os.path.exists('nothin.py'))
 
+    def test_save_unchanged(self):
+        with open('output5.py', 'w') as f:
+            f.writelines(self.container.lines)
+        os.utime('output5.py', (1000000000, 1000000000))
+
+        # --> Dirty, but the text is the same as the file's
+        self.container.dirty_flag = True
+        self.assertTrue(self.container.save_module('output5.py'))
+        self.assertFalse(self.container.dirty_flag)
+        self.assertEqual(os.stat('output5.py').st_mtime, 1000000000)
+
+        self.container.add_class_method(class_name='sampleTests', method_name='new_method')
+        self.assertTrue(self.container.save_module('output5.py'))
+        self.assertNotEqual(os.stat('output5.py').st_mtime, 1000000000)
+        with open('output5.py') as f:
+            self.assertTrue('def test_new_method' in f.read())
+
+    def test_save_keeps_mode(self):
+        with open('output6.py', 'w') as f:
+            f.write('')
+        os.chmod('output6.py', 0640)
+        self.container.dirty_flag = True
+        self.assertTrue(self.container.save_module('output6.py'))
+        self.assertEqual(os.stat('output6.py').st_mode & 0777, 0640)
+
+    def test_write_file_atomic(self):
+        UTModuleContainer.write_file_atomic(file_name='output7.py', text='x = 1\n')
+        with open('output7.py') as f:
+            self.assertEqual(f.read(), 'x = 1\n')
+        self.assertFalse([name for name in os.listdir('.') if name.endswith('.tmp')])
+
+    def test_write_file_atomic_fails(self):
+        with mock.patch('os.rename', side_effect=OSError('rename failed')):
+            with self.assertRaises(OSError):
+                UTModuleContainer.write_file_atomic(file_name='output8.py', text='x = 1\n')
+        self.assertFalse(os.path.exists('output8.py'))
+        self.assertFalse([name for name in os.listdir('.') if name.endswith('.tmp')])
+
     def test_with_pyc(self):
         anchor_dir = os.getcwd()
         loader = ModuleLoader(anchor_dir=anchor_dir)
@@ -467,9 +737,150 @@ class ModuleContainerTests(unittest.TestCase):
         container = UTModuleContainer(module_path=mod.__file__)
         self.assertNotEqual(container.module_path, mod.__file__)
 
+    def test_read_test_names(self):
+        """Verify the names read match what the full index finds"""
+        names = UTModuleContainer.read_test_names(self.path)
+        self.assertEqual(names, dict((name, span.method_names) for name, span in self.container.class_spans.items()))
+        self.assertTrue('test_verify_sample' in names['sampleTests'])
+
+    def test_index_lines(self):
+        span = self.container.class_spans['ChildSampleTests']
+        self.assertTrue(self.container.lines[span.def_line].startswith('class ChildSampleTests('))
+        self.assertTrue('def test_eat_more_chocolate' in self.container.lines[span.last_method_line])
+        self.assertEqual(span.end_token_line, -1)  # The sample only has the old DocTag tokens
+        self.assertEqual(len(self.container.class_def_lines), 5)
+
+        # --> Verify the index follows the edits
+        self.container.add_class_method(class_name='ClassNoEndTag', method_name='new_method')
+        self.container.add_class_method(class_name='sampleTests', method_name='new_method')
+        lines = self.container.lines
+        for name, span in self.container.class_spans.items():
+            self.assertTrue(lines[span.def_line].startswith('class %s(' % name))
+            if span.end_token_line != -1:
+                self.assertTrue(create_end_class_token(name) in lines[span.end_token_line])
+        span = self.container.class_spans['ClassNoEndTag']
+        self.assertTrue('def test_new_method' in lines[span.last_method_line])
+
+    def test_hook_events(self):
+        from tddtags import hooks
+        events = []
+        tddtags.core._event_hooks.add(hooks.TEST_METHOD_INSERTED, lambda event, **details: events.append((event, details)))
+        tddtags.core._event_hooks.add(hooks.TEST_CLASS_CREATED, lambda event, **details: events.append((event, details)))
+        tddtags.core._event_hooks.add(hooks.MODULE_SAVED, lambda event, **details: events.append((event, details)))
+        try:
+            self.container.add_class_method(class_name='sampleTests', method_name='new_method')
+            ut_class = UTClassDetails(class_name='NewClassTests')
+            ut_class.add_method('feature')
+            self.container.append_class(ut_class=ut_class)
+            self.container.save_module('output8.py')
+        finally:
+            tddtags.core._event_hooks.clear()
+
+        self.assertEqual([event for event, details in events],
+                         [hooks.TEST_METHOD_INSERTED, hooks.TEST_CLASS_CREATED, hooks.MODULE_SAVED])
+        self.assertEqual(events[0][1]['method_name'], 'new_method')
+        self.assertEqual(events[1][1]['methods'], 1)
+        self.assertTrue(events[2][1]['changed'])
+        self.assertEqual(events[2][1]['size'], os.path.getsize('output8.py'))
+
+    def test_apply_pending(self):
+        original = list(self.container.lines)
+        for method_name in ['first', 'second', 'third']:
+            self.container.add_class_method(class_name='ClassNoEndTag', method_name=method_name)
+        self.container.add_class_method(class_name='sampleTests', method_name='fourth')
+
+        # --> Nothing is spliced in until the lines are asked for
+        self.assertTrue(self.container.pending)
+        self.assertEqual(self.container._lines, original)
+
+        class_line, end_line = self.container._find_class_end('ClassNoEndTag')
+        lines = self.container.lines
+        self.assertFalse(self.container.pending)
+        self.assertTrue(create_end_class_token('ClassNoEndTag') in lines[end_line])
+
+        # --> The methods land in the order they were added, just ahead of the end token
+        text = ''.join(lines[class_line:end_line])
+        self.assertTrue(text.index('test_first') < text.index('test_second') < text.index('test_third'))
+        self.assertFalse('test_fourth' in text)
+        self.assertEqual(len(lines), len(original) + 4 * 3 + 2 * 2)
+
+    def test_index_lines_appended(self):
+        ut_class = UTClassDetails(class_name='SomeClass', base_class='TestCase')
+        ut_class.method_names = ['first_feature']
+        self.container.append_class(ut_class=ut_class)
+
+        span = self.container.class_spans['SomeClass']
+        self.assertTrue(self.container.lines[span.def_line].startswith('class SomeClass('))
+        self.assertTrue('def test_first_feature' in self.container.lines[span.last_method_line])
+        self.assertTrue(create_end_class_token('SomeClass') in self.container.lines[span.end_token_line])
+
+        # --> Another class's token that starts with the same name isn't ours
+        ut_class = UTClassDetails(class_name='Some', base_class='TestCase')
+        self.container.append_class(ut_class=ut_class)
+        self.assertTrue(self.container.class_spans['Some'].end_token_line > span.end_token_line)
+
+    def test_get_generated_methods(self):
+        container = UTModuleContainer(module_path=self.path, lines=ORPHAN_TEXT.splitlines(True))
+        self.assertEqual(container.get_generated_methods('KeptTests'), ['test_renamed', 'test_tagged', 'test_written'])
+        self.assertEqual(container.get_generated_methods('DroppedTests'), ['test_old'])
+        self.assertEqual(container.get_generated_methods('HandWrittenTests'), [])
+        self.assertEqual(container.get_generated_methods('NoSuchTests'), [])
+
+    def test_is_stub_method(self):
+        container = UTModuleContainer(module_path=self.path, lines=ORPHAN_TEXT.splitlines(True))
+        self.assertTrue(container.is_stub_method('KeptTests', 'test_renamed'))
+        self.assertTrue(container.is_stub_method('HandWrittenTests', 'test_manual'))
+        self.assertFalse(container.is_stub_method('KeptTests', 'test_written'))
+        self.assertFalse(container.is_stub_method('KeptTests', 'setUp'))
+        self.assertFalse(container.is_stub_method('KeptTests', 'test_nope'))
+
+    def test_remove_class_method(self):
+        container = UTModuleContainer(module_path=self.path, lines=ORPHAN_TEXT.splitlines(True))
+        self.assertTrue(container.remove_class_method('KeptTests', 'test_renamed'))
+        self.assertTrue(container.dirty_flag)
+        text = ''.join(container.lines)
+        self.assertEqual(text, ORPHAN_TEXT.replace("\n\n    def test_renamed(self):\n        self.fail('Test not implemented yet')", ''))
+        self.assertEqual(container.class_spans['KeptTests'].method_names, set(['setUp', 'test_tagged', 'test_written',
+                                                                                'test_after_token']))
+        self.assertFalse(container.remove_class_method('KeptTests', 'test_renamed'))
+
+        # --> The last method of a class leaves a pass behind
+        self.assertTrue(container.remove_class_method('DroppedTests', 'test_old'))
+        self.assertTrue('class DroppedTests(TestCase):\n    pass\n\n    # -- TDDTag: /DroppedTests ---\n' in ''.join(container.lines))
+        compile(''.join(container.lines), 'orphans', 'exec')
+
+    def test_remove_class_methods(self):
+        container = UTModuleContainer(module_path=self.path, lines=ORPHAN_TEXT.splitlines(True))
+        removed = container.remove_class_methods([('HandWrittenTests', 'test_manual'), ('KeptTests', 'test_renamed'),
+                                                  ('DroppedTests', 'test_old'), ('KeptTests', 'test_tagged'),
+                                                  ('KeptTests', 'test_nope'), ('NoSuchTests', 'test_old')])
+        self.assertEqual(removed, [('KeptTests', 'test_tagged'), ('KeptTests', 'test_renamed'), ('DroppedTests', 'test_old'),
+                                   ('HandWrittenTests', 'test_manual')])
+        text = ''.join(container.lines)
+        self.assertFalse('test_tagged' in text or 'test_renamed' in text or 'test_old' in text or 'test_manual' in text)
+        self.assertTrue('class DroppedTests(TestCase):\n    pass\n\n    # -- TDDTag: /DroppedTests ---\n' in text)
+        self.assertTrue(text.endswith('class HandWrittenTests(TestCase):\n    pass\n'))
+        self.assertEqual(text.count('    pass\n'), 2)
+        self.assertEqual(container.class_spans['KeptTests'].method_names, set(['setUp', 'test_written', 'test_after_token']))
+        compile(text, 'orphans', 'exec')
+        self.assertEqual(container.remove_class_methods([('KeptTests', 'test_tagged')]), [])
+
     # --TDDTag: /ModuleContainerTests ---
 
 
+class ClassSpanTests(TestCase):
+    def test_create_instance(self):
+        span = ClassSpan(class_name='SomeTests', def_line=10)
+        self.assertEqual(span.class_name, 'SomeTests')
+        self.assertEqual(span.def_line, 10)
+        self.assertEqual(span.end_token_line, -1)
+        self.assertFalse(span.end_token_pending)
+        self.assertEqual(span.last_method_line, -1)
+        self.assertEqual(span.method_names, set())
+
+    # --TDDTag: /ClassSpanTests ---
+
+
 class VerifySetupTeardown(TestCase):
     """ Since Python's module import/reference shit is, well, shit """
 
@@ -525,40 +936,67 @@ class ModuleUpdaterTests(TddSettingsRestoreMixin, MockHelperMixin, TestCase):
 
     def test_get_class_lists(self):
         updater = ModuleUpdater(ut_module=self.ut_module)
-        loader = ModuleLoader(anchor_dir=self.anchor_dir)
-        mod = loader.load_module(self.tmp_module_name)
-        self.assertTrue(mod)
+        container = UTModuleContainer(module_path=self.tmp_file)
 
         # --> And test it first with no difference...
-        existing_classes, new_classes = updater._get_class_lists(loaded_module=mod)
+        existing_classes, new_classes = updater._get_class_lists(container=container)
         self.assertFalse(new_classes)
+        self.assertTrue('test_eat_more_chocolate' in existing_classes['ChildSampleTests'].method_names)
 
         # --> Then with a new one
         self.ut_module.add_class(class_name='NewClassTests')
-        existing_classes, new_classes = updater._get_class_lists(loaded_module=mod)
+        existing_classes, new_classes = updater._get_class_lists(container=container)
         self.assertTrue(new_classes)
 
+    def test_get_missing_tests(self):
+        updater = ModuleUpdater(ut_module=self.ut_module)
+        container = UTModuleContainer(module_path=self.tmp_file)
+        self.assertEqual(updater.get_missing_tests(container=container), {})
+
+        self.ut_module.class_list['ChildSampleTests'].add_method('eat_beans')
+        self.ut_module.add_class(class_name='NewClassTests')
+        self.ut_module.class_list['NewClassTests'].add_method('cook')
+        missing = updater.get_missing_tests(container=container)
+        self.assertEqual(missing, {'ChildSampleTests': ['test_eat_beans'], 'NewClassTests': ['test_cook']})
+        self.assertFalse(container.dirty_flag)
+
+    def test_get_orphaned_tests(self):
+        ut_module = UTModuleDetails(module_name='test_tmp')
+        ut_module.add_class(class_name='KeptTests').add_method('tagged')
+        ut_module.add_class(class_name='HandWrittenTests').add_method('new')
+        updater = ModuleUpdater(ut_module=ut_module)
+        container = UTModuleContainer(module_path=self.tmp_file, lines=ORPHAN_TEXT.splitlines(True))
+        self.assertEqual(updater.get_orphaned_tests(container=container), {'KeptTests': ['test_renamed', 'test_written'],
+                                                                           'DroppedTests': ['test_old']})
+        self.assertFalse(container.dirty_flag)
+
+    def test_get_class_lists_broken_imports(self):
+        """Verify a test module that can't be imported is still read"""
+        with open(self.tmp_file, 'a') as f:
+            f.write('\nimport no_such_module_anywhere\n')
+        self.ut_module.class_list['ChildSampleTests'].add_method('eat_beans')
+        updater = ModuleUpdater(ut_module=self.ut_module)
+        tddtags.core.tddtags_config['save'] = False
+        self.assertTrue(updater.update(module_path=self.tmp_file))
+        self.assertTrue(updater.container.dirty_flag)
+        self.assertFalse('no_such_module_anywhere' in sys.modules)
+
     def test_update_verify_path(self):
         with mock.patch('tddtags.core.ModuleUpdater._update_step1', spec=True) as ModCon:
             # --> Prep
             updater = ModuleUpdater(ut_module=self.ut_module)
             updater._update_step1.side_effect = self.return_true
-            loader = ModuleLoader(anchor_dir=self.anchor_dir)
-            mod = loader.load_module(name=self.tmp_module_name)
 
             # --> Test
-            reply = updater.update(loaded_module=mod)
-            parm_info = [('loaded_module', 0), ('module_path', 1)]
+            reply = updater.update(module_path=self.tmp_file)
+            parm_info = [('module_path', 0)]
             kwargs = self.get_patched_call_parms(parm_info, updater._update_step1, 0)
             self.assertTrue(self.tmp_file in kwargs['module_path'])
-            self.assertEqual(kwargs['loaded_module'], mod)
 
     def test_update_no_save(self):
         with mock.patch('tddtags.core.UTModuleContainer.save_module', spec=True) as ModCon:
             # --> Prep
             updater = ModuleUpdater(ut_module=self.ut_module)
-            loader = ModuleLoader(anchor_dir=self.anchor_dir)
-            mod = loader.load_module(name=self.tmp_module_name)
             tddtags.core.tddtags_config['save'] = False
 
             # --> Need something new to do (Remember, this just uses the ut_module setup in setUp())
@@ -566,7 +1004,7 @@ class ModuleUpdaterTests(TddSettingsRestoreMixin, MockHelperMixin, TestCase):
             ut_class.add_method('eat_peanuts')
 
             # --> Test
-            reply = updater.update(loaded_module=mod)
+            reply = updater.update(module_path=self.tmp_file)
             self.assertEqual(updater.container.save_module.call_count, 0)
 
     def test_save_no_container(self):
@@ -679,16 +1117,12 @@ class ModuleUpdaterTests(TddSettingsRestoreMixin, MockHelperMixin, TestCase):
             # --> Prep
             ut_class = self.ut_module.class_list['ChildSampleTests']
             ut_class.add_method('eat_beans')
-            container = None  # We'll also verity that it correctly creates the container and returns it
-            loader = ModuleLoader(anchor_dir=self.anchor_dir)
-            mod = loader.load_module(self.tmp_module_name)
+            container = UTModuleContainer(module_path=self.tmp_file)
             updater = ModuleUpdater(ut_module=self.ut_module)
-            existing_classes, new_names = updater._get_class_lists(loaded_module=mod)
+            existing_classes, new_names = updater._get_class_lists(container=container)
 
             # --> The test
-            container = updater._update_new_methods(container, self.tmp_file, existing_classes)
-            self.assertTrue(container)
-            self.assertIsInstance(container, UTModuleContainer)
+            self.assertEqual(updater._update_new_methods(container, existing_classes), container)
 
             self.assertEqual(updater._add_new_tests_to_class.call_count, 1)
             parm_info = [('container', 0), ('class_name', 1), ('new_test_names', 2)]
@@ -700,15 +1134,13 @@ class ModuleUpdaterTests(TddSettingsRestoreMixin, MockHelperMixin, TestCase):
         with mock.patch('tddtags.core.ModuleUpdater._add_new_tests_to_class', spec=True) as ModUp:
             # --> Prep
             # (Same as test_update_new_methods, but no new test method added)
-            container = None  # We'll also verity that it correctly creates the container and returns it
-            loader = ModuleLoader(anchor_dir=self.anchor_dir)
-            mod = loader.load_module(self.tmp_module_name)
+            container = UTModuleContainer(module_path=self.tmp_file)
             updater = ModuleUpdater(ut_module=self.ut_module)
-            existing_classes, new_names = updater._get_class_lists(loaded_module=mod)
+            existing_classes, new_names = updater._get_class_lists(container=container)
 
             # --> The test
-            container = updater._update_new_methods(container, self.tmp_file, existing_classes)
-            self.assertFalse(container)
+            container = updater._update_new_methods(container, existing_classes)
+            self.assertFalse(container.dirty_flag)
 
             self.assertEqual(updater._add_new_tests_to_class.call_count, 0)
 
@@ -772,10 +1204,47 @@ class GlobalTests(TestCase):
     def tearDown(self):
         pass
 
+    def test_get_stub_lines(self):
+        self.assertEqual(get_stub_lines("self.fail('Test not implemented yet')"), ["self.fail('Test not implemented yet')"])
+        self.assertEqual(get_stub_lines('  x = 1\n\n  self.fail()\n'), ['x = 1', 'self.fail()'])
+
     def test_create_end_class_token(self):
         token = create_end_class_token(class_name='AClass')
         self.assertTrue('/AClass' in token)
 
+    def test_add_tag_record(self):
+        add_tag_record(('a_test_module', 'SomeTests', 'some_method'))
+        add_tag_record(('a_test_module', 'SomeTests', 'other_method'))
+        ut_class = _test_module_details['a_test_module'].class_list['SomeTests']
+        self.assertEqual(ut_class.method_names, ['some_method', 'other_method'])
+        del _test_module_details['a_test_module']
+
+    def test_read_target_list(self):
+        lines = ['tddtags.sample\n', '\n', '# A comment\n', '  tests/p  \n']
+        self.assertEqual(read_target_list(lines), ['tddtags.sample', 'tests/p'])
+
+    def test_expand_targets(self):
+        create_module_loader(anchor_dir=os.getcwd())
+        names = expand_targets(['tddtags.sample', 'tests/p', 'tddtags/sample.py'])
+        self.assertEqual(names, ['tddtags.sample', 'tests.p', 'tests.p.mod'])
+
+    def test_expand_targets_list_file(self):
+        create_module_loader(anchor_dir=os.getcwd())
+        list_path = 'tests/tmp_targets.txt'
+        with open(list_path, 'w') as f:
+            f.write('tests.p.mod\ntddtags.sample\n')
+        try:
+            names = expand_targets(['tddtags.sample', '@' + list_path])
+            self.assertEqual(names, ['tddtags.sample', 'tests.p.mod'])
+        finally:
+            os.remove(list_path)
+
+    def test_get_session(self):
+        session = TDDTagSession()
+        self.assertTrue(get_session(session) is session)
+        self.assertTrue(get_session().test_module_details is _test_module_details)
+        self.assertTrue(get_session().config is tddtags.core.tddtags_config)
+
     # -- TDDTag: /GlobalTests ---
 
 
@@ -811,9 +1280,272 @@ class TDDTagTests(TestCase):
             self.assertEqual(tag.process_referenced_test_modules.call_count, 0)
             self.assertTrue(tag.compiler)
 
+    def test_add_hook(self):
+        from tddtags import hooks
+        events = []
+        tag = tddtags.core.TDDTag()
+        for event in hooks.EVENTS:
+            tag.add_hook(event, lambda event, **details: events.append((event, details)))
+        try:
+            with mock.patch('tddtags.core.TDDTag.process_referenced_test_modules', spec=True):
+                create_module_loader(anchor_dir=os.getcwd())
+                sys.modules.pop('tddtags.sample', None)
+                self.assertTrue(tag.run(source_module_name='tddtags.sample'))
+        finally:
+            tddtags.core._event_hooks.clear()
+
+        loaded = [details for event, details in events if event == hooks.MODULE_LOADED]
+        self.assertEqual(loaded[0]['name'], 'tddtags.sample')
+        self.assertTrue(loaded[0]['seconds'] >= 0)
+        scanned = [details for event, details in events if event == hooks.DOCSTRING_SCANNED]
+        self.assertEqual(scanned[0]['name'], 'tddtags.sample')
+        self.assertTrue(scanned[0]['size'] > 0)
+        tags = [details['value'] for event, details in events if event == hooks.TAG_FOUND]
+        self.assertTrue('outside_function_exception' in tags)
+
+    def test_remove_hook(self):
+        from tddtags import hooks
+        callback = lambda event, **details: None
+        tag = tddtags.core.TDDTag()
+        tag.add_hook(hooks.TAG_FOUND, callback)
+        self.assertTrue(tddtags.core._event_hooks)
+        tag.remove_hook(hooks.TAG_FOUND, callback)
+        self.assertFalse(tddtags.core._event_hooks)
+
+    def test_run_many_modules(self):
+        with mock.patch('tddtags.core.TDDTag.process_referenced_test_modules', spec=True):
+            with mock.patch('tddtags.core.CompileTags.compile', spec=True) as compile_tags:
+                compile_tags.return_value = True
+                create_module_loader(anchor_dir=os.getcwd())
+                tag = tddtags.core.TDDTag()
+                result = tag.run(source_module_name=['tddtags.sample', 'tests.p'])
+                self.assertTrue(result)
+
+                self.assertEqual(compile_tags.call_count, 3)
+                self.assertEqual(tag.process_referenced_test_modules.call_count, 1)
+
+    def snapshot_model(self):
+        return [(key, [(name, list(ut_class.method_names)) for name, ut_class in ut_module.class_list.items()])
+                for key, ut_module in _test_module_details.items()]
+
+    def test_compile_parallel(self):
+        """Verify a parallel compile builds the same model, in the same order, as a serial one"""
+        with mock.patch('tddtags.core.TDDTag.process_referenced_test_modules', spec=True):
+            create_module_loader(anchor_dir=os.getcwd())
+            module_names = ['tddtags.sample', 'tests.p.mod', 'tddtags._core']
+
+            _test_module_details.clear()
+            self.assertTrue(tddtags.core.TDDTag().run(source_module_name=module_names))
+            serial = self.snapshot_model()
+
+            _test_module_details.clear()
+            self.assertTrue(tddtags.core.TDDTag().run(source_module_name=module_names, jobs=2))
+            self.assertEqual(self.snapshot_model(), serial)
+            _test_module_details.clear()
+
+    def test_compile_serial_cached(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            create_module_loader(anchor_dir=os.getcwd())
+            cache = TagCache(cache_dir=cache_dir)
+            cache.put('tddtags.sample', [('test_cached', 'CachedTests', 'from_cache')])
+
+            _test_module_details.clear()
+            with mock.patch('tddtags.core.CompileTags.compile', spec=True) as compile_tags:
+                compiled_cnt = tddtags.core.TDDTag()._compile_serial(module_names=['tddtags.sample'], cache=cache)
+                self.assertEqual(compiled_cnt, 1)
+                self.assertEqual(compile_tags.call_count, 0)
+            self.assertEqual(_test_module_details['test_cached'].class_list['CachedTests'].method_names, ['from_cache'])
+            _test_module_details.clear()
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def create_failing_package(self):
+        """
+        :returns: The anchor dir of a package with good modules, one that raises on import and one that doesn't parse
+        """
+        anchor_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(anchor_dir, 'failpkg'))
+        sources = {
+            '__init__.py': '',
+            'a_good.py': '"""\n:unit_test_module: test_failpkg\n:unit_test_class: GoodTests\n:unit_test: a_good\n"""\n',
+            'bad.py': 'raise RuntimeError("broken on import")\n',
+            'broken.py': 'def foo(:\n',
+            'z_good.py': '"""\n:unit_test_module: test_failpkg\n:unit_test_class: GoodTests\n:unit_test: z_good\n"""\n',
+        }
+        for name, text in sources.items():
+            with open(os.path.join(anchor_dir, 'failpkg', name), 'w') as f:
+                f.write(text)
+        return anchor_dir
+
+    def test_run_failing_modules(self):
+        """Verify a module that fails to import fails on its own, and the run goes on to the rest"""
+        anchor_dir = self.create_failing_package()
+        try:
+            for jobs in (1, 2):
+                session = TDDTagSession(anchor_dir=anchor_dir)
+                with mock.patch('tddtags.core.TDDTag.process_referenced_test_modules', spec=True):
+                    self.assertFalse(tddtags.core.TDDTag(session=session).run(source_module_name=['failpkg'], jobs=jobs))
+                self.assertEqual(session.test_module_details['test_failpkg'].class_list['GoodTests'].method_names,
+                                 ['a_good', 'z_good'])
+        finally:
+            sys.path.remove(anchor_dir)
+            for name in [name for name in sys.modules if name.startswith('failpkg')]:
+                del sys.modules[name]
+            shutil.rmtree(anchor_dir)
+
+    def test_compile_parallel_session(self):
+        session = TDDTagSession(anchor_dir=os.getcwd())
+        with mock.patch('tddtags.core.TDDTag.process_referenced_test_modules', spec=True):
+            self.assertTrue(tddtags.core.TDDTag(session=session).run(source_module_name=['tddtags.sample', 'tests.p.mod'], jobs=2))
+        self.assertTrue('test_sample' in session.test_module_details)
+        self.assertTrue(session.run_stats.counters['tags_found'] > 0)
+        self.assertFalse('test_sample' in _test_module_details)
+
+    def test_run_sources(self):
+        session = TDDTagSession(anchor_dir=os.getcwd())
+        sources = [('tddtags/sample.py', '"""\n:unit_test_module: test_staged\n:unit_test_class: StagedTests\n:unit_test: staged\n"""\n'),
+                   ('tests/p/mod.py', 'def broken(:\n')]
+        with mock.patch('tddtags.core.TDDTag.process_referenced_test_modules', spec=True) as process:
+            self.assertFalse(tddtags.core.TDDTag(session=session).run_sources(sources))
+            self.assertEqual(process.call_count, 1)
+        self.assertEqual(session.test_module_details['test_staged'].class_list['StagedTests'].method_names, ['staged'])
+
+    def test_run_sources_deadline(self):
+        """Verify the sources not reached by the deadline are left out, and don't count as failures"""
+        session = TDDTagSession(anchor_dir=os.getcwd())
+        sources = [('tddtags/sample.py', '"""\n:unit_test: staged\n"""\n')]
+        with mock.patch('tddtags.core.TDDTag.process_referenced_test_modules', spec=True) as process:
+            self.assertTrue(tddtags.core.TDDTag(session=session).run_sources(sources, deadline=1))
+            self.assertEqual(process.call_count, 0)
+        self.assertEqual(session.test_module_details, {})
+
+    def test_compile_serial_checker(self):
+        """Verify the compile stops at the first module with a missing test"""
+        session = TDDTagSession(anchor_dir=os.getcwd())
+        checker = TagChecker(fail_fast=True, session=session)
+        tag = tddtags.core.TDDTag(session=session)
+        self.assertEqual(tag._compile_serial(module_names=['tddtags.sample', 'tests.p.mod'], checker=checker), 1)
+        self.assertEqual(len(checker.missing), 1)
+        self.assertEqual(checker.missing[0][0], 'test_sample')
+
+    def test_run_check(self):
+        """Verify a check lists the missing tests and writes nothing"""
+        session = TDDTagSession(anchor_dir=os.getcwd())
+        checker = TagChecker(session=session)
+        with mock.patch('tddtags.core.TDDTag.process_referenced_test_modules', spec=True) as process:
+            self.assertTrue(tddtags.core.TDDTag(session=session).run(source_module_name=['tddtags.sample'], checker=checker))
+            self.assertEqual(process.call_count, 0)
+        self.assertEqual(checker.missing, [('test_sample', None, None)])
+
     # -- TDDTag: /TDDTagTests ---
 
 
+class TagCacheTests(TddSettingsRestoreMixin, TestCase):
+    def setUp(self):
+        super(TagCacheTests, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.source_path = 'tests/p/tmp_cached.py'
+        shutil.copyfile('tddtags/sample.py', self.source_path)
+        self.records = [('test_sample', 'SampleTests', 'drink_beer')]
+        create_module_loader(anchor_dir=os.getcwd())
+
+    def tearDown(self):
+        super(TagCacheTests, self).tearDown()
+        shutil.rmtree(self.cache_dir)
+        os.remove(self.source_path)
+
+    def test_create_instance(self):
+        cache = TagCache(cache_dir=self.cache_dir)
+        self.assertEqual(cache.cache_dir, self.cache_dir)
+        self.assertFalse(cache.entries)
+
+    def test_create_instance_fingerprint_changed(self):
+        cache = TagCache(cache_dir=self.cache_dir)
+        cache.put('tests.p.tmp_cached', self.records)
+        cache.save()
+        self.assertTrue(TagCache(cache_dir=self.cache_dir).entries)
+
+        tddtags.core.tddtags_config['compile_mode'] = 'static'
+        self.assertFalse(TagCache(cache_dir=self.cache_dir).entries)
+
+    def test_get_fingerprint(self):
+        fingerprint = TagCache.get_fingerprint()
+        self.assertEqual(fingerprint, TagCache.get_fingerprint())
+        tddtags.core.tddtags_config['compile_mode'] = 'static'
+        self.assertNotEqual(fingerprint, TagCache.get_fingerprint())
+
+    def test_get(self):
+        cache = TagCache(cache_dir=self.cache_dir)
+        self.assertIsNone(cache.get('tests.p.tmp_cached'))
+        cache.put('tests.p.tmp_cached', self.records)
+        self.assertEqual(cache.get('tests.p.tmp_cached'), self.records)
+
+    def test_get_changed_source(self):
+        cache = TagCache(cache_dir=self.cache_dir)
+        cache.put('tests.p.tmp_cached', self.records)
+        with open(self.source_path, 'a') as f:
+            f.write('\n# changed\n')
+        self.assertIsNone(cache.get('tests.p.tmp_cached'))
+
+    def test_get_touched_source(self):
+        cache = TagCache(cache_dir=self.cache_dir)
+        cache.put('tests.p.tmp_cached', self.records)
+        cache.save()
+        stat = os.stat(self.source_path)
+        os.utime(self.source_path, (stat.st_atime, stat.st_mtime + 10))
+        self.assertEqual(cache.get('tests.p.tmp_cached'), self.records)
+        self.assertTrue(cache.dirty_flag)
+
+    def test_put(self):
+        cache = TagCache(cache_dir=self.cache_dir)
+        cache.put('tests.p.tmp_cached', self.records)
+        entry = cache.entries['tests.p.tmp_cached']
+        self.assertEqual(entry['path'], os.path.abspath(self.source_path))
+        self.assertEqual(entry['size'], os.path.getsize(self.source_path))
+
+        # --> Nothing to key an unknown module on
+        cache.put('tests.unknown', self.records)
+        self.assertFalse('tests.unknown' in cache.entries)
+
+    def test_save(self):
+        cache = TagCache(cache_dir=self.cache_dir)
+        cache.put('tests.p.tmp_cached', self.records)
+        self.assertTrue(cache.save())
+        self.assertFalse(cache.dirty_flag)
+        self.assertEqual(os.listdir(self.cache_dir), [TagCache.CACHE_FILE_NAME])
+
+        reloaded = TagCache(cache_dir=self.cache_dir)
+        self.assertEqual(reloaded.get('tests.p.tmp_cached'), self.records)
+
+    def test_save_fails(self):
+        """Verify a failed save doesn't leave its temporary file in the cache directory"""
+        cache = TagCache(cache_dir=self.cache_dir)
+        cache.put('tests.p.tmp_cached', self.records)
+        with mock.patch('os.rename', side_effect=OSError('rename failed')):
+            with self.assertRaises(OSError):
+                cache.save()
+        self.assertEqual(os.listdir(self.cache_dir), [])
+        self.assertTrue(cache.dirty_flag)
+
+    # -- TDDTag: /TagCacheTests ---
+
+
+class ImportCostTests(TestCase):
+    def test_create_instance(self):
+        cost = ImportCost(name='a', seconds=1.5, added=4, nested=dict(('m%d' % index, index) for index in range(10)))
+        self.assertEqual((cost.name, cost.seconds, cost.added), ('a', 1.5, 4))
+        self.assertEqual(len(cost.nested), ImportCost.nested_limit)
+        self.assertEqual(cost.nested[0], ('m9', 9))
+
+    def test_to_dict(self):
+        cost = ImportCost(name='a', seconds=1.5, added=4, nested={'b': 0.5})
+        self.assertEqual(cost.to_dict(), {'name': 'a', 'seconds': 1.5, 'added': 4,
+                                          'nested': [{'name': 'b', 'seconds': 0.5}]})
+
+    # -- TDDTag: /ImportCostTests ---
+
+
 class ModuleLoaderTests(TestCase):
     """
     Generated by TDDTag
@@ -860,4 +1592,291 @@ class ModuleLoaderTests(TestCase):
         mod = loader.load_module(name='p.mod')
         self.assertTrue(mod)
 
+    def test_load_module_count_imported(self):
+        session = TDDTagSession(anchor_dir=os.getcwd())
+        sys.modules.pop('tests.p.mod', None)
+        for _ in range(2):
+            self.assertTrue(session.module_loader.load_module(name='tests.p.mod', session=session))
+        self.assertEqual(session.run_stats.counters['modules_imported'], 1)
+
+    def test_find_source(self):
+        loader = ModuleLoader(anchor_dir=os.getcwd())
+        self.assertEqual(loader.find_source('tddtags.sample'), os.path.abspath('tddtags/sample.py'))
+        self.assertEqual(loader.find_source('tests.p'), os.path.abspath('tests/p/__init__.py'))
+
+    def test_find_source_name_unknown(self):
+        loader = ModuleLoader(anchor_dir=os.getcwd())
+        self.assertIsNone(loader.find_source('tests.unknown'))
+
+    def test_find_module_names(self):
+        loader = ModuleLoader(anchor_dir=os.getcwd())
+        self.assertEqual(loader.find_module_names('tddtags.sample'), ['tddtags.sample'])
+        self.assertEqual(loader.find_module_names('tests/p/mod.py'), ['tests.p.mod'])
+        self.assertEqual(loader.find_module_names('tests.unknown'), ['tests.unknown'])
+
+    def test_find_module_names_package(self):
+        loader = ModuleLoader(anchor_dir=os.getcwd())
+        self.assertEqual(loader.find_module_names('tests.p'), ['tests.p', 'tests.p.mod'])
+        self.assertEqual(loader.find_module_names('tests/p'), ['tests.p', 'tests.p.mod'])
+
+    def test_find_module_names_glob(self):
+        loader = ModuleLoader(anchor_dir=os.getcwd())
+        self.assertEqual(loader.find_module_names('tests/p/*.py'), ['tests.p', 'tests.p.mod'])
+
+    def test_find_module_names_excludes(self):
+        loader = ModuleLoader(anchor_dir=os.getcwd())
+        self.assertEqual(loader.find_module_names('tests/p', excludes=['__init__.py']), ['tests.p.mod'])
+        self.assertFalse([name for name in loader.find_module_names('tests', excludes=['p']) if name.startswith('tests.p')])
+
+    def test_module_name_for_path(self):
+        self.assertEqual(ModuleLoader.module_name_for_path('tests/p/mod.py'), 'tests.p.mod')
+        self.assertEqual(ModuleLoader.module_name_for_path('tests/p/__init__.py'), 'tests.p')
+
+    def test_is_excluded(self):
+        self.assertTrue(ModuleLoader.is_excluded('tests/p/mod.py', 'tests', ['mod.py']))
+        self.assertTrue(ModuleLoader.is_excluded('tests/p/mod.py', 'tests', ['p']))
+        self.assertTrue(ModuleLoader.is_excluded('tests/p/mod.py', 'tests', ['p/*.py']))
+        self.assertFalse(ModuleLoader.is_excluded('tests/p/mod.py', 'tests', ['tests', '*.txt']))
+        self.assertFalse(ModuleLoader.is_excluded('tests/p/mod.py', 'tests', []))
+
+    def test_find_source_files(self):
+        paths = ModuleLoader.find_source_files('tests/p')
+        self.assertEqual(paths, ['tests/p/__init__.py', 'tests/p/mod.py'])
+        self.assertEqual(ModuleLoader.find_source_files('tests/p', excludes=['mod.py']), ['tests/p/__init__.py'])
+
+    def test_unload_module(self):
+        loader = ModuleLoader(anchor_dir=os.getcwd())
+        self.assertTrue(loader.load_module(name='tests.p.mod'))
+        loader.unload_module(name='tests.p.mod')
+        self.assertFalse('tests.p.mod' in sys.modules)
+        loader.unload_module(name='tests.p.mod')  # Safe to repeat
+
+    def test_load_module_track_imports(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(tmp_dir, 'costpkg'))
+            for name, text in [('__init__.py', ''), ('top.py', 'from costpkg import middle\n'),
+                               ('middle.py', 'import leaf\n'), ('leaf.py', 'value = 1\n')]:
+                with open(os.path.join(tmp_dir, 'costpkg', name), 'w') as f:
+                    f.write(text)
+
+            loader = ModuleLoader(anchor_dir=tmp_dir)
+            loader.track_imports = True
+            original_import = __builtin__.__import__
+            self.assertTrue(loader.load_module(name='costpkg.top'))
+            self.assertEqual(__builtin__.__import__, original_import)
+            cost = loader.import_costs['costpkg.top']
+            self.assertEqual(cost.added, 4)
+            self.assertTrue(cost.seconds > 0)
+
+            # --> The implicit relative import is reported by its full name
+            nested = dict(cost.nested)
+            self.assertTrue('costpkg.leaf' in nested, cost.nested)
+            self.assertTrue('costpkg.middle' in nested, cost.nested)
+            self.assertFalse('costpkg.top' in nested)
+
+            # --> Already imported modules aren't timed again
+            self.assertTrue(loader.load_module(name='costpkg.top'))
+            self.assertEqual(len(loader.import_costs), 1)
+        finally:
+            for name in [name for name in sys.modules if name.startswith('costpkg')]:
+                del sys.modules[name]
+            sys.path.remove(tmp_dir)
+            shutil.rmtree(tmp_dir)
+
+    def test_get_import_costs(self):
+        loader = ModuleLoader(anchor_dir=os.getcwd())
+        loader.import_costs = dict((name, ImportCost(name=name, seconds=seconds, added=1))
+                                   for name, seconds in [('a', 0.1), ('b', 0.3), ('c', 0.2)])
+        self.assertEqual([cost.name for cost in loader.get_import_costs()], ['b', 'c', 'a'])
+        self.assertEqual([cost.name for cost in loader.get_import_costs(top=2)], ['b', 'c'])
+
+    def test_format_import_report(self):
+        loader = ModuleLoader(anchor_dir=os.getcwd())
+        loader.import_costs = {'a': ImportCost(name='a', seconds=0.5, added=3, nested={'x': 0.25})}
+        lines = loader.format_import_report(top=10)
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith('a '))
+        self.assertTrue('x 0.250' in lines[1])
+
+    def test_find_source_path(self):
+        loader = ModuleLoader(anchor_dir=os.getcwd())
+        self.assertEqual(loader.find_source('tddtags/sample.py'), os.path.abspath('tddtags/sample.py'))
+
     # -- TDDTag: /ModuleLoaderTests ---
+
+
+class FrozenConfigTests(TestCase):
+    def test_create_instance(self):
+        settings = {'verbose': True}
+        config = FrozenConfig(settings)
+        settings['verbose'] = False
+        self.assertEqual(config['verbose'], True)
+        self.assertEqual(dict(config), {'verbose': True})
+        with self.assertRaises(TypeError):
+            config['verbose'] = False
+
+    # -- TDDTag: /FrozenConfigTests ---
+
+
+class TagCheckerTests(TestCase):
+    def setUp(self):
+        self.session = TDDTagSession(anchor_dir=os.getcwd())
+        self.records = [('tests.a_test_sample', 'sampleTests', 'verify_sample'),
+                        ('tests.a_test_sample', 'sampleTests', 'nope'),
+                        ('tests.a_test_sample', 'NoSuchTests', 'first'),
+                        ('tests.a_test_sample', 'NoSuchTests', 'second'),
+                        ('tests.no_such_module', 'XTests', 'x')]
+
+    def test_create_instance(self):
+        checker = TagChecker(fail_fast=True, session=self.session)
+        self.assertTrue(checker.fail_fast)
+        self.assertEqual(checker.missing, [])
+
+    def test_get_test_names(self):
+        checker = TagChecker(session=self.session)
+        names = checker.get_test_names('tests.a_test_sample')
+        self.assertTrue('test_verify_sample' in names['sampleTests'])
+        self.assertTrue(checker.get_test_names('tests.a_test_sample') is names)
+        self.assertEqual(checker.get_test_names('tests.no_such_module'), None)
+
+    def test_check_records(self):
+        checker = TagChecker(session=self.session)
+        self.assertFalse(checker.check_records(self.records[:1]))
+        self.assertTrue(checker.check_records(self.records))
+        self.assertEqual(checker.missing, [('tests.a_test_sample', 'sampleTests', 'test_nope'),
+                                           ('tests.a_test_sample', 'NoSuchTests', None),
+                                           ('tests.no_such_module', None, None)])
+
+    def test_check_records_fail_fast(self):
+        checker = TagChecker(fail_fast=True, session=self.session)
+        self.assertTrue(checker.check_records(self.records))
+        self.assertEqual(checker.missing, [('tests.a_test_sample', 'sampleTests', 'test_nope')])
+        self.assertFalse('tests.no_such_module' in checker._test_names)
+
+    def test_check_model(self):
+        for record in self.records:
+            self.session.add_tag_record(record)
+        checker = TagChecker(session=self.session)
+        self.assertTrue(checker.check_model(self.session.test_module_details))
+        self.assertEqual(checker.missing, [('tests.a_test_sample', 'NoSuchTests', None),
+                                           ('tests.a_test_sample', 'sampleTests', 'test_nope'),
+                                           ('tests.no_such_module', None, None)])
+
+    def test_format_missing(self):
+        checker = TagChecker(session=self.session)
+        checker.check_records(self.records)
+        self.assertEqual(checker.format_missing(), ['tests.a_test_sample.sampleTests.test_nope',
+                                                    'tests.a_test_sample.NoSuchTests (no test class)',
+                                                    'tests.no_such_module (no test module)'])
+
+    # -- TDDTag: /TagCheckerTests ---
+
+
+class OrphanFinderTests(TestCase):
+    def setUp(self):
+        self.tmp_file = 'tests/test_orphans_tmp.py'
+        with open(self.tmp_file, 'w') as f:
+            f.write(ORPHAN_TEXT)
+        self.session = TDDTagSession(anchor_dir=os.getcwd())
+        for record in [('tests.test_orphans_tmp', 'KeptTests', 'tagged'), ('tests.no_such_module', 'XTests', 'x')]:
+            self.session.add_tag_record(record)
+
+    def tearDown(self):
+        os.remove(self.tmp_file)
+
+    def test_create_instance(self):
+        finder = OrphanFinder(remove=True, session=self.session)
+        self.assertTrue(finder.remove)
+        self.assertFalse(finder.fail_fast)
+        self.assertEqual(finder.orphans, [])
+
+    def test_check_model(self):
+        finder = OrphanFinder(session=self.session)
+        self.assertTrue(finder.check_model(self.session.test_module_details))
+        self.assertEqual(finder.orphans, [('tests.test_orphans_tmp', 'DroppedTests', 'test_old', True, False),
+                                          ('tests.test_orphans_tmp', 'KeptTests', 'test_renamed', True, False),
+                                          ('tests.test_orphans_tmp', 'KeptTests', 'test_written', False, False)])
+        self.assertEqual(open(self.tmp_file).read(), ORPHAN_TEXT)
+
+    def test_check_model_remove(self):
+        finder = OrphanFinder(remove=True, session=self.session)
+        self.assertTrue(finder.check_model(self.session.test_module_details))
+        self.assertEqual([orphan[4] for orphan in finder.orphans], [True, True, False])
+        text = open(self.tmp_file).read()
+        self.assertFalse('test_old' in text or 'test_renamed' in text)
+        self.assertTrue('test_written' in text and 'test_after_token' in text and 'test_manual' in text)
+
+        # --> Nothing left to remove the next time, and the written test is kept
+        finder = OrphanFinder(remove=True, session=self.session)
+        finder.check_model(self.session.test_module_details)
+        self.assertEqual(finder.orphans, [('tests.test_orphans_tmp', 'KeptTests', 'test_written', False, False)])
+
+    def test_format_orphans(self):
+        finder = OrphanFinder(remove=True, session=self.session)
+        finder.check_model(self.session.test_module_details)
+        self.assertEqual(finder.format_orphans(), ['tests.test_orphans_tmp.DroppedTests.test_old (stub, removed)',
+                                                   'tests.test_orphans_tmp.KeptTests.test_renamed (stub, removed)',
+                                                   'tests.test_orphans_tmp.KeptTests.test_written (implemented)'])
+        finder = OrphanFinder(session=self.session)
+        finder.orphans = [('tests.test_x', 'XTests', 'test_x', True, False)]
+        self.assertEqual(finder.format_orphans(), ['tests.test_x.XTests.test_x (stub)'])
+
+    # -- TDDTag: /OrphanFinderTests ---
+
+
+class TDDTagSessionTests(TestCase):
+    def test_create_instance(self):
+        session = TDDTagSession(anchor_dir='tests')
+        self.assertEqual(session.module_loader.anchor_dir, os.path.abspath('tests'))
+        self.assertEqual(session.test_module_details, {})
+        self.assertFalse(session.event_hooks)
+        self.assertTrue(session.formatter.config is session.config)
+
+    def test_create_instance_config(self):
+        session = TDDTagSession(config={'verbose': True, 'test_method_body': 'pass'})
+        self.assertEqual(session.config['verbose'], True)
+        self.assertEqual(session.config['save'], tddtags.core.tddtags_config['save'])
+        self.assertEqual(tddtags.core.tddtags_config['test_method_body'], "self.fail('Test not implemented yet')")
+
+    def test_add_tag_record(self):
+        session = TDDTagSession()
+        session.add_tag_record(('a_test_module', 'SomeTests', 'some_method'))
+        self.assertEqual(session.test_module_details['a_test_module'].class_list['SomeTests'].method_names, ['some_method'])
+        self.assertFalse('a_test_module' in _test_module_details)
+
+    def test_memory_checkpoint(self):
+        from tddtags.stats import MemoryProfiler
+        session = TDDTagSession()
+        self.assertEqual(session.memory_checkpoint('compile', model={}), None)
+        session.memory_profiler = MemoryProfiler()
+        checkpoint = session.memory_checkpoint('compile', model=['x' * 1000])
+        self.assertTrue(checkpoint['retained']['model'] > 1000)
+
+    def test_reset(self):
+        session = TDDTagSession()
+        session.add_tag_record(('a_test_module', 'SomeTests', 'some_method'))
+        session.run_stats.count('tags_found')
+        session.reset()
+        self.assertEqual(session.test_module_details, {})
+        self.assertEqual(session.run_stats.counters['tags_found'], 0)
+
+    def test_sessions_isolated(self):
+        """Verify two sessions compiling in the same process keep their own models, stats and hooks"""
+        from tddtags import hooks
+        first = TDDTagSession(anchor_dir=os.getcwd())
+        second = TDDTagSession(anchor_dir=os.getcwd(), config={'compile_mode': CompileTags.MODE_STATIC})
+        found = []
+        first.event_hooks.add(hooks.TAG_FOUND, lambda event, **details: found.append(details['value']))
+
+        self.assertTrue(CompileTags(source_module_name='tddtags.sample', session=first).compile())
+        self.assertTrue(CompileTags(source_module_name='tests.p.mod', session=second).compile())
+
+        self.assertTrue('test_sample' in first.test_module_details)
+        self.assertFalse('test_sample' in second.test_module_details)
+        self.assertTrue(found)
+        self.assertEqual(first.run_stats.counters['tags_found'], len(found))
+        self.assertNotEqual(second.run_stats.counters['tags_found'], first.run_stats.counters['tags_found'])
+        self.assertFalse('test_sample' in _test_module_details)
+
+    # -- TDDTag: /TDDTagSessionTests ---
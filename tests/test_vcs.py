@@ -0,0 +1,113 @@
+"""
+test_vcs.py
+----------------------------------
+
+Tests for the `tddtags.vcs` module.
+"""
+import os
+import tempfile
+from unittest import TestCase
+
+from tddtags.vcs import GitError, run_git, get_top_dir, get_staged_files, get_changed_files, get_changed_lines, \
+    read_staged
+from tests.helpers import TempDirMixin
+
+
+class GitRepoMixin(TempDirMixin):
+    def setUp(self):
+        super(GitRepoMixin, self).setUp()
+        run_git(['init', '-q'], cwd=self.top_dir)
+
+    def write(self, name, text, stage=True):
+        path = super(GitRepoMixin, self).write(name, text)
+        if stage:
+            run_git(['add', name], cwd=self.top_dir)
+        return path
+
+    def commit(self, message='commit'):
+        run_git(['-c', 'user.name=tddtags', '-c', 'user.email=tddtags@example.com', 'commit', '-q', '-m', message],
+                cwd=self.top_dir)
+
+
+class VcsGlobalTests(GitRepoMixin, TestCase):
+    def test_run_git(self):
+        self.assertEqual(run_git(['rev-parse', '--is-inside-work-tree'], cwd=self.top_dir), 'true\n')
+
+    def test_run_git_error(self):
+        with self.assertRaises(GitError):
+            run_git(['no-such-command'], cwd=self.top_dir)
+
+    def test_get_top_dir(self):
+        os.mkdir(os.path.join(self.top_dir, 'pkg'))
+        self.assertEqual(get_top_dir(os.path.join(self.top_dir, 'pkg')), self.top_dir)
+        with self.assertRaises(GitError):
+            get_top_dir(tempfile.gettempdir())
+
+    def test_get_staged_files(self):
+        first = self.write('pkg/a.py', 'a = 1\n')
+        self.write('notes.txt', 'notes\n')
+        self.write('b.py', 'b = 1\n', stage=False)
+        self.assertEqual(get_staged_files(self.top_dir), [first])
+        self.assertEqual(get_staged_files(self.top_dir, suffix=None),
+                         [os.path.join(self.top_dir, 'notes.txt'), first])
+
+    def test_get_changed_files(self):
+        """Verify the changes since the merge base are listed, committed or not, by their new names"""
+        self.write('a.py', 'a = 1\n')
+        self.write('b.py', 'b = 1\n')
+        self.write('c.py', 'c = 1\n')
+        self.commit()
+        run_git(['branch', 'base'], cwd=self.top_dir)
+
+        self.write('a.py', 'a = 2\n')
+        run_git(['mv', 'b.py', 'pkg.py'], cwd=self.top_dir)
+        run_git(['rm', '-q', 'c.py'], cwd=self.top_dir)
+        self.commit()
+        d = self.write('d.py', 'd = 1\n')
+        self.write('a.py', 'a = 3\n', stage=False)
+        self.write('e.py', 'e = 1\n', stage=False)
+
+        self.assertEqual(get_changed_files(self.top_dir, 'base'),
+                         [os.path.join(self.top_dir, 'a.py'), d, os.path.join(self.top_dir, 'pkg.py')])
+        self.assertEqual(get_changed_files(self.top_dir, 'HEAD'), [os.path.join(self.top_dir, 'a.py'), d])
+
+    def test_get_changed_files_bad_ref(self):
+        self.write('a.py', 'a = 1\n')
+        self.commit()
+        with self.assertRaises(GitError):
+            get_changed_files(self.top_dir, 'no-such-branch')
+
+    def test_get_changed_lines(self):
+        self.write('a.py', ''.join('line %d\n' % n for n in range(1, 11)))
+        self.write('notes.txt', 'notes\n')
+        self.commit()
+
+        self.write('a.py', 'line 1\n+++ b/x.py\nline 3\n' + ''.join('line %d\n' % n for n in range(4, 11)) + 'line 11\nline 12',
+                   stage=False)
+        self.write('notes.txt', 'changed\n', stage=False)
+        b = self.write('b.py', 'b = 1\n')
+        self.assertEqual(get_changed_lines(self.top_dir, 'HEAD'), {os.path.join(self.top_dir, 'a.py'): set([2, 11, 12]),
+                                                                   b: set([1])})
+
+    def test_get_changed_lines_removed(self):
+        """Verify the lines either side of a removal count as changed"""
+        self.write('a.py', 'a = 1\nb = 2\nc = 3\n')
+        self.commit()
+        self.write('a.py', 'a = 1\nc = 3\n', stage=False)
+        self.assertEqual(get_changed_lines(self.top_dir, 'HEAD'), {os.path.join(self.top_dir, 'a.py'): set([1, 2])})
+
+    def test_read_staged(self):
+        """Verify the staged content is read, not the working tree's"""
+        first = self.write('pkg/a.py', 'a = 1\n')
+        second = self.write('b.py', '')
+        self.write('pkg/a.py', 'a = 2\n', stage=False)
+        self.assertEqual(read_staged([first, 'b.py'], self.top_dir), {first: 'a = 1\n', 'b.py': ''})
+        self.assertEqual(read_staged([], self.top_dir), {})
+        self.assertTrue(second)
+
+    def test_read_staged_missing(self):
+        first = self.write('a.py', 'a = 1\n')
+        missing = self.write('b.py', 'b = 1\n', stage=False)
+        self.assertEqual(read_staged([missing, first], self.top_dir), {first: 'a = 1\n'})
+
+    # -- TDDTag: /VcsGlobalTests ---
@@ -0,0 +1,179 @@
+"""
+test_watch.py
+----------------------------------
+
+Tests for the `tddtags.watch` module.
+"""
+import os
+import sys
+import time
+from unittest import TestCase, skipUnless
+import mock
+
+import tddtags.core
+from tddtags.core import create_module_loader
+from tddtags.watch import PollingWatcher, InotifyWatcher, TagWatcher, create_watcher
+from tests.helpers import TempDirMixin
+
+SOURCE_TEXT = '''"""
+:unit_test_module: w_test
+:unit_test_class: WTests
+"""
+
+
+def foo():
+    """
+    :unit_test: foo
+    """
+'''
+
+TEST_TEXT = '''from unittest import TestCase
+
+
+class WTests(TestCase):
+    def test_bar(self):
+        pass
+
+    # -- TDDTag: /WTests ---
+'''
+
+
+class WatchDirMixin(TempDirMixin):
+    def setUp(self):
+        super(WatchDirMixin, self).setUp()
+        self.source_path = os.path.join(self.top_dir, 'w_src.py')
+        self.test_path = os.path.join(self.top_dir, 'w_test.py')
+        self.write(self.source_path, SOURCE_TEXT)
+        self.write(self.test_path, TEST_TEXT)
+
+
+class PollingWatcherTests(WatchDirMixin, TestCase):
+    """
+    Generated by TDDTag
+    """
+    def test_create_instance(self):
+        watcher = PollingWatcher(top_dir=self.top_dir, interval=0.01)
+        self.assertEqual(sorted(watcher.mtimes), sorted([self.source_path, self.test_path]))
+
+    def test_snapshot(self):
+        watcher = PollingWatcher(top_dir=self.top_dir, excludes=['w_test.py'])
+        self.assertEqual(list(watcher.snapshot()), [self.source_path])
+
+    def test_poll(self):
+        watcher = PollingWatcher(top_dir=self.top_dir)
+        self.assertFalse(watcher.poll())
+        self.write(self.source_path, SOURCE_TEXT + '\n', mtime_offset=10)
+        self.assertEqual(watcher.poll(), set([self.source_path]))
+        self.assertFalse(watcher.poll())
+
+    def test_wait_timeout(self):
+        watcher = PollingWatcher(top_dir=self.top_dir, interval=0.01)
+        self.assertEqual(watcher.wait(timeout=0.02), set())
+
+    # -- TDDTag: /PollingWatcherTests ---
+
+
+@skipUnless(InotifyWatcher.get_libc(), 'inotify is not available')
+class InotifyWatcherTests(WatchDirMixin, TestCase):
+    """
+    Generated by TDDTag
+    """
+    def test_create_instance(self):
+        watcher = InotifyWatcher(top_dir=self.top_dir)
+        try:
+            self.assertEqual(list(watcher.watch_dirs.values()), [self.top_dir])
+        finally:
+            watcher.close()
+
+    def test_get_libc(self):
+        self.assertTrue(InotifyWatcher.get_libc())
+
+    def test_read_events(self):
+        watcher = InotifyWatcher(top_dir=self.top_dir)
+        try:
+            self.write(self.source_path, SOURCE_TEXT)
+            os.mkdir(os.path.join(self.top_dir, 'sub'))
+            changed = watcher.wait(timeout=1)
+            self.assertEqual(changed, set([self.source_path]))
+
+            # --> The new directory is picked up as well
+            sub_path = os.path.join(self.top_dir, 'sub', 'new.py')
+            self.write(sub_path, '')
+            self.assertEqual(watcher.wait(timeout=1), set([sub_path]))
+        finally:
+            watcher.close()
+
+    def test_wait_timeout(self):
+        watcher = InotifyWatcher(top_dir=self.top_dir)
+        try:
+            self.assertEqual(watcher.wait(timeout=0.01), set())
+        finally:
+            watcher.close()
+
+    # -- TDDTag: /InotifyWatcherTests ---
+
+
+class TagWatcherTests(WatchDirMixin, TestCase):
+    """
+    Generated by TDDTag
+    """
+    def setUp(self):
+        super(TagWatcherTests, self).setUp()
+        create_module_loader(anchor_dir=self.top_dir)
+        self.tag_watcher = TagWatcher(watcher=PollingWatcher(top_dir=self.top_dir, interval=0.01), debounce=0.01)
+
+    def tearDown(self):
+        super(TagWatcherTests, self).tearDown()
+        for name in ['w_src', 'w_test']:
+            sys.modules.pop(name, None)
+        tddtags.core._test_module_details.clear()
+
+    def test_create_instance(self):
+        self.assertEqual(self.tag_watcher.debounce, 0.01)
+        self.assertFalse(self.tag_watcher.written)
+
+    def test_collect_changes(self):
+        with mock.patch.object(self.tag_watcher.watcher, 'wait', spec=True) as wait:
+            wait.side_effect = [set(['a.py']), set(['b.py']), set()]
+            self.assertEqual(self.tag_watcher.collect_changes(), set(['a.py', 'b.py']))
+            self.assertEqual(wait.call_count, 3)
+
+    def test_order_changes(self):
+        self.write(self.test_path, TEST_TEXT, mtime_offset=10)
+        missing_path = os.path.join(self.top_dir, 'gone.py')
+        ordered = self.tag_watcher.order_changes([self.source_path, self.test_path, missing_path])
+        self.assertEqual(ordered, [self.test_path, self.source_path])
+
+    def test_order_changes_skips_written(self):
+        self.tag_watcher.written[self.test_path] = os.stat(self.test_path).st_mtime
+        self.assertEqual(self.tag_watcher.order_changes([self.source_path, self.test_path]), [self.source_path])
+
+    def test_update(self):
+        self.assertEqual(self.tag_watcher.update([self.source_path]), 1)
+        with open(self.test_path) as f:
+            text = f.read()
+        self.assertTrue('def test_foo(self):' in text)
+        self.assertTrue('def test_bar(self):' in text)
+
+        # --> Our own save of the test module is ignored
+        self.assertEqual(self.tag_watcher.order_changes([self.test_path]), [])
+
+    # -- TDDTag: /TagWatcherTests ---
+
+
+class WatchGlobalTests(WatchDirMixin, TestCase):
+    """
+    Generated by TDDTag
+    """
+    def test_create_watcher(self):
+        watcher = create_watcher(top_dir=self.top_dir, poll=True)
+        self.assertIsInstance(watcher, PollingWatcher)
+
+        watcher = create_watcher(top_dir=self.top_dir)
+        try:
+            expected = InotifyWatcher if InotifyWatcher.get_libc() else PollingWatcher
+            self.assertIsInstance(watcher, expected)
+        finally:
+            watcher.close()
+
+    # -- TDDTag: /WatchGlobalTests ---